@@ -16,13 +16,25 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 from graphql_crm.schema import schema
+from crm.views import (
+    AsyncCRMGraphQLView, CRMGraphQLView, export_view, graphql_cache_stats,
+    healthz, import_view, metrics_view, readyz,
+)
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql', csrf_exempt(GraphQLView.as_view(
-        graphiql=True, schema=schema)))
+    path('graphql', csrf_exempt(CRMGraphQLView.as_view(
+        graphiql=True, schema=schema))),
+    # the same endpoint for ASGI servers (see crm.views)
+    path('graphql/async', csrf_exempt(AsyncCRMGraphQLView.as_view(
+        graphiql=True, schema=schema))),
+    path('graphql/cache-stats', graphql_cache_stats),
+    path('import/<str:kind>', import_view),
+    path('export/<str:kind>', export_view),
+    path('metrics', metrics_view),
+    path('healthz', healthz),
+    path('readyz', readyz),
 ]
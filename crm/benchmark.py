@@ -0,0 +1,195 @@
+import itertools
+import json
+import math
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from graphql_crm.schema import schema
+
+from .models import Customer, Product
+
+ORDERS_PAGE = '''
+query ($first: Int) {
+  allOrders(first: $first, orderBy: "-orderDate") {
+    edges {
+      node {
+        id
+        orderDate
+        totalAmount
+        customer { name email }
+        products { name price }
+      }
+    }
+  }
+}
+'''
+
+FILTERED_CUSTOMERS = '''
+query {
+  allCustomers(first: 50, name: "ada", orderBy: "name") {
+    edges { node { id name email phone } }
+  }
+}
+'''
+
+ALL_REVENUE = '{ allRevenue }'
+
+CREATE_ORDER = '''
+mutation ($customerId: ID!, $productIds: [ID]!) {
+  createOrder(customerId: $customerId, productIds: $productIds) {
+    success
+    order { id totalAmount }
+  }
+}
+'''
+
+BULK_CREATE_CUSTOMERS = '''
+mutation ($customers: [JSONString]!) {
+  bulkCreateCustomers(customers: $customers) {
+    errors
+  }
+}
+'''
+
+
+def order_variables():
+    customer_id = Customer.objects.values_list('id', flat=True).first()
+    product_ids = list(Product.objects.values_list('id', flat=True)[:3])
+    return lambda run: {'customerId': customer_id, 'productIds': product_ids}
+
+
+def customer_batch(size):
+    # every call must create new customers, across transports too
+    batches = itertools.count()
+
+    def variables(run):
+        batch = next(batches)
+        return {'customers': [
+            json.dumps({'name': f'Bench {batch}-{i}',
+                        'email': f'bench{size}.{batch}.{i}@example.com',
+                        'phone': '+2348012345678'})
+            for i in range(size)
+        ]}
+    return variables
+
+
+def operations():
+    """``(name, document, variables(run), iterations factor)`` for every
+    benchmarked operation; large imports run fewer iterations."""
+    return [
+        ('allOrders page 20', ORDERS_PAGE, lambda run: {'first': 20}, 1),
+        ('allOrders page 100', ORDERS_PAGE, lambda run: {'first': 100}, 1),
+        ('filtered allCustomers', FILTERED_CUSTOMERS, lambda run: None, 1),
+        ('allRevenue', ALL_REVENUE, lambda run: None, 1),
+        ('createOrder', CREATE_ORDER, order_variables(), 1),
+        ('bulkCreateCustomers 1k', BULK_CREATE_CUSTOMERS,
+         customer_batch(1000), 0.2),
+        ('bulkCreateCustomers 10k', BULK_CREATE_CUSTOMERS,
+         customer_batch(10000), 0.05),
+    ]
+
+
+class Request:
+    """Stand-in for the HttpRequest GraphQLView passes as context."""
+
+
+def execute_in_process(document, variables):
+    result = schema.execute(document, variables=variables,
+                            context_value=Request())
+    if result.errors:
+        raise RuntimeError(result.errors[0])
+
+
+def http_executor():
+    client = Client()
+
+    def execute(document, variables):
+        response = client.post(
+            '/graphql', {'query': document, 'variables': variables},
+            content_type='application/json')
+        errors = response.json().get('errors')
+        if response.status_code != 200 or errors:
+            raise RuntimeError(errors or response.status_code)
+    return execute
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def measure(execute, document, variables, iterations, warmup=2):
+    """Run one operation ``iterations`` times and summarize latency (ms),
+    SQL queries per operation and allocations of one traced run."""
+    run = 0
+    for _ in range(warmup):
+        execute(document, variables(run))
+        run += 1
+
+    latencies = []
+    queries = []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            execute(document, variables(run))
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(len(ctx.captured_queries))
+        run += 1
+
+    # allocation tracing slows execution down, so it gets its own run
+    tracemalloc.start()
+    execute(document, variables(run))
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in
+                 tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': statistics.fmean(latencies),
+        'queries': statistics.fmean(queries),
+        'peak_alloc_kib': peak / 1024,
+        'retained_blocks': blocks,
+    }
+
+
+def run_suite(iterations, transports=('in-process', 'http'), only=None,
+              log=print):
+    executors = {'in-process': execute_in_process, 'http': http_executor()}
+    results = {}
+    for name, document, variables, factor in operations():
+        if only and name not in only:
+            continue
+        for transport in transports:
+            count = max(int(iterations * factor), 3)
+            stats = measure(executors[transport], document, variables, count)
+            results.setdefault(name, {})[transport] = stats
+            log(f"{name} [{transport}]: p50 {stats['p50_ms']:.2f} ms, "
+                f"p95 {stats['p95_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+                f"{stats['queries']:.1f} queries, "
+                f"peak {stats['peak_alloc_kib']:.0f} KiB")
+    return results
+
+
+def compare(results, baseline, log=print):
+    """Print how ``results`` moved against a previously saved run."""
+    for name, transports in results.items():
+        for transport, stats in transports.items():
+            before = baseline.get('results', {}).get(name, {}).get(transport)
+            if not before:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'queries', 'peak_alloc_kib'):
+                if before[key]:
+                    delta = (stats[key] - before[key]) / before[key] * 100
+                    changes.append(f'{key} {delta:+.1f}%')
+            log(f"{name} [{transport}]: {', '.join(changes)}")
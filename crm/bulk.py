@@ -0,0 +1,398 @@
+import csv
+import json
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Customer, Order, OrderItem, Product
+from .pubsub import orders_created, stock_changed
+from .response_cache import invalidate_on_commit
+from .revenue import record_orders
+
+PHONE_RE = re.compile(r'^(\+\d{10,15}|\d{3}-\d{3}-\d{4}|\d{10,15})$')
+
+DEFAULT_BATCH_SIZE = 1000
+# the most rows one chunk holds in memory, whatever a client asks for
+MAX_BATCH_SIZE = 10000
+
+LOW_STOCK_THRESHOLD = 10
+RESTOCK_INCREMENT = 10
+
+# only the first errors of a streamed import are kept in its report
+MAX_REPORTED_ERRORS = 100
+
+
+def get_batch_size(batch_size=None):
+    if batch_size:
+        return min(batch_size, getattr(settings, 'CRM_BULK_MAX_BATCH_SIZE',
+                                       MAX_BATCH_SIZE))
+    return getattr(settings, 'CRM_BULK_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def clean_error(instance):
+    """The field errors of ``instance`` as one string, or None.
+
+    Catches what the database would only reject by failing the whole
+    insert of a chunk (lengths, formats, digits); uniqueness is checked
+    per chunk.
+    """
+    try:
+        instance.full_clean(validate_unique=False, validate_constraints=False)
+    except ValidationError as e:
+        return '; '.join(f'{field}: {messages[0]}'
+                         for field, messages in e.message_dict.items())
+    return None
+
+
+def validate_customer(data):
+    """Return a ``(Customer, error)`` pair for one input record."""
+    if not isinstance(data, dict):
+        return None, 'Invalid record.'
+    name = data.get('name')
+    email = data.get('email')
+    phone = data.get('phone') or None
+    if not name or not email:
+        return None, 'Missing required fields.'
+    if phone and not PHONE_RE.match(phone):
+        return None, 'invalid phone format'
+    customer = Customer(name=name, email=email, phone=phone)
+    error = clean_error(customer)
+    if error:
+        return None, error
+    return customer, None
+
+
+def create_customer_chunk(chunk):
+    """Validate and insert one chunk of ``(index, record)`` pairs.
+
+    Existing emails are looked up with a single ``email__in`` query and the
+    valid rows are written with one ``bulk_create``. Rows of earlier chunks
+    are already inserted, so the lookup also catches duplicates across
+    chunks of the same import.
+    """
+    errors = []
+    seen_emails = set()
+    candidates = []
+    for idx, data in chunk:
+        customer, error = validate_customer(data)
+        if error:
+            errors.append((idx, error))
+        elif customer.email in seen_emails:
+            errors.append((idx, 'Email already exist'))
+        else:
+            seen_emails.add(customer.email)
+            candidates.append((idx, customer))
+
+    existing = set(Customer.objects.filter(
+        email__in=[customer.email for _, customer in candidates],
+    ).values_list('email', flat=True))
+
+    created = []
+    for idx, customer in candidates:
+        if customer.email in existing:
+            errors.append((idx, 'Email already exist'))
+        else:
+            created.append(customer)
+    Customer.objects.bulk_create(created, batch_size=len(created) or None)
+    # bulk_create sends no signals, so drop cached responses here
+    if created:
+        invalidate_on_commit('customer')
+    return created, errors
+
+
+def bulk_create_customers(records, batch_size=None):
+    """Create customers from ``records`` in chunks of ``batch_size``.
+
+    Invalid and duplicate records are reported as ``'Record n : reason'``
+    strings and skipped; they never stop the rest of the batch.
+    """
+    batch_size = get_batch_size(batch_size)
+    created = []
+    errors = []
+    with transaction.atomic():
+        for chunk in chunked(enumerate(records), batch_size):
+            chunk_created, chunk_errors = create_customer_chunk(chunk)
+            created.extend(chunk_created)
+            errors.extend(chunk_errors)
+    errors.sort()
+    return created, [f'Record {idx + 1} : {error}' for idx, error in errors]
+
+
+def restock_low_stock(threshold=LOW_STOCK_THRESHOLD,
+                      increment=RESTOCK_INCREMENT):
+    """Add ``increment`` to the stock of every product below ``threshold``.
+
+    The low-stock rows are read (and locked where the backend supports it)
+    once, then restocked with a single ``UPDATE ... SET stock = stock + n``
+    of their pks; their new stock is known without re-reading.
+    """
+    with transaction.atomic():
+        low_stock = Product.objects.select_for_update().filter(
+            stock__lt=threshold)
+        products = list(low_stock.order_by('pk'))
+        if products:
+            # exactly the rows read, not whatever is low by now
+            Product.objects.filter(pk__in=[p.pk for p in products]).update(
+                stock=F('stock') + increment)
+            invalidate_on_commit('product')
+        previous = {product.pk: product.stock for product in products}
+        for product in products:
+            product.stock += increment
+        stock_changed(products, previous)
+    return products
+
+
+def validate_product(data):
+    """Return a ``(Product, error)`` pair for one input record."""
+    if not isinstance(data, dict):
+        return None, 'Invalid record.'
+    name = data.get('name')
+    if not name:
+        return None, 'Missing required fields.'
+    try:
+        price = Decimal(str(data.get('price')))
+        stock = int(data.get('stock') or 0)
+    except (InvalidOperation, TypeError, ValueError):
+        return None, 'Invalid price or stock.'
+    if not price.is_finite():
+        return None, 'Invalid price or stock.'
+    if price < 0:
+        return None, 'Price must be positive'
+    if stock < 0:
+        return None, 'Stock must be positive'
+    product = Product(name=name, price=price, stock=stock)
+    error = clean_error(product)
+    if error:
+        return None, error
+    return product, None
+
+
+def mark_reminded(order_ids):
+    """Stamp the orders not reminded yet with one UPDATE; returns how
+    many were marked."""
+    marked = Order.objects.filter(
+        pk__in=order_ids, reminded_at__isnull=True,
+    ).update(reminded_at=timezone.now())
+    if marked:
+        invalidate_on_commit('order')
+    return marked
+
+
+def create_product_chunk(chunk):
+    errors = []
+    created = []
+    for idx, data in chunk:
+        product, error = validate_product(data)
+        if error:
+            errors.append((idx, error))
+        else:
+            created.append(product)
+    Product.objects.bulk_create(created)
+    if created:
+        invalidate_on_commit('product')
+    return created, errors
+
+
+def parse_product_ids(value):
+    """The product ids of an order and how often each is listed (its
+    quantity)."""
+    # NDJSON sends a list, CSV a "1;2;3" cell
+    if isinstance(value, str):
+        value = [part for part in re.split(r'[;\s]+', value) if part]
+    return Counter(int(pk) for pk in value or [])
+
+
+def line_items(quantities, prices):
+    """Unsaved ``OrderItem`` rows for ``quantities`` by product id, at the
+    ``prices`` captured now."""
+    return [
+        OrderItem(product_id=pk, quantity=quantity, unit_price=prices[pk],
+                  line_total=prices[pk] * quantity)
+        for pk, quantity in quantities.items()
+    ]
+
+
+def save_line_items(orders, items):
+    """Write the ``items`` of each of the saved ``orders`` with one
+    ``bulk_create``."""
+    rows = []
+    for order, order_items in zip(orders, items):
+        for item in order_items:
+            item.order_id = order.pk
+            rows.append(item)
+    OrderItem.objects.bulk_create(rows)
+    # bulk_create sends no m2m_changed; the link is visible from both sides
+    if rows:
+        invalidate_on_commit('order', 'product')
+
+
+def parse_order_date(value):
+    """An ISO string or a datetime as an aware datetime; None stays None
+    and anything else, e.g. a number from NDJSON, raises ValueError."""
+    if isinstance(value, str):
+        # raises ValueError itself for well-formed but impossible dates
+        value = parse_datetime(value)
+        if value is None:
+            raise ValueError('invalid order_date')
+    elif value is not None and not isinstance(value, datetime):
+        raise ValueError('invalid order_date')
+    if value and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def create_order_chunk(chunk):
+    """Validate and insert one chunk of order records.
+
+    Customers and products referenced anywhere in the chunk are fetched with
+    one query each; orders and their ``OrderItem`` rows are written with one
+    ``bulk_create`` each. A product listed n times is ordered n times.
+    """
+    errors = []
+    parsed = []
+    for idx, data in chunk:
+        try:
+            customer_id = int(data['customer_id'])
+            product_ids = parse_product_ids(data.get('product_ids'))
+        except (KeyError, TypeError, ValueError):
+            errors.append((idx, 'Invalid customer_id or product_ids.'))
+            continue
+        if not product_ids:
+            errors.append((idx, 'one product must be selected'))
+            continue
+        try:
+            order_date = parse_order_date(data.get('order_date') or None)
+        except ValueError:
+            errors.append((idx, 'Invalid order_date.'))
+            continue
+        parsed.append((idx, customer_id, product_ids, order_date))
+
+    customers = Customer.objects.in_bulk(
+        {customer_id for _, customer_id, _, _ in parsed})
+    prices = dict(Product.objects.filter(
+        id__in={pk for _, _, ids, _ in parsed for pk in ids},
+    ).values_list('id', 'price'))
+
+    orders = []
+    order_items = []
+    for idx, customer_id, product_ids, order_date in parsed:
+        if customer_id not in customers:
+            errors.append((idx, 'invalid customer_id'))
+            continue
+        if any(pk not in prices for pk in product_ids):
+            errors.append((idx, 'One or more product IDs are invalid.'))
+            continue
+        items = line_items(product_ids, prices)
+        orders.append(Order(
+            customer_id=customer_id,
+            order_date=order_date or timezone.now(),
+            total_amount=sum(item.line_total for item in items)))
+        order_items.append(items)
+
+    Order.objects.bulk_create(orders)
+    # bulk_create sends no signals, so update the summaries and drop cached
+    # responses here
+    record_orders(orders)
+    if orders:
+        invalidate_on_commit('order')
+    orders_created(orders)
+    save_line_items(orders, order_items)
+    return orders, errors
+
+
+def bulk_create_orders(records):
+    """Create every order in ``records`` in one transaction.
+
+    All referenced customers and products are resolved with one query each
+    and orders plus their line items are written with ``bulk_create``.
+    """
+    with transaction.atomic():
+        orders, errors = create_order_chunk(list(enumerate(records)))
+    return orders, [f'Record {idx + 1} : {error}'
+                    for idx, error in sorted(errors)]
+
+
+def iter_records(lines, fmt):
+    """Lazily parse NDJSON or CSV ``lines`` (bytes or str) into dicts."""
+    lines = (line.decode('utf-8') if isinstance(line, bytes) else line
+             for line in lines)
+    if fmt == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # reported as an invalid record by the validators
+            yield None
+
+
+IMPORTERS = {
+    'customers': create_customer_chunk,
+    'products': create_product_chunk,
+    'orders': create_order_chunk,
+}
+
+
+def import_records(kind, records, batch_size=None, on_chunk=None):
+    """Stream ``records`` into the ``kind`` table chunk by chunk.
+
+    Each chunk is validated and written in its own transaction, so memory
+    stays bounded by ``batch_size`` and a failing chunk does not roll back
+    the ones before it. ``on_chunk`` is called with the progress of every
+    committed chunk; the returned report covers the whole import.
+    """
+    importer = IMPORTERS[kind]
+    batch_size = get_batch_size(batch_size)
+    report = {'kind': kind, 'created': 0, 'failed': 0, 'chunks': 0,
+              'errors': []}
+    started = time.monotonic()
+    for chunk in chunked(enumerate(records), batch_size):
+        chunk_started = time.monotonic()
+        with transaction.atomic():
+            created, errors = importer(chunk)
+        elapsed = time.monotonic() - chunk_started
+
+        report['chunks'] += 1
+        report['created'] += len(created)
+        report['failed'] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(report['errors'])
+        report['errors'].extend(
+            f'Record {idx + 1} : {error}' for idx, error in sorted(errors)[:room])
+        if on_chunk:
+            on_chunk({
+                'chunk': report['chunks'],
+                'created': len(created),
+                'failed': len(errors),
+                'seconds': elapsed,
+                'rows_per_second': len(chunk) / elapsed if elapsed else None,
+            })
+
+    report['seconds'] = time.monotonic() - started
+    total = report['created'] + report['failed']
+    report['rows_per_second'] = (
+        total / report['seconds'] if report['seconds'] else None)
+    return report
@@ -1,12 +1,40 @@
 import os
 from celery import Celery
+from kombu import Queue
 
 # Set default Django settings module for 'celery' program
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crm.settings')
 
+# One queue per kind of workload, so long report shards and bulk imports
+# never sit in front of short notifications; each is served by its own
+# worker profile (see crm/workers.py).
+QUEUES = ('default', 'reports', 'notifications', 'bulk')
+
+TASK_ROUTES = {
+    'crm.tasks.generate_crm_report': {'queue': 'reports'},
+    'crm.tasks.compute_report_shard': {'queue': 'reports'},
+    'crm.tasks.assemble_crm_report': {'queue': 'reports'},
+    'crm.tasks.deliver_crm_report': {'queue': 'notifications'},
+    'crm.tasks.bulk_*': {'queue': 'bulk'},
+}
+
 # Create Celery app instance
 app = Celery('crm')
 
+# Defaults of the CRM workloads; CELERY_* Django settings override them.
+app.add_defaults({
+    'task_queues': tuple(Queue(name, routing_key=name) for name in QUEUES),
+    'task_default_queue': 'default',
+    'task_routes': TASK_ROUTES,
+    # a worker holds no more tasks than it runs; the profiles raise it
+    # for short tasks
+    'worker_prefetch_multiplier': 1,
+    # results are only read by the report chord
+    'result_expires': 6 * 3600,
+    # seconds a task acked late may run before Redis hands it out again
+    'broker_transport_options': {'visibility_timeout': 2 * 3600},
+})
+
 # Load settings from Django settings file using CELERY namespace
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
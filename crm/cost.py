@@ -0,0 +1,192 @@
+"""Depth, cost and page-size limits for GraphQL operations.
+
+Every object field costs one, multiplied by the page size of each list or
+connection it is nested in: ``allCustomers(first: 50) { edges { node {
+orders(first: 20) { ... } } } }`` costs 1 + 50 * (1 + 20 * ...). Pages
+without ``first``/``last`` count at the connection's maximum page size and
+plain lists at ``DEFAULT_LIST_SIZE``. A batched request may hold at most
+``MAX_BATCH_SIZE`` operations whose costs add up to ``MAX_BATCH_COST``.
+The limits are read from the ``CRM_QUERY_LIMITS`` setting.
+"""
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FragmentDefinitionNode, GraphQLError, GraphQLList, OperationType,
+    get_named_type, get_nullable_type, is_abstract_type, is_leaf_type,
+)
+from graphql.execution.collect_fields import (
+    collect_fields, collect_sub_fields,
+)
+from graphql.execution.values import get_argument_values, get_variable_values
+
+# weight of a single root mutation field, before its selection
+MUTATION_COST = 10
+
+
+def get_limits():
+    limits = {
+        'MAX_DEPTH': 10,
+        'MAX_COST': 5000,
+        'MAX_PAGE_SIZE': graphene_settings.RELAY_CONNECTION_MAX_LIMIT,
+        'DEFAULT_LIST_SIZE': 20,
+        'MAX_BATCH_SIZE': 10,
+        'MAX_BATCH_COST': 10000,
+    }
+    limits.update(getattr(settings, 'CRM_QUERY_LIMITS', {}))
+    return limits
+
+
+class QueryCost:
+    def __init__(self, limits):
+        self.limits = limits
+        self.cost = 0
+        self.depth = 0
+        self.errors = []
+
+    def as_dict(self):
+        return {
+            'requestedQueryCost': self.cost,
+            'maximumAvailable': self.limits['MAX_COST'],
+            'depth': self.depth,
+            'maximumDepth': self.limits['MAX_DEPTH'],
+        }
+
+
+def _is_connection(gql_type):
+    fields = getattr(gql_type, 'fields', {})
+    return 'edges' in fields and 'pageInfo' in fields
+
+
+def _page_size(field_def, node, variables, gql_type, report):
+    try:
+        args = get_argument_values(field_def, node, variables)
+    except GraphQLError:
+        # invalid arguments are reported by execution
+        args = {}
+    limits = report.limits
+    for name in ('first', 'last'):
+        size = args.get(name)
+        if size is not None and size > limits['MAX_PAGE_SIZE']:
+            report.errors.append(GraphQLError(
+                f'Requesting {size} records on `{node.name.value}` exceeds '
+                f"the maximum page size of {limits['MAX_PAGE_SIZE']}.",
+                node, extensions={'code': 'PAGE_SIZE_EXCEEDED'}))
+    size = args.get('first') or args.get('last')
+    if _is_connection(gql_type):
+        return min(size or limits['MAX_PAGE_SIZE'], limits['MAX_PAGE_SIZE'])
+    return size or limits['DEFAULT_LIST_SIZE']
+
+
+def _selection_cost(info, gql_type, field_nodes, depth, report):
+    """Cost of the selection of ``field_nodes`` on ``gql_type``; abstract
+    types cost as much as their most expensive possible type."""
+    types = (info['schema'].get_possible_types(gql_type)
+             if is_abstract_type(gql_type) else [gql_type])
+    return max((_object_cost(info, possible, field_nodes, depth, report)
+                for possible in types), default=0)
+
+
+def _object_cost(info, gql_type, field_nodes, depth, report):
+    fields = collect_sub_fields(info['schema'], info['fragments'],
+                                info['variables'], gql_type, field_nodes)
+    return _fields_cost(info, gql_type, fields, depth, report)
+
+
+def _fields_cost(info, gql_type, fields, depth, report):
+    total = 0
+    for nodes in fields.values():
+        name = nodes[0].name.value
+        if name.startswith('__'):
+            continue
+        total += _field_cost(info, gql_type.fields[name], nodes, depth + 1,
+                             report)
+    return total
+
+
+def _field_cost(info, field_def, nodes, depth, report):
+    report.depth = max(report.depth, depth)
+    field_type = get_nullable_type(field_def.type)
+    named_type = get_named_type(field_type)
+    if is_leaf_type(named_type):
+        return 0
+
+    multiplier = 1
+    if _is_connection(named_type) or isinstance(field_type, GraphQLList):
+        multiplier = _page_size(field_def, nodes[0], info['variables'],
+                                named_type, report)
+    if _is_connection(named_type):
+        # a page of nodes, wrapped in edges { node { ... } }
+        per_node, rest = _connection_cost(info, named_type, nodes, depth,
+                                          report)
+        return 1 + multiplier * per_node + rest
+    return 1 + multiplier * _selection_cost(info, named_type, nodes, depth,
+                                            report)
+
+
+def _connection_cost(info, connection_type, nodes, depth, report):
+    """``(per-node cost, cost of the rest)`` of a connection selection;
+    ``totalCount`` and ``pageInfo`` are fetched once, not per node."""
+    fields = collect_sub_fields(info['schema'], info['fragments'],
+                                info['variables'], connection_type, nodes)
+    edge_type = get_named_type(connection_type.fields['edges'].type)
+    node_type = get_named_type(edge_type.fields['node'].type)
+    per_node = 0
+    rest = 0
+    for field_nodes in fields.values():
+        name = field_nodes[0].name.value
+        if name.startswith('__'):
+            continue
+        if name != 'edges':
+            rest += _field_cost(info, connection_type.fields[name],
+                                field_nodes, depth + 1, report)
+            continue
+        report.depth = max(report.depth, depth + 1)
+        edge_fields = collect_sub_fields(info['schema'], info['fragments'],
+                                         info['variables'], edge_type,
+                                         field_nodes)
+        for node_nodes in edge_fields.values():
+            if node_nodes[0].name.value == 'node':
+                report.depth = max(report.depth, depth + 2)
+                per_node += _selection_cost(info, node_type, node_nodes,
+                                            depth + 2, report)
+    return per_node, rest
+
+
+def analyze_cost(schema, document, operation, raw_variables):
+    """Return the ``QueryCost`` of running ``operation`` of ``document``.
+
+    Its ``errors`` list the limits the operation exceeds. Operations with
+    invalid variables are not analysed; execution reports those.
+    """
+    report = QueryCost(get_limits())
+    variables = get_variable_values(
+        schema, operation.variable_definitions or (), raw_variables or {})
+    if isinstance(variables, list):
+        return report
+    info = {
+        'schema': schema,
+        'variables': variables,
+        'fragments': {definition.name.value: definition
+                      for definition in document.definitions
+                      if isinstance(definition, FragmentDefinitionNode)},
+    }
+    root_type = schema.get_root_type(operation.operation)
+    fields = collect_fields(schema, info['fragments'], variables, root_type,
+                            operation.selection_set)
+    report.cost = _fields_cost(info, root_type, fields, 0, report)
+    if operation.operation == OperationType.MUTATION:
+        report.cost += MUTATION_COST * len(operation.selection_set.selections)
+
+    limits = report.limits
+    if report.depth > limits['MAX_DEPTH']:
+        report.errors.append(GraphQLError(
+            f"Query depth {report.depth} exceeds the maximum depth of "
+            f"{limits['MAX_DEPTH']}.", operation,
+            extensions={'code': 'QUERY_TOO_DEEP'}))
+    if report.cost > limits['MAX_COST']:
+        report.errors.append(GraphQLError(
+            f"Query cost {report.cost} exceeds the maximum cost of "
+            f"{limits['MAX_COST']}.", operation,
+            extensions={'code': 'QUERY_TOO_COMPLEX'}))
+    return report
+
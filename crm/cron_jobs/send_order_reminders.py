@@ -1,14 +1,45 @@
+"""Send a reminder for every order of the last week not reminded yet.
+
+A fetcher walks the orders with keyset cursors, one page of ``PAGE_SIZE``
+at a time, and hands the pages through a bounded queue to ``SENDERS``
+concurrent workers, so at most ``QUEUE_SIZE`` pages wait in memory. The
+workers share a limit of ``RATE`` reminders per second, retry failing
+calls with backoff, write each page's log lines at once and then mark the
+page's orders reminded (``markOrdersReminded``). Reminded orders are not
+fetched again, so an interrupted or repeated run picks up where the last
+one stopped.
+"""
 import asyncio
+import os
 from datetime import datetime, timedelta, UTC
+
+from aiohttp import ClientError
 from gql import gql, Client
 from gql.transport.aiohttp import AIOHTTPTransport
+from gql.transport.exceptions import TransportError
 
-GRAPHQL_ENDPOINT = "http://localhost:8000/graphql"
+GRAPHQL_ENDPOINT = os.environ.get(
+    "CRM_GRAPHQL_ENDPOINT", "http://localhost:8000/graphql")
 LOG_FILE = "/tmp/order_reminders_log.txt"
 
-QUERY = gql("""
-query GetRecentPendingOrders($fromDate: Date!) {
-  allOrders(orderDateGte: $fromDate) {
+PAGE_SIZE = 100
+QUEUE_SIZE = 4
+SENDERS = 4
+# reminders per second, across all senders
+RATE = 50
+MAX_ATTEMPTS = 5
+# seconds before the first retry; doubled for every further one
+RETRY_DELAY = 0.5
+# seconds a single GraphQL request may take
+TIMEOUT = 30
+
+RETRYABLE = (OSError, asyncio.TimeoutError, ClientError, TransportError)
+
+ORDERS_QUERY = """
+query GetRecentPendingOrders($fromDate: Date!, $first: Int!,
+                             $after: String) {
+  allOrders(orderDateGte: $fromDate, reminded: false, keyset: true,
+            first: $first, after: $after) {
     edges {
       node {
         id
@@ -18,34 +49,135 @@ query GetRecentPendingOrders($fromDate: Date!) {
         orderDate
       }
     }
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+  }
+}
+"""
+
+MARK_REMINDED = """
+mutation MarkOrdersReminded($ids: [ID]!) {
+  markOrdersReminded(orderIds: $ids) {
+    marked
   }
 }
-""")
+"""
+
+
+class RateLimiter:
+    """Spaces the calls to ``wait()`` at least ``1 / rate`` seconds apart."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def with_retry(call, *args):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await call(*args)
+        except RETRYABLE:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+async def send_reminder(order):
+    # the reminder itself is the log line
+    return (
+        f"{datetime.now().isoformat()} | "
+        f"Order ID: {order['id']} | "
+        f"Email: {order['customer']['email']}\n"
+    )
+
+
+async def fetch_pages(execute, from_date, queue):
+    after = None
+    while True:
+        result = await with_retry(execute, ORDERS_QUERY, {
+            "fromDate": from_date, "first": PAGE_SIZE, "after": after})
+        connection = result["allOrders"]
+        orders = [edge["node"] for edge in connection["edges"]]
+        if orders:
+            await queue.put(orders)
+        if not connection["pageInfo"]["hasNextPage"]:
+            return
+        after = connection["pageInfo"]["endCursor"]
+
+
+async def send_pages(execute, queue, limiter, log, stats):
+    while True:
+        orders = await queue.get()
+        try:
+            lines = []
+            for order in orders:
+                await limiter.wait()
+                lines.append(await with_retry(send_reminder, order))
+            log.write("".join(lines))
+            log.flush()
+            result = await with_retry(execute, MARK_REMINDED, {
+                "ids": [order["id"] for order in orders]})
+            stats["reminded"] += result["markOrdersReminded"]["marked"]
+        except Exception as e:
+            # left unmarked, so the next run tries these orders again; the
+            # worker lives on, so the fetcher never blocks on a full queue
+            stats["failed"] += len(orders)
+            stats["errors"].append(str(e))
+        finally:
+            queue.task_done()
+
+
+async def remind(execute, from_date, log):
+    """Remind every unreminded order since ``from_date``; ``execute(query,
+    variables)`` runs a GraphQL operation and returns its data."""
+    stats = {"reminded": 0, "failed": 0, "errors": []}
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    limiter = RateLimiter(RATE)
+    senders = [
+        asyncio.create_task(send_pages(execute, queue, limiter, log, stats))
+        for _ in range(SENDERS)
+    ]
+    try:
+        await fetch_pages(execute, from_date, queue)
+        await queue.join()
+    finally:
+        for sender in senders:
+            sender.cancel()
+        await asyncio.gather(*senders, return_exceptions=True)
+    return stats
 
 
 async def main():
     last_week = datetime.now(UTC) - timedelta(days=7)
     from_date = last_week.date().isoformat()
-    transport = AIOHTTPTransport(url=GRAPHQL_ENDPOINT)
+    documents = {query: gql(query) for query in (ORDERS_QUERY, MARK_REMINDED)}
+    transport = AIOHTTPTransport(url=GRAPHQL_ENDPOINT, timeout=TIMEOUT)
     async with Client(
         transport=transport,
-        fetch_schema_from_transport=True
+        fetch_schema_from_transport=False,
+        execute_timeout=TIMEOUT,
     ) as session:
-        result = await session.execute(
-            QUERY,
-            variable_values={"fromDate": from_date}
-        )
-        orders = result.get("allOrders", {}).get("edges", [])
-        with open(LOG_FILE, "a") as f:
-            for edge in orders:
-                order = edge["node"]
-                log_line = (
-                    f"{datetime.now().isoformat()} | "
-                    f"Order ID: {order['id']} | "
-                    f"Email: {order['customer']['email']}\n"
-                )
-                f.write(log_line)
-    print("Order reminders processed!")
+        async def execute(query, variables):
+            return await session.execute(
+                documents[query], variable_values=variables)
+
+        with open(LOG_FILE, "a") as log:
+            stats = await remind(execute, from_date, log)
+    print(f"Order reminders processed! {stats['reminded']} reminded, "
+          f"{stats['failed']} to retry on the next run")
+
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,172 @@
+"""Streaming exports of customers, products and orders.
+
+The export side of ``crm.bulk``: rows are filtered with the same filter
+sets as the GraphQL connections, read with ``iterator(chunk_size=...)``
+(a server-side cursor on PostgreSQL) and written as CSV or NDJSON, usually
+gzip-compressed, one chunk at a time. An order's customer is joined and its
+products are prefetched once per chunk, so memory stays bounded by the
+chunk size however many rows are exported.
+"""
+import csv
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .filters import CustomerFilter, OrderFilter, ProductFilter
+from .models import Customer, Order, Product
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# compressed output is handed on once this many bytes are buffered
+FLUSH_SIZE = 64 * 1024
+
+# separates the product ids and names of an order in a CSV cell
+LIST_SEPARATOR = '|'
+
+
+def get_chunk_size(chunk_size=None):
+    if chunk_size:
+        return chunk_size
+    return getattr(settings, 'CRM_EXPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def customer_rows(queryset):
+    for customer in queryset:
+        yield {
+            'id': customer.pk,
+            'name': customer.name,
+            'email': customer.email,
+            'phone': customer.phone,
+            'created_at': customer.created_at,
+        }
+
+
+def product_rows(queryset):
+    for product in queryset:
+        yield {
+            'id': product.pk,
+            'name': product.name,
+            'price': product.price,
+            'stock': product.stock,
+        }
+
+
+def order_rows(queryset):
+    for order in queryset:
+        products = order.products.all()
+        yield {
+            'id': order.pk,
+            'order_date': order.order_date,
+            'total_amount': order.total_amount,
+            'customer_id': order.customer_id,
+            'customer_name': order.customer.name,
+            'customer_email': order.customer.email,
+            'product_ids': [product.pk for product in products],
+            'product_names': [product.name for product in products],
+        }
+
+
+def order_queryset():
+    # the customer is joined; the products of each chunk of orders are
+    # fetched with one prefetch query
+    return Order.objects.select_related('customer').prefetch_related(
+        Prefetch('products',
+                 queryset=Product.objects.only('id', 'name').order_by('id')))
+
+
+class Exporter:
+    def __init__(self, get_queryset, filterset_class, columns, rows):
+        self.get_queryset = get_queryset
+        self.filterset_class = filterset_class
+        self.columns = columns
+        self.rows = rows
+
+
+EXPORTERS = {
+    'customers': Exporter(
+        Customer.objects.all, CustomerFilter,
+        ['id', 'name', 'email', 'phone', 'created_at'], customer_rows),
+    'products': Exporter(
+        Product.objects.all, ProductFilter,
+        ['id', 'name', 'price', 'stock'], product_rows),
+    'orders': Exporter(
+        order_queryset, OrderFilter,
+        ['id', 'order_date', 'total_amount', 'customer_id', 'customer_name',
+         'customer_email', 'product_ids', 'product_names'], order_rows),
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_queryset(kind, filters=None):
+    """The ``kind`` rows matching ``filters``, the arguments of the
+    GraphQL connection (e.g. ``{'total_amount_gte': '100'}``)."""
+    exporter = EXPORTERS[kind]
+    filterset = exporter.filterset_class(
+        filters or {}, queryset=exporter.get_queryset())
+    if not filterset.is_valid():
+        raise ExportError('; '.join(
+            f'{name}: {" ".join(errors)}'
+            for name, errors in filterset.errors.items()))
+    queryset = filterset.qs
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+    return queryset
+
+
+class _Line:
+    """File-like target for ``csv.writer`` that returns what it gets."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([
+            LIST_SEPARATOR.join(map(str, row[column]))
+            if isinstance(row[column], list) else row[column]
+            for column in columns])
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def gzip_chunks(lines):
+    """Compress ``lines`` into a gzip stream, in pieces of about
+    ``FLUSH_SIZE`` bytes."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    buffered = []
+    size = 0
+    for line in lines:
+        data = compressor.compress(line.encode('utf-8'))
+        if data:
+            buffered.append(data)
+            size += len(data)
+            if size >= FLUSH_SIZE:
+                yield b''.join(buffered)
+                buffered = []
+                size = 0
+    buffered.append(compressor.flush())
+    yield b''.join(buffered)
+
+
+def export_lines(kind, fmt, filters=None, chunk_size=None):
+    """Lazily render the ``kind`` rows matching ``filters`` as CSV or
+    NDJSON lines."""
+    exporter = EXPORTERS[kind]
+    queryset = export_queryset(kind, filters)
+    rows = exporter.rows(queryset.iterator(chunk_size=get_chunk_size(
+        chunk_size)))
+    if fmt == 'csv':
+        return _csv_lines(exporter.columns, rows)
+    return _ndjson_lines(rows)
@@ -0,0 +1,64 @@
+import graphene
+from django.db.models import QuerySet
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from promise import Promise
+
+from .optimizer import prefetched_list
+from .pagination import resolve_keyset_connection
+
+
+class BatchedConnectionField(DjangoFilterConnectionField):
+    """DjangoFilterConnectionField that hands each resolved page to the
+    node type's ``prime_loaders`` hook, so relations of every node on the
+    page are fetched in one batch instead of once per edge.
+
+    With ``keyset: true`` pages are cut with a seek predicate on the
+    ordering columns instead of ``OFFSET``, and nothing is counted unless
+    ``totalCount`` is selected.
+    """
+
+    def __init__(self, type_, *args, **kwargs):
+        kwargs.setdefault('keyset', graphene.Boolean(
+            description='Paginate with keyset cursors instead of offsets.'))
+        super().__init__(type_, *args, **kwargs)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        iterable = maybe_queryset(iterable)
+        if args.get('keyset') and isinstance(iterable, QuerySet):
+            return resolve_keyset_connection(
+                connection, args, iterable, max_limit=max_limit)
+        return super().resolve_connection(
+            connection, args, iterable, max_limit=max_limit)
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args,
+                         filtering_args, filterset_class):
+        # nested connections prefetched by the optimizer are already
+        # filtered; re-filtering would clone the queryset and drop them
+        prefetched = prefetched_list(iterable)
+        if prefetched is not None:
+            return prefetched
+        return super().resolve_queryset(
+            connection, iterable, info, args, filtering_args,
+            filterset_class)
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager,
+                            queryset_resolver, max_limit,
+                            enforce_first_or_last, root, info, **args):
+        resolved = super().connection_resolver(
+            resolver, connection, default_manager, queryset_resolver,
+            max_limit, enforce_first_or_last, root, info, **args)
+
+        def prime(conn):
+            node_type = connection._meta.node
+            if hasattr(node_type, 'prime_loaders'):
+                node_type.prime_loaders(
+                    info, [edge.node for edge in conn.edges])
+            return conn
+
+        if Promise.is_thenable(resolved):
+            return Promise.resolve(resolved).then(prime)
+        return prime(resolved)
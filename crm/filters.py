@@ -1,5 +1,11 @@
 import django_filters
-from .models import Customer, Product, Order
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from .models import Customer, Order, OrderItem, Product
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
 
 
 # django filter to name, email to Case-insensitive and partial matching
@@ -14,6 +20,13 @@ class CustomerFilter(django_filters.FilterSet):
     created_at__lte = django_filters.DateTimeFilter(
         field_name='created_at', lookup_expr='lte')
     phone_pattern = django_filters.CharFilter(method='filter_phone_pattern')
+    order_by = django_filters.OrderingFilter(
+        fields=(
+            ('name', 'name'),
+            ('email', 'email'),
+            ('created_at', 'created_at'),
+        )
+    )
 
     def filter_phone_pattern(self, querryset, name, value):
         # Example: value = '+1' to match numbers starting with +1
@@ -46,7 +59,7 @@ class ProductFilter(django_filters.FilterSet):
         )
     )
 
-    def filter_low_stock(self, name, queryset, value):
+    def filter_low_stock(self, queryset, name, value):
         if value:
             return queryset.filter(stock__lt=10)
         return queryset
@@ -64,24 +77,44 @@ class OrderFilter(django_filters.FilterSet):
     total_amount_gte = django_filters.NumberFilter(
         field_name='total_amount', lookup_expr='gte'
     )
-    order_date_lte = django_filters.DateFilter(
-        field_name='order_date', lookup_expr='lte'
-    )
-    order_date_gte = django_filters.DateFilter(
-        field_name='order_date', lookup_expr='gte'
-    )
+    order_date_lte = django_filters.DateFilter(method='filter_order_date_lte')
+    order_date_gte = django_filters.DateFilter(method='filter_order_date_gte')
     customer_name = django_filters.CharFilter(
         field_name='customer__name', lookup_expr='icontains'
     )
-    product_name = django_filters.CharFilter(
-        field_name='products__name', lookup_expr='icontains'
-    )
+    product_name = django_filters.CharFilter(method='filter_product_name')
 
     product_id = django_filters.NumberFilter(method='filter_product_id')
+    reminded = django_filters.BooleanFilter(method='filter_reminded')
+    order_by = django_filters.OrderingFilter(
+        fields=(
+            ('order_date', 'order_date'),
+            ('total_amount', 'total_amount'),
+            ('customer__name', 'customer_name'),
+        )
+    )
+
+    # compare the raw column with day boundaries (instead of order_date__date)
+    # so the order_date index can serve the range
+    def filter_order_date_gte(self, queryset, name, value):
+        return queryset.filter(order_date__gte=start_of_day(value))
+
+    def filter_order_date_lte(self, queryset, name, value):
+        return queryset.filter(
+            order_date__lt=start_of_day(value + timedelta(days=1)))
+
+    # a subquery, not a join: an order with two matching products must
+    # still come back once
+    def filter_product_name(self, queryset, name, value):
+        return queryset.filter(pk__in=OrderItem.objects.filter(
+            product__name__icontains=value).values('order_id'))
 
     def filter_product_id(self, queryset, name, value):
         return queryset.filter(products__id=value)
 
+    def filter_reminded(self, queryset, name, value):
+        return queryset.filter(reminded_at__isnull=not value)
+
     class Meta:
         model = Order
         fields = []
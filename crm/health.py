@@ -0,0 +1,179 @@
+"""Liveness and readiness checks behind ``/healthz``, ``/readyz`` and the
+heartbeat cron job.
+
+The GraphQL check executes a probe document, parsed and validated once,
+in-process against the project schema. The database and broker checks run
+in a small thread pool and fail once they take longer than their timeout,
+so a hung dependency cannot hang the probe. The latencies of each check's
+last ``WINDOW`` runs are kept as a rolling histogram. Configured with
+``CRM_HEALTH``.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils.module_loading import import_string
+from graphql import execute, parse, validate
+
+from .celery import app as celery_app
+
+LIVENESS = ('graphql',)
+READINESS = ('graphql', 'database', 'broker')
+
+# upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='crm-health')
+
+
+def get_config():
+    config = {
+        'PROBE': 'query HealthProbe { __typename }',
+        # seconds
+        'DATABASE_TIMEOUT': 1.0,
+        'BROKER_TIMEOUT': 1.0,
+        # runs per check kept for the latency histograms
+        'WINDOW': 500,
+        'CHECKS': {
+            'graphql': 'crm.health.check_graphql',
+            'database': 'crm.health.check_database',
+            'broker': 'crm.health.check_broker',
+        },
+    }
+    config.update(getattr(settings, 'CRM_HEALTH', {}))
+    return config
+
+
+@lru_cache(maxsize=8)
+def probe_document(source):
+    from graphql_crm.schema import schema
+
+    document = parse(source)
+    errors = validate(schema.graphql_schema, document)
+    if errors:
+        raise ValueError(f'invalid health probe: {errors[0].message}')
+    return schema.graphql_schema, document
+
+
+def _with_timeout(func, timeout):
+    def call():
+        try:
+            return func()
+        finally:
+            close_old_connections()
+
+    future = _executor.submit(call)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        future.cancel()
+        raise TimeoutError(f'no answer within {timeout}s') from None
+
+
+def check_graphql(config):
+    schema, document = probe_document(config['PROBE'])
+    result = execute(schema, document)
+    if result.errors:
+        raise RuntimeError(result.errors[0].message)
+
+
+def check_database(config):
+    def ping():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+
+    _with_timeout(ping, config['DATABASE_TIMEOUT'])
+
+
+def check_broker(config):
+    timeout = config['BROKER_TIMEOUT']
+
+    def ping():
+        with celery_app.connection_for_read(connect_timeout=timeout) as conn:
+            conn.ensure_connection(max_retries=1, interval_start=0,
+                                   interval_step=0, timeout=timeout)
+
+    _with_timeout(ping, timeout)
+
+
+class LatencyHistogram:
+    """The latencies of a check's last ``size`` runs."""
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, ms):
+        with self._lock:
+            self._samples.append(ms)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {'count': 0}
+
+        def quantile(q):
+            return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+        # cumulative, like Prometheus' "le" buckets
+        buckets = {str(bound): bisect_right(samples, bound)
+                   for bound in BUCKETS_MS}
+        buckets['+Inf'] = len(samples)
+        return {
+            'count': len(samples),
+            'p50_ms': quantile(0.5),
+            'p95_ms': quantile(0.95),
+            'p99_ms': quantile(0.99),
+            'max_ms': samples[-1],
+            'buckets': buckets,
+        }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name, size):
+    with _histograms_lock:
+        if name not in _histograms:
+            _histograms[name] = LatencyHistogram(size)
+        return _histograms[name]
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def run_check(name, config):
+    started = time.perf_counter()
+    try:
+        import_string(config['CHECKS'][name])(config)
+        error = None
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    latency_ms = round((time.perf_counter() - started) * 1000, 3)
+    histogram(name, config['WINDOW']).record(latency_ms)
+    result = {'ok': error is None, 'latency_ms': latency_ms}
+    if error is not None:
+        result['error'] = error
+    return result
+
+
+def run_checks(names):
+    """Run the checks ``names``; the payload of the health endpoints."""
+    config = get_config()
+    checks = {name: run_check(name, config) for name in names}
+    return {
+        'status': 'ok' if all(c['ok'] for c in checks.values()) else 'fail',
+        'checks': checks,
+        'latency': {name: histogram(name, config['WINDOW']).snapshot()
+                    for name in names},
+    }
@@ -0,0 +1,110 @@
+"""Bulk mutations run as background jobs.
+
+``bulkCreateCustomers`` and ``bulkCreateOrders`` called with
+``background: true`` store their records in a ``BulkJob`` and return it
+at once; ``crm.tasks.bulk_import_job`` then imports the records chunk by
+chunk with the streaming importers of ``crm.bulk``. Each chunk commits
+together with the job's progress, so a job redelivered after its worker
+died resumes after the last committed chunk. The ``job(id)`` query reads
+the progress, the counts and the first ``MAX_REPORTED_ERRORS`` errors.
+
+A run first claims its job with a conditional UPDATE. A job whose claim
+heartbeated within ``CRM_BULK_JOB_LEASE`` seconds is being imported, so
+a copy of its task delivered meanwhile (e.g. once the broker's
+visibility timeout ran out) does nothing; a run that stopped heartbeating
+is taken over. Every chunk locks the job row and re-reads its progress
+under the claim, so a run that lost its claim stops before importing
+anything twice.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .bulk import IMPORTERS, MAX_REPORTED_ERRORS, get_batch_size
+from .models import BulkJob
+
+# seconds a claimed job goes without committing a chunk before another
+# run may take it over; well above the time one chunk takes
+DEFAULT_LEASE = 300
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'CRM_BULK_JOB_LEASE',
+                                     DEFAULT_LEASE))
+
+
+def create_job(kind, records):
+    return BulkJob.objects.create(kind=kind, records=records,
+                                  total=len(records))
+
+
+def claim_job(job_id):
+    """Claim job ``job_id`` for a new run; returns the claim, or None when
+    the job is finished or another run holds a live claim."""
+    claim = uuid.uuid4()
+    now = timezone.now()
+    claimed = BulkJob.objects.filter(
+        Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=now - get_lease()),
+        pk=job_id, status__in=[BulkJob.PENDING, BulkJob.RUNNING],
+    ).update(status=BulkJob.RUNNING, claim=claim, heartbeat_at=now)
+    if not claimed:
+        return None
+    BulkJob.objects.filter(pk=job_id, started_at__isnull=True).update(
+        started_at=now)
+    return claim
+
+
+def _finish(job_id, claim, status, error=''):
+    # the input is not needed any more
+    BulkJob.objects.filter(pk=job_id, claim=claim).update(
+        status=status, error=error, finished_at=timezone.now(),
+        records=None, claim=None)
+
+
+def import_records(job_id, claim, batch_size=None):
+    """Import the records of job ``job_id`` left after its last chunk for
+    as long as ``claim`` holds it; returns whether the job finished."""
+    records = BulkJob.objects.values_list('records', flat=True).get(
+        pk=job_id)
+    size = get_batch_size(batch_size)
+    while True:
+        with transaction.atomic():
+            job = (BulkJob.objects.select_for_update().defer('records')
+                   .filter(pk=job_id, claim=claim).first())
+            if job is None:
+                # taken over by another run
+                return False
+            chunk = list(enumerate(records[job.processed:][:size],
+                                   start=job.processed))
+            if not chunk:
+                break
+            created, errors = IMPORTERS[job.kind](chunk)
+            job.processed += len(chunk)
+            job.created += len(created)
+            job.failed += len(errors)
+            room = MAX_REPORTED_ERRORS - len(job.errors)
+            job.errors.extend(f'Record {idx + 1} : {error}'
+                              for idx, error in sorted(errors)[:room])
+            job.heartbeat_at = timezone.now()
+            job.save(update_fields=['processed', 'created', 'failed',
+                                    'errors', 'heartbeat_at'])
+    _finish(job_id, claim, BulkJob.SUCCEEDED)
+    return True
+
+
+def run_job(job_id, batch_size=None):
+    """Claim job ``job_id`` and import what is left of it; finished jobs
+    and jobs another run is importing are left alone."""
+    claim = claim_job(job_id)
+    if claim is None:
+        return BulkJob.objects.filter(pk=job_id).first()
+    try:
+        import_records(job_id, claim, batch_size)
+    except Exception as e:
+        _finish(job_id, claim, BulkJob.FAILED, str(e) or type(e).__name__)
+        raise
+    return BulkJob.objects.filter(pk=job_id).first()
@@ -0,0 +1,105 @@
+import threading
+from collections import defaultdict
+
+from .models import Customer, Order
+
+
+class DataLoader:
+    """Synchronous, per-request batch loader.
+
+    Keys are queued with ``want()`` (usually for every node on a page) and
+    fetched together by ``batch_load_fn`` the first time any of them is
+    ``load()``-ed. A key that was never queued is fetched in its own batch,
+    so a loader is always correct, just not always batched.
+
+    Operations that run concurrently in one request (see
+    ``crm.views.AsyncCRMGraphQLView``) share their loaders, so a loader
+    may be used from several threads at once.
+    """
+
+    def __init__(self, batch_load_fn):
+        self.batch_load_fn = batch_load_fn
+        self._cache = {}
+        self._queue = {}
+        self._lock = threading.Lock()
+
+    def want(self, keys):
+        with self._lock:
+            for key in keys:
+                if key is not None and key not in self._cache:
+                    self._queue[key] = None
+
+    def prime(self, key, value):
+        with self._lock:
+            self._cache.setdefault(key, value)
+
+    def load(self, key):
+        with self._lock:
+            if key not in self._cache:
+                self._queue[key] = None
+                self._dispatch()
+            return self._cache[key]
+
+    def load_many(self, keys):
+        keys = list(keys)
+        self.want(keys)
+        with self._lock:
+            self._dispatch()
+            return [self._cache[key] for key in keys]
+
+    def _dispatch(self):
+        keys = [key for key in self._queue if key not in self._cache]
+        self._queue = {}
+        if not keys:
+            return
+        values = self.batch_load_fn(keys)
+        self._cache.update(zip(keys, values))
+
+
+def load_customers(customer_ids):
+    customers = Customer.objects.in_bulk(customer_ids)
+    return [customers.get(pk) for pk in customer_ids]
+
+
+def load_order_products(order_ids):
+    # one query over the M2M through table for every order on the page
+    products = defaultdict(list)
+    rows = (Order.products.through.objects
+            .filter(order_id__in=order_ids)
+            .select_related('product')
+            .order_by('order_id', 'product_id'))
+    for row in rows:
+        products[row.order_id].append(row.product)
+    return [products[pk] for pk in order_ids]
+
+
+class Loaders:
+    def __init__(self):
+        self.customer = DataLoader(load_customers)
+        self.order_products = DataLoader(load_order_products)
+
+
+_context_lock = threading.Lock()
+
+
+def get_loaders(info):
+    # loaders live on the request so every resolver of every operation in
+    # it shares the same batches and cache
+    context = info.context
+    if context is None:
+        return Loaders()
+    loaders = getattr(context, '_crm_loaders', None)
+    if loaders is None:
+        with _context_lock:
+            loaders = getattr(context, '_crm_loaders', None)
+            if loaders is None:
+                loaders = Loaders()
+                setattr(context, '_crm_loaders', loaders)
+    return loaders
+
+
+def reset_loaders(context):
+    """Forget the rows loaded for ``context``, e.g. after a mutation in
+    it may have changed them."""
+    if context is not None and hasattr(context, '_crm_loaders'):
+        del context._crm_loaders
@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.workers import WORKLOADS, get_profiles, run_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Measure the task throughput of the Celery worker profiles on '
+            'an in-memory broker (see crm/workers.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=500)
+        parser.add_argument('--profile', action='append',
+                            help='Only run this profile (repeatable).')
+        parser.add_argument('--workload', choices=sorted(WORKLOADS),
+                            help='Run every profile on this workload '
+                                 "instead of its own queue's.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON.')
+
+    def handle(self, *args, tasks, profile, workload, seed, output,
+               **options):
+        unknown = set(profile or ()) - set(get_profiles())
+        if unknown:
+            raise CommandError(
+                f"Unknown profile {', '.join(sorted(unknown))}; choose "
+                f"from {', '.join(sorted(get_profiles()))}.")
+        results = run_benchmark(tasks, profiles=profile, workload=workload,
+                                seed=seed, log=self.stdout.write)
+        if output:
+            with open(output, 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
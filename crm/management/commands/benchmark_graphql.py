@@ -0,0 +1,93 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment,
+)
+
+from crm.benchmark import compare as compare_results, operations, run_suite
+from graphql_crm.seed_db import run as seed_data
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the CRM GraphQL operations in-process and over HTTP '
+            'against a freshly seeded test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=20000,
+                            help='Synthetic orders to seed (see seed_crm).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--transport', choices=['in-process', 'http'],
+                            action='append',
+                            help='Only run over this transport (repeatable).')
+        parser.add_argument('--operation', action='append',
+                            help='Only run this operation (repeatable).')
+        parser.add_argument('--output', help='Write the results as JSON.')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='Print changes against an earlier --output.')
+
+    def handle(self, *args, iterations, orders, seed, transport, operation,
+               output, compare, **options):
+        names = [name for name, *_ in operations()]
+        unknown = set(operation or ()) - set(names)
+        if unknown:
+            raise CommandError(
+                f"Unknown operation {', '.join(sorted(unknown))}; "
+                f"choose from {', '.join(names)}.")
+        baseline = None
+        if compare:
+            with open(compare) as fh:
+                baseline = json.load(fh)
+
+        # run against a throwaway database so the numbers do not depend on
+        # (or disturb) whatever data the development database holds
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            seed_data(customers=max(orders // 10, 1),
+                      products=max(min(orders // 100, 10000), 10),
+                      orders=orders, seed=seed, log=self.stdout.write)
+            results = run_suite(
+                iterations, transports=transport or ('in-process', 'http'),
+                only=operation, log=self.stdout.write)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': iterations,
+                'orders': orders,
+                'seed': seed,
+            },
+            'results': results,
+        }
+        if output:
+            with open(output, 'w') as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+        if baseline:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"== against {baseline['meta'].get('revision')} =="))
+            compare_results(results, baseline, log=self.stdout.write)
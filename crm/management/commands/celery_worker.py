@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.celery import app
+from crm.workers import get_profiles, worker_argv
+
+
+class Command(BaseCommand):
+    help = ('Start a Celery worker with one of the CRM worker profiles '
+            '(queues, pool, concurrency and prefetch; see crm/workers.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile')
+        parser.add_argument('--loglevel', default='info')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the worker arguments and exit.')
+
+    def handle(self, *args, profile, loglevel, dry_run, **options):
+        profiles = get_profiles()
+        if profile not in profiles:
+            raise CommandError(
+                f"Unknown profile {profile}; choose from "
+                f"{', '.join(sorted(profiles))}.")
+        argv = worker_argv(profile, loglevel)
+        if dry_run:
+            self.stdout.write(' '.join(['celery', '-A', 'crm'] + argv))
+            return
+        app.worker_main(argv)
@@ -0,0 +1,117 @@
+import contextlib
+import importlib
+import statistics
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, migrations
+from django.utils import timezone
+
+from crm.filters import CustomerFilter, OrderFilter, ProductFilter
+from crm.models import Customer, Order, Product
+from graphql_crm.seed_db import run as seed
+
+# the migration that added the filter indexes
+FILTER_INDEXES = 'crm.migrations.0004_filter_indexes'
+
+
+@contextlib.contextmanager
+def without_filter_indexes():
+    """Drop the indexes of the filter index migration, and create them
+    again on the way out. The migration state is left alone, so nothing
+    but those indexes is touched."""
+    operations = importlib.import_module(FILTER_INDEXES).Migration.operations
+    indexes = [(apps.get_model('crm', op.model_name), op.index)
+               for op in operations if isinstance(op, migrations.AddIndex)]
+    search = [op for op in operations
+              if isinstance(op, migrations.RunPython)]
+    with connection.schema_editor() as schema_editor:
+        for op in search:
+            op.reverse_code(apps, schema_editor)
+        for model, index in indexes:
+            schema_editor.remove_index(model, index)
+    try:
+        yield
+    finally:
+        with connection.schema_editor() as schema_editor:
+            for model, index in indexes:
+                schema_editor.add_index(model, index)
+            for op in search:
+                op.code(apps, schema_editor)
+
+
+def filter_queries():
+    now = timezone.now()
+    week_ago = (now - timedelta(days=7)).date().isoformat()
+    month_ago = (now - timedelta(days=30)).isoformat()
+    customer_id = Customer.objects.order_by('id').values_list(
+        'id', flat=True).first()
+    return [
+        ('customers created in the last month', CustomerFilter, Customer,
+         {'created_at__gte': month_ago, 'order_by': 'created_at'}),
+        ('customers by name', CustomerFilter, Customer,
+         {'name': 'ann', 'order_by': 'name'}),
+        ('customers by email', CustomerFilter, Customer,
+         {'email': 'example.com'}),
+        ('customers by phone prefix', CustomerFilter, Customer,
+         {'phone_pattern': '+1555'}),
+        ('orders in the last week', OrderFilter, Order,
+         {'order_date_gte': week_ago, 'order_by': '-order_date'}),
+        ('orders over 500', OrderFilter, Order,
+         {'total_amount_gte': 500, 'order_by': 'total_amount'}),
+        ('orders by customer name', OrderFilter, Order,
+         {'customer_name': 'ann'}),
+        ('orders of one customer', None, Order,
+         {'customer_id': customer_id, 'order_by': 'order_date'}),
+        ('low stock products', ProductFilter, Product,
+         {'stock_lte': 5, 'order_by': 'stock'}),
+    ]
+
+
+def build_queryset(filterset_class, model, data):
+    if filterset_class is None:
+        data = dict(data)
+        ordering = data.pop('order_by')
+        return model.objects.filter(**data).order_by(ordering)
+    return filterset_class(data=data, queryset=model.objects.all()).qs
+
+
+class Command(BaseCommand):
+    help = ('Print query plans and timings for the CRM filters, optionally '
+            'before and after the filter index migration.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-orders', type=int, default=0,
+                            help='Replace the data with this many synthetic '
+                                 'orders first (see seed_crm).')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also run with the filter indexes '
+                                 'dropped, then create them again.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, seed_orders, compare, repeat, **options):
+        if seed_orders:
+            seed(customers=max(seed_orders // 10, 1),
+                 products=max(min(seed_orders // 100, 10000), 10),
+                 orders=seed_orders, log=self.stdout.write)
+
+        if compare:
+            with without_filter_indexes():
+                self.report('before indexes', repeat)
+        self.report('with indexes', repeat)
+
+    def report(self, title, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'== {title} =='))
+        for label, filterset_class, model, data in filter_queries():
+            qs = build_queryset(filterset_class, model, data)[:50]
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(qs.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(self.style.SUCCESS(
+                f'{label}: median {statistics.median(timings):.2f} ms'))
+            for line in qs.explain().splitlines():
+                self.stdout.write(f'    {line}')
@@ -0,0 +1,58 @@
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.export import EXPORTERS, ExportError, export_lines, gzip_chunks
+
+
+class Command(BaseCommand):
+    help = ('Stream customers, products or orders matching the GraphQL '
+            'filters to an NDJSON or CSV file, gzip-compressed if its name '
+            'ends in .gz.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTERS))
+        parser.add_argument('path', help="File to write, or '-' for stdout.")
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Defaults to the file extension.')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress even if the name does not end '
+                                 'in .gz.')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='NAME=VALUE',
+            help='A filter of the GraphQL connection, e.g. '
+                 'order_date_gte=2025-01-01. May be repeated.')
+
+    def handle(self, *args, kind, path, format=None, gzip=False,
+               chunk_size=None, filter=(), **options):
+        name = path[:-3] if path.endswith('.gz') else path
+        fmt = format or ('csv' if name.endswith('.csv') else 'ndjson')
+        compress = gzip or path.endswith('.gz')
+        filters = {}
+        for item in filter:
+            key, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Filters are NAME=VALUE, not {item!r}')
+            filters[key] = value
+
+        try:
+            lines = export_lines(kind, fmt, filters, chunk_size)
+        except ExportError as e:
+            raise CommandError(e)
+        chunks = (gzip_chunks(lines) if compress
+                  else (line.encode('utf-8') for line in lines))
+        try:
+            stream = (nullcontext(sys.stdout.buffer) if path == '-'
+                      else open(path, 'wb'))
+        except OSError as e:
+            raise CommandError(e)
+        written = 0
+        with stream as out:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        if path != '-':
+            self.stderr.write(self.style.SUCCESS(
+                f'Exported {kind} to {path} ({written} bytes)'))
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.bulk import IMPORTERS, import_records, iter_records
+
+
+class Command(BaseCommand):
+    help = ('Stream customers, products or orders from an NDJSON or CSV '
+            'file into the database in chunked transactions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help="File to import, or '-' for stdin.")
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, kind, path, format=None, batch_size=None,
+               **options):
+        fmt = format or ('csv' if path.endswith('.csv') else 'ndjson')
+
+        def progress(chunk):
+            rate = chunk['rows_per_second']
+            self.stdout.write(
+                f"chunk {chunk['chunk']}: {chunk['created']} created, "
+                f"{chunk['failed']} failed"
+                + (f", {rate:.0f} rows/s" if rate else ''))
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='')
+        except OSError as e:
+            raise CommandError(e)
+        with stream:
+            report = import_records(kind, iter_records(stream, fmt),
+                                    batch_size, on_chunk=progress)
+
+        for error in report['errors']:
+            self.stderr.write(error)
+        rate = report['rows_per_second']
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} {kind} "
+            f"({report['failed']} failed) in {report['seconds']:.2f}s"
+            + (f", {rate:.0f} rows/s" if rate else '')))
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.benchmark import percentile
+
+# independent root fields, which the async view resolves concurrently
+DEFAULT_QUERY = '''
+query {
+  allRevenue
+  revenueByCustomer(first: 10) { revenue customer { name } }
+  allOrders(first: 20, orderBy: "-orderDate") {
+    edges { node { totalAmount customer { name } products { name } } }
+  }
+}
+'''
+
+
+async def worker(client, url, body, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, json=body)
+            ok = response.status_code == 200 and 'errors' not in response.json()
+        except Exception:
+            ok = False
+        latencies.append((time.perf_counter() - started) * 1000)
+        if not ok:
+            errors.append(url)
+
+
+async def load(url, body, concurrency, duration, warmup):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        if warmup:
+            await asyncio.gather(*(
+                worker(client, url, body, time.monotonic() + warmup, [], [])
+                for _ in range(concurrency)))
+        latencies = []
+        errors = []
+        started = time.monotonic()
+        await asyncio.gather(*(
+            worker(client, url, body, started + duration, latencies, errors)
+            for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Load test GraphQL endpoints of a running server, e.g. the sync '
+            'and async views under uvicorn:\n'
+            '  uvicorn alx_backend_graphql_crm.asgi:application\n'
+            '  python manage.py loadtest_graphql --url http://127.0.0.1:8000')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append',
+                            help='Endpoint to test (repeatable); default '
+                                 'graphql and graphql/async.')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=20)
+        parser.add_argument('--warmup', type=float, default=2)
+        parser.add_argument('--query', help='File with the query to send.')
+        parser.add_argument('--output', help='Write the results as JSON.')
+
+    def handle(self, *args, url, path, concurrency, duration, warmup, query,
+               output, **options):
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            raise CommandError('The load test needs httpx: '
+                               'pip install httpx')
+        body = {'query': open(query).read() if query else DEFAULT_QUERY}
+        results = {}
+        for endpoint in path or ['graphql', 'graphql/async']:
+            target = f"{url.rstrip('/')}/{endpoint.lstrip('/')}"
+            stats = asyncio.run(load(target, body, concurrency, duration,
+                                     warmup))
+            results[endpoint] = stats
+            self.stdout.write(
+                f"{endpoint}: {stats['requests_per_second']:.1f} req/s, "
+                f"p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, "
+                f"p99 {stats['p99_ms']:.1f} ms, {stats['errors']} errors")
+        if output:
+            with open(output, 'w') as fh:
+                json.dump({'concurrency': concurrency, 'duration': duration,
+                           'results': results}, fh, indent=2)
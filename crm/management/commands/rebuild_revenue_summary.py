@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crm.models import CustomerRevenue, DailyRevenue
+from crm.revenue import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily and per-customer revenue summaries from orders.'
+
+    def handle(self, *args, **options):
+        rebuild_summaries()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {DailyRevenue.objects.count()} daily and '
+            f'{CustomerRevenue.objects.count()} customer revenue rows'))
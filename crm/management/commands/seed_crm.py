@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from graphql_crm.seed_db import run
+
+
+class Command(BaseCommand):
+    help = ('Generate deterministic synthetic customers, products and orders '
+            'for performance work (see graphql_crm/seed_db.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--end', type=date.fromisoformat,
+                            help='Last day of orders (YYYY-MM-DD), '
+                                 'default today.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Zipf exponent of product popularity.')
+        parser.add_argument('--append', action='store_true',
+                            help='Keep existing rows instead of flushing.')
+
+    def handle(self, *args, **options):
+        try:
+            run(customers=options['customers'],
+                products=options['products'],
+                orders=options['orders'],
+                seed=options['seed'],
+                days=options['days'],
+                end=options['end'],
+                batch_size=options['batch_size'],
+                zipf_s=options['zipf'],
+                reset=not options['append'],
+                log=self.stdout.write)
+        except ValueError as e:
+            raise CommandError(e)
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_summaries(apps, schema_editor):
+    Order = apps.get_model('crm', 'Order')
+    DailyRevenue = apps.get_model('crm', 'DailyRevenue')
+    CustomerRevenue = apps.get_model('crm', 'CustomerRevenue')
+    DailyRevenue.objects.bulk_create(
+        DailyRevenue(day=row['day'], order_count=row['count'],
+                     revenue=row['revenue'])
+        for row in Order.objects.annotate(day=TruncDate('order_date'))
+        .values('day').annotate(count=Count('id'), revenue=Sum('total_amount'))
+        .order_by()
+    )
+    CustomerRevenue.objects.bulk_create(
+        CustomerRevenue(customer_id=row['customer_id'],
+                        order_count=row['count'], revenue=row['revenue'])
+        for row in Order.objects.values('customer_id')
+        .annotate(count=Count('id'), revenue=Sum('total_amount'))
+        .order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0002_order_date_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='revenue', to='crm.customer')),
+            ],
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+# Search indexes for the icontains / startswith filters. B-tree indexes
+# cannot serve them as declared in the models, so each backend gets its own:
+# trigram GIN indexes over UPPER(col) (what icontains compiles to) and a
+# pattern_ops index for the phone prefix on PostgreSQL, and a NOCASE index
+# that lets SQLite's LIKE optimization serve the phone prefix.
+SEARCH_INDEXES = {
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX crm_customer_name_trgm ON crm_customer '
+        'USING gin (UPPER(name) gin_trgm_ops)',
+        'CREATE INDEX crm_customer_email_trgm ON crm_customer '
+        'USING gin (UPPER(email) gin_trgm_ops)',
+        'CREATE INDEX crm_product_name_trgm ON crm_product '
+        'USING gin (UPPER(name) gin_trgm_ops)',
+        'CREATE INDEX crm_customer_phone_prefix ON crm_customer '
+        '(phone varchar_pattern_ops)',
+    ],
+    'sqlite': [
+        'CREATE INDEX crm_customer_phone_prefix ON crm_customer '
+        '(phone COLLATE NOCASE)',
+    ],
+}
+
+DROP_SEARCH_INDEXES = {
+    'postgresql': [
+        'DROP INDEX IF EXISTS crm_customer_name_trgm',
+        'DROP INDEX IF EXISTS crm_customer_email_trgm',
+        'DROP INDEX IF EXISTS crm_product_name_trgm',
+        'DROP INDEX IF EXISTS crm_customer_phone_prefix',
+    ],
+    'sqlite': [
+        'DROP INDEX IF EXISTS crm_customer_phone_prefix',
+    ],
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    for sql in SEARCH_INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    for sql in DROP_SEARCH_INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_revenue_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['created_at', 'id'], name='crm_customer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['name', 'id'], name='crm_customer_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_date', 'id'], name='crm_order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total_amount', 'id'], name='crm_order_total_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'order_date'], name='crm_order_customer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='crm_product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['stock', 'id'], name='crm_product_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='crm_product_name_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
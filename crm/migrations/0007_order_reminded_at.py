@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_report_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reminded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
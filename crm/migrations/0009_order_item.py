@@ -0,0 +1,97 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:05
+
+import itertools
+from decimal import ROUND_HALF_UP, Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+CENT = Decimal('0.01')
+
+
+def split_total(total, prices):
+    """Split ``total`` over the products in proportion to ``prices``,
+    to the cent; the last share takes the rounding remainder, so the
+    shares always add up to ``total``."""
+    total = Decimal(total)
+    prices = [Decimal(price) for price in prices]
+    weight = sum(prices)
+    if not weight:
+        prices, weight = [Decimal(1)] * len(prices), len(prices)
+    shares = [(total * price / weight).quantize(CENT, ROUND_HALF_UP)
+              for price in prices[:-1]]
+    return shares + [total - sum(shares)]
+
+
+def copy_order_products(apps, schema_editor):
+    # The price paid per product was never recorded, so this backfill is
+    # lossy: each order's total is split over its products in proportion
+    # to their current prices, which keeps the line totals of every order
+    # adding up to its total_amount.
+    Order = apps.get_model('crm', 'Order')
+    OrderItem = apps.get_model('crm', 'OrderItem')
+    rows = (Order.products.through.objects.order_by('order_id', 'product_id')
+            .values_list('order_id', 'product_id', 'product__price',
+                         'order__total_amount'))
+    items = []
+    for order_id, links in itertools.groupby(rows.iterator(BATCH_SIZE),
+                                             key=lambda row: row[0]):
+        links = list(links)
+        shares = split_total(links[0][3], [price for _, _, price, _ in links])
+        for (_, product_id, _, _), share in zip(links, shares):
+            items.append(OrderItem(order_id=order_id, product_id=product_id,
+                                   quantity=1, unit_price=share,
+                                   line_total=share))
+        if len(items) >= BATCH_SIZE:
+            OrderItem.objects.bulk_create(items)
+            items = []
+    OrderItem.objects.bulk_create(items)
+
+
+def copy_order_items(apps, schema_editor):
+    Order = apps.get_model('crm', 'Order')
+    OrderItem = apps.get_model('crm', 'OrderItem')
+    Through = Order.products.through
+    Through.objects.bulk_create(
+        (Through(order_id=order_id, product_id=product_id)
+         for order_id, product_id in OrderItem.objects.order_by('pk')
+         .values_list('order_id', 'product_id').iterator(BATCH_SIZE)),
+        batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_bulk_job'),
+    ]
+
+    # a plain many-to-many field cannot be altered to use a through model,
+    # so its rows are copied and the field is replaced
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='crm.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='crm.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'quantity', 'line_total'], name='crm_orderitem_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'product'), name='crm_orderitem_unique')],
+            },
+        ),
+        migrations.RunPython(copy_order_products, copy_order_items),
+        migrations.RemoveField(
+            model_name='order',
+            name='products',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='products',
+            field=models.ManyToManyField(through='crm.OrderItem', to='crm.product'),
+        ),
+    ]
@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 
 # Create your models here.
@@ -6,7 +9,16 @@ class Customer(models.Model):
     name = models.CharField(max_length=30)
     email = models.EmailField(unique=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    # B-tree indexes for the CustomerFilter range filters and orderings;
+    # search indexes are backend-specific (see migration 0004)
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'],
+                         name='crm_customer_created_idx'),
+            models.Index(fields=['name', 'id'], name='crm_customer_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -17,6 +29,13 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=20, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='crm_product_price_idx'),
+            models.Index(fields=['stock', 'id'], name='crm_product_stock_idx'),
+            models.Index(fields=['name', 'id'], name='crm_product_name_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} : {self.price}"
 
@@ -24,7 +43,133 @@ class Product(models.Model):
 class Order(models.Model):
     customer = models.ForeignKey(
         Customer, on_delete=models.CASCADE, related_name='orders')
-    products = models.ManyToManyField(Product)
-    order_date = models.DateTimeField(auto_now_add=True)
+    products = models.ManyToManyField(Product, through='OrderItem')
+    order_date = models.DateTimeField(default=timezone.now)
     total_amount = models.DecimalField(
         max_digits=10, decimal_places=2, default=0.00)
+    # set once a reminder was sent (crm/cron_jobs/send_order_reminders.py)
+    reminded_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_date', 'id'],
+                         name='crm_order_date_idx'),
+            models.Index(fields=['total_amount', 'id'],
+                         name='crm_order_total_idx'),
+            models.Index(fields=['customer', 'order_date'],
+                         name='crm_order_customer_date_idx'),
+        ]
+
+
+# One product line of an order. Its price is captured when the order is
+# placed, so totals and per-product aggregates never read Product.price.
+class OrderItem(models.Model):
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='order_items')
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=20, decimal_places=2)
+    # quantity * unit_price, so aggregates are plain column sums
+    line_total = models.DecimalField(max_digits=20, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'],
+                                    name='crm_orderitem_unique'),
+        ]
+        # covers the per-product aggregates (see crm.revenue.product_sales)
+        indexes = [
+            models.Index(fields=['product', 'quantity', 'line_total'],
+                         name='crm_orderitem_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id} : {self.quantity} x {self.product_id}"
+
+
+# Revenue summaries maintained incrementally from Order changes
+# (see crm/revenue.py); rebuild with `manage.py rebuild_revenue_summary`.
+class DailyRevenue(models.Model):
+    day = models.DateField(unique=True)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # when the day's orders last changed (see crm.reports)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.day} : {self.revenue}"
+
+
+class CustomerRevenue(models.Model):
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, related_name='revenue')
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.customer} : {self.revenue}"
+
+
+# Totals of a reporting period, kept by the crm.reports pipeline: one row
+# per day shard and one per report assembled from its shards.
+class ReportSnapshot(models.Model):
+    SHARD = 'shard'
+    REPORT = 'report'
+    KIND_CHOICES = [(SHARD, 'Shard'), (REPORT, 'Report')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    start = models.DateField()
+    # exclusive
+    end = models.DateField()
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    new_customers = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(default=timezone.now)
+    delivered_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'start', 'end'],
+                                    name='crm_report_period_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.start} - {self.end} : {self.revenue}"
+
+
+# A bulk mutation run in the background (see crm.jobs): the input is kept
+# until the job is done, the result only as counts and the first errors.
+class BulkJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'),
+                      (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    # handed out to clients, so not guessable
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    kind = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    records = models.JSONField(blank=True, null=True)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    # why a failed job stopped
+    error = models.TextField(blank=True)
+    # the run importing the job, and when it last committed a chunk; a
+    # run that stops heartbeating loses its claim (see crm.jobs)
+    claim = models.UUIDField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.id} : {self.status}"
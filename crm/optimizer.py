@@ -0,0 +1,166 @@
+from django.db.models import ForeignObjectRel, Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.filter.fields import convert_enum
+from graphql import get_named_type
+from graphql.execution.collect_fields import collect_sub_fields
+from graphql.execution.values import get_argument_values
+
+
+def optimize_queryset(queryset, info):
+    """Shape ``queryset`` to the fields selected in ``info``.
+
+    Columns are pruned with ``only()``, forward relations are joined with
+    ``select_related()`` and reverse / many-to-many relations (including
+    nested connections) are prefetched with a ``Prefetch`` queryset that is
+    filtered the same way the nested connection would filter it.
+    """
+    plan = _plan(queryset.model, get_named_type(info.return_type),
+                 info.field_nodes, info)
+    return plan.apply(queryset)
+
+
+def is_prefetched(instance, name):
+    return name in getattr(instance, '_prefetched_objects_cache', {})
+
+
+def prefetched_list(iterable):
+    # a related manager whose rows were prefetched by the optimizer; its
+    # Prefetch queryset was already filtered with the connection arguments
+    get_queryset = getattr(iterable, 'get_queryset', None)
+    if get_queryset is None or not hasattr(iterable, 'instance'):
+        return None
+    return get_queryset()._result_cache
+
+
+class _Plan:
+    def __init__(self):
+        self.only = set()
+        self.prunable = True
+        self.select = []
+        self.prefetch = []
+
+    def apply(self, queryset):
+        if self.select:
+            queryset = queryset.select_related(*self.select)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch)
+        if self.prunable:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+def _model_fields(model):
+    fields = {}
+    for field in model._meta.get_fields():
+        if isinstance(field, ForeignObjectRel):
+            fields[field.get_accessor_name()] = field
+        else:
+            fields[field.name] = field
+    return fields
+
+
+def _collect(info, gql_type, field_nodes):
+    # response keys -> field nodes, grouped again by field name so that
+    # aliases of the same field are planned together
+    selected = collect_sub_fields(info.schema, info.fragments,
+                                  info.variable_values, gql_type, field_nodes)
+    by_name = {}
+    for nodes in selected.values():
+        for node in nodes:
+            by_name.setdefault(node.name.value, []).append(node)
+    return by_name
+
+
+def _unwrap_connection(info, gql_type, field_nodes):
+    # connection { edges { node { ... } } } -> the node type and its nodes
+    for name in ('edges', 'node'):
+        if name not in getattr(gql_type, 'fields', {}):
+            break
+        field_nodes = _collect(info, gql_type, field_nodes).get(name, [])
+        gql_type = get_named_type(gql_type.fields[name].type)
+    return gql_type, field_nodes
+
+
+def _plan(model, gql_type, field_nodes, info):
+    plan = _Plan()
+    gql_type, field_nodes = _unwrap_connection(info, gql_type, field_nodes)
+    model_fields = _model_fields(model)
+
+    for gql_name, nodes in _collect(info, gql_type, field_nodes).items():
+        if gql_name.startswith('__'):
+            continue
+        name = to_snake_case(gql_name)
+        field = model_fields.get(name)
+        if field is None:
+            # a computed field may read any column
+            plan.prunable = False
+            continue
+        if not field.is_relation:
+            plan.only.add(field.name)
+            continue
+
+        field_def = gql_type.fields[gql_name]
+        child_type = get_named_type(field_def.type)
+        if field.many_to_one or (field.one_to_one and field.concrete):
+            _plan_forward(plan, field, child_type, nodes, info)
+        else:
+            _plan_prefetch(plan, field, name, gql_type, field_def,
+                           child_type, nodes, info)
+    return plan
+
+
+def _plan_forward(plan, field, child_type, nodes, info):
+    child = _plan(field.related_model, child_type, nodes, info)
+    plan.only.add(field.name)
+    plan.select.append(field.name)
+    plan.select.extend(f'{field.name}__{lookup}' for lookup in child.select)
+    if child.prunable:
+        plan.only.update(f'{field.name}__{column}' for column in child.only)
+    plan.prefetch.extend(
+        Prefetch(f'{field.name}__{prefetch.prefetch_through}',
+                 queryset=prefetch.queryset)
+        for prefetch in child.prefetch)
+
+
+def _plan_prefetch(plan, field, name, gql_type, field_def, child_type,
+                   nodes, info):
+    arguments = [get_argument_values(field_def, node, info.variable_values)
+                 for node in nodes]
+    if any(args != arguments[0] for args in arguments[1:]):
+        # aliases asking for differently filtered sets cannot share one
+        # prefetch; leave them to the connection resolver
+        return
+    if arguments[0].get('keyset'):
+        # keyset pages seek per parent and cannot be cut from one prefetch
+        return
+
+    related_model = field.related_model
+    child = _plan(related_model, child_type, nodes, info)
+    if field.one_to_many:
+        child.only.add(field.field.attname)
+    queryset = child.apply(related_model._default_manager.all())
+
+    graphene_field = gql_type.graphene_type._meta.fields.get(name)
+    if isinstance(graphene_field, DjangoFilterConnectionField):
+        queryset = _filter(graphene_field, queryset, arguments[0], info)
+        if queryset is None:
+            return
+    plan.prefetch.append(Prefetch(name, queryset=queryset))
+
+
+def _filter(graphene_field, queryset, args, info):
+    data = {}
+    for key, value in args.items():
+        if key in graphene_field.filtering_args and value is not None:
+            if key == 'order_by':
+                value = to_snake_case(value)
+            data[key] = convert_enum(value)
+    if not data:
+        return queryset
+    filterset = graphene_field.filterset_class(
+        data=data, queryset=queryset, request=info.context)
+    if not filterset.is_valid():
+        # let the connection resolver report the validation error
+        return None
+    return filterset.qs
@@ -0,0 +1,149 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import graphene
+from django.db.models import F, Q
+from graphene.relay.connection import connection_adapter, page_info_adapter
+from graphql import GraphQLError
+
+KEYSET_PREFIX = 'keyset:'
+
+
+class CountableConnection(graphene.relay.Connection):
+    """Connection with an opt-in ``totalCount``.
+
+    Offset pagination already knows the length of the result; keyset pages
+    never count, so the COUNT(*) only runs when a client selects the field.
+    """
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        if root.length is None:
+            root.length = root.iterable.count()
+        return root.length
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        # keep microseconds; a truncated key would repeat rows on seek
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not keyset serializable')
+
+
+def keyset_to_cursor(values):
+    payload = json.dumps(values, default=_encode_value)
+    return base64.b64encode(
+        (KEYSET_PREFIX + payload).encode()).decode('ascii')
+
+
+def cursor_to_keyset(cursor):
+    try:
+        payload = base64.b64decode(cursor).decode()
+    except (ValueError, UnicodeDecodeError):
+        payload = ''
+    if not payload.startswith(KEYSET_PREFIX):
+        raise GraphQLError(f'Invalid keyset cursor: {cursor}')
+    return json.loads(payload[len(KEYSET_PREFIX):])
+
+
+def keyset_columns(queryset):
+    """The ``(path, descending)`` ordering of ``queryset`` with the primary
+    key appended as the tie-breaker, rejecting orderings a seek predicate
+    cannot express."""
+    ordering = list(queryset.query.order_by)
+    if not ordering and queryset.query.default_ordering:
+        ordering = list(queryset.model._meta.ordering)
+
+    columns = []
+    for item in ordering:
+        if not isinstance(item, str) or item == '?':
+            raise GraphQLError(
+                'Keyset pagination only supports ordering by fields.')
+        path = item.lstrip('-')
+        if _is_nullable(queryset.model, path):
+            raise GraphQLError(
+                f'Keyset pagination cannot order by nullable field {path}.')
+        columns.append((path, item.startswith('-')))
+    if not any(path in ('pk', 'id') for path, _ in columns):
+        columns.append(('pk', False))
+    return columns
+
+
+def _is_nullable(model, path):
+    field = None
+    for part in path.split('__'):
+        field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+        if field.is_relation:
+            model = field.related_model
+    return field.null
+
+
+def _seek(columns, values, forward):
+    # (a, b, pk) > (x, y, z)  ==  a > x OR (a = x AND (b > y OR (b = y AND pk > z)))
+    predicate = None
+    for (path, descending), value in reversed(list(zip(columns, values))):
+        lookup = 'lt' if descending == forward else 'gt'
+        strict = Q(**{f'{path}__{lookup}': value})
+        if predicate is None:
+            predicate = strict
+        else:
+            predicate = strict | (Q(**{path: value}) & predicate)
+    return predicate
+
+
+def resolve_keyset_connection(connection, args, queryset, max_limit=None):
+    """Build one page of ``connection`` with a seek predicate instead of
+    ``OFFSET``, so the cost of a page does not grow with its depth."""
+    if args.get('offset') is not None:
+        raise GraphQLError('offset cannot be combined with keyset pagination.')
+
+    columns = keyset_columns(queryset)
+    aliases = [f'keyset_{i}' for i in range(len(columns))]
+    page = queryset.annotate(**{
+        alias: F(path) for alias, (path, _) in zip(aliases, columns)})
+
+    first, last = args.get('first'), args.get('last')
+    after, before = args.get('after'), args.get('before')
+    forward = last is None or first is not None
+    size = (first if forward else last) or max_limit
+
+    ordering = [('-' if descending == forward else '') + path
+                for path, descending in columns]
+    page = page.order_by(*ordering)
+    if after:
+        page = page.filter(_seek(columns, cursor_to_keyset(after), True))
+    if before:
+        page = page.filter(_seek(columns, cursor_to_keyset(before), False))
+    if size is not None:
+        page = page[:size + 1]
+
+    rows = list(page)
+    has_more = size is not None and len(rows) > size
+    rows = rows[:size]
+    if not forward:
+        rows.reverse()
+
+    edges = [
+        connection.Edge(
+            node=row,
+            cursor=keyset_to_cursor([getattr(row, a) for a in aliases]))
+        for row in rows
+    ]
+    page_info = page_info_adapter(
+        startCursor=edges[0].cursor if edges else None,
+        endCursor=edges[-1].cursor if edges else None,
+        hasPreviousPage=has_more if not forward else bool(after),
+        hasNextPage=has_more if forward else bool(before),
+    )
+    resolved = connection_adapter(connection, edges, page_info)
+    resolved.iterable = queryset
+    resolved.length = None
+    return resolved
@@ -0,0 +1,212 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from graphql import GraphQLError, parse, validate
+
+DEFAULT_DOCUMENT_CACHE_SIZE = 256
+DEFAULT_STORE = 'crm.persisted_queries.InProcessStore'
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class CacheMetrics:
+    """Hit and miss counters for one cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def snapshot(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else None}
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class InProcessStore:
+    """Persisted queries kept in this process, least recently used first
+    out once ``MAX_ENTRIES`` is reached."""
+
+    def __init__(self, MAX_ENTRIES=1000):
+        self._queries = LRUCache(MAX_ENTRIES)
+
+    def get(self, digest):
+        return self._queries.get(digest)
+
+    def set(self, digest, query):
+        self._queries.set(digest, query)
+
+    def clear(self):
+        self._queries.clear()
+
+
+class DjangoCacheStore:
+    """Persisted queries shared between processes through a Django cache."""
+
+    def __init__(self, CACHE='default', KEY_PREFIX='graphql:apq:',
+                 TIMEOUT=None):
+        self.cache = caches[CACHE]
+        self.key_prefix = KEY_PREFIX
+        self.timeout = TIMEOUT
+
+    def get(self, digest):
+        return self.cache.get(self.key_prefix + digest)
+
+    def set(self, digest, query):
+        self.cache.set(self.key_prefix + digest, query, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class PersistedQueryError(GraphQLError):
+    def __init__(self, message, code):
+        super().__init__(message, extensions={'code': code})
+
+
+metrics = {'documents': CacheMetrics(), 'persisted_queries': CacheMetrics()}
+_documents = None
+_store = None
+
+
+def get_document_cache():
+    global _documents
+    if _documents is None:
+        _documents = LRUCache(getattr(settings, 'CRM_DOCUMENT_CACHE_SIZE',
+                                      DEFAULT_DOCUMENT_CACHE_SIZE))
+    return _documents
+
+
+def get_store():
+    """The persisted-query store configured by ``CRM_PERSISTED_QUERIES``,
+    e.g. ``{'BACKEND': 'crm.persisted_queries.DjangoCacheStore',
+    'OPTIONS': {'CACHE': 'default'}}``."""
+    global _store
+    if _store is None:
+        config = getattr(settings, 'CRM_PERSISTED_QUERIES', {})
+        backend = import_string(config.get('BACKEND', DEFAULT_STORE))
+        _store = backend(**config.get('OPTIONS', {}))
+    return _store
+
+
+def reset():
+    """Drop the caches and counters, e.g. after changing settings."""
+    global _documents, _store
+    _documents = _store = None
+    for counter in metrics.values():
+        counter.reset()
+
+
+def resolve_persisted_query(query, extensions):
+    """Apply the Automatic Persisted Queries protocol.
+
+    A request carrying only ``extensions.persistedQuery.sha256Hash`` is
+    answered from the store; one carrying the query as well registers it
+    under its hash after checking that the two match.
+    """
+    persisted = (extensions or {}).get('persistedQuery')
+    if not isinstance(persisted, dict):
+        return query
+    if persisted.get('version') != 1:
+        raise PersistedQueryError('Unsupported persisted query version.',
+                                  'PERSISTED_QUERY_VERSION_NOT_SUPPORTED')
+    digest = persisted.get('sha256Hash')
+    if not isinstance(digest, str):
+        raise PersistedQueryError('Missing persisted query hash.',
+                                  'PERSISTED_QUERY_HASH_MISSING')
+
+    store = get_store()
+    if query:
+        if query_hash(query) != digest:
+            raise PersistedQueryError('provided sha does not match query',
+                                      'PERSISTED_QUERY_HASH_MISMATCH')
+        store.set(digest, query)
+        return query
+
+    query = store.get(digest)
+    if query is None:
+        metrics['persisted_queries'].miss()
+        # clients retry with the full query, which registers it
+        raise PersistedQueryError('PersistedQueryNotFound',
+                                  'PERSISTED_QUERY_NOT_FOUND')
+    metrics['persisted_queries'].hit()
+    return query
+
+
+def get_document(schema, query, rules=None, max_errors=None):
+    """Parse and validate ``query``, reusing earlier valid documents.
+
+    Returns ``(document, errors)``. Only documents that validated cleanly
+    are cached, keyed by the query's sha256, so a cached document is
+    executed without being parsed or validated again.
+    """
+    cache = get_document_cache()
+    # a document is only known valid under the rules it was checked with
+    key = (query_hash(query), tuple(rules) if rules is not None else None)
+    document = cache.get(key)
+    if document is not None:
+        metrics['documents'].hit()
+        return document, []
+    metrics['documents'].miss()
+
+    try:
+        document = parse(query)
+    except GraphQLError as error:
+        return None, [error]
+    errors = validate(schema, document, rules, max_errors=max_errors)
+    if errors:
+        return None, errors
+    cache.set(key, document)
+    return document, []
+
+
+def stats():
+    return {name: counter.snapshot() for name, counter in metrics.items()}
@@ -0,0 +1,156 @@
+"""Pub/sub of CRM events for GraphQL subscriptions.
+
+Writers publish JSON-friendly dicts on a channel; every subscriber of the
+channel receives them. The backend is chosen with ``CRM_PUBSUB``, e.g.::
+
+    CRM_PUBSUB = {
+        'BACKEND': 'crm.pubsub.RedisPubSub',
+        'OPTIONS': {'URL': 'redis://localhost:6379/1'},
+    }
+
+``InMemoryPubSub`` (the default) only reaches subscribers in the same
+process, which is enough for tests and a single ASGI worker.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+ORDER_CREATED = 'crm.order_created'
+PRODUCT_STOCK_CHANGED = 'crm.product_stock_changed'
+
+DEFAULT_BACKEND = 'crm.pubsub.InMemoryPubSub'
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryPubSub:
+    """Fans messages out to asyncio queues of this process.
+
+    ``publish`` may be called from any thread; each message is handed to
+    the subscriber's event loop. A subscriber that falls ``MAX_QUEUE``
+    messages behind loses its oldest ones rather than growing without
+    bound.
+    """
+
+    def __init__(self, MAX_QUEUE=1000):
+        self.max_queue = MAX_QUEUE
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers[channel])
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, message)
+            except RuntimeError:
+                # the subscriber's loop is closed; it unsubscribes when
+                # its generator is finalized
+                pass
+
+    def _put(self, queue, message):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def subscribe(self, channel):
+        entry = (asyncio.get_running_loop(),
+                 asyncio.Queue(maxsize=self.max_queue))
+        with self._lock:
+            self._subscribers[channel].add(entry)
+        try:
+            while True:
+                yield await entry[1].get()
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(entry)
+
+
+class RedisPubSub:
+    """Redis PUBLISH/SUBSCRIBE, shared by every worker and process."""
+
+    def __init__(self, URL='redis://localhost:6379/0', PREFIX=''):
+        import redis
+
+        self.url = URL
+        self.prefix = PREFIX
+        self._client = redis.Redis.from_url(URL)
+
+    def publish(self, channel, message):
+        self._client.publish(self.prefix + channel,
+                             json.dumps(message, cls=DjangoJSONEncoder))
+
+    async def subscribe(self, channel):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(self.prefix + channel)
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    yield json.loads(message['data'])
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_backend = None
+
+
+def get_pubsub():
+    global _backend
+    if _backend is None:
+        config = getattr(settings, 'CRM_PUBSUB', {})
+        backend = import_string(config.get('BACKEND', DEFAULT_BACKEND))
+        _backend = backend(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def reset():
+    global _backend
+    _backend = None
+
+
+def publish_on_commit(channel, messages):
+    """Publish ``messages`` once the current transaction commits, so that
+    subscribers never see rows that could still be rolled back. The rows
+    are saved by then, so a failing backend is logged, never raised to the
+    writer."""
+    messages = list(messages)
+
+    def publish():
+        try:
+            backend = get_pubsub()
+            for message in messages:
+                backend.publish(channel, message)
+        except Exception:
+            logger.exception('Could not publish %d message(s) on %s',
+                             len(messages), channel)
+
+    if messages:
+        transaction.on_commit(publish)
+
+
+def orders_created(orders):
+    publish_on_commit(ORDER_CREATED, (
+        {'id': order.pk, 'customer_id': order.customer_id,
+         'total_amount': str(order.total_amount)}
+        for order in orders))
+
+
+def stock_changed(products, previous):
+    """Announce new stock levels; ``previous`` maps product ids to the
+    stock they had before."""
+    publish_on_commit(PRODUCT_STOCK_CHANGED, (
+        {'id': product.pk, 'name': product.name, 'stock': product.stock,
+         'previous_stock': previous.get(product.pk)}
+        for product in products))
@@ -0,0 +1,161 @@
+"""Sharded, incremental CRM reports.
+
+A report covers ``PERIOD_DAYS`` days and is split into shards of
+``SHARD_DAYS`` days that ``crm.tasks`` computes in parallel. Every shard's
+totals are kept in a ``ReportSnapshot`` whose ``computed_at`` is its
+watermark: a later run recomputes only the shards that were still open
+when computed or whose days' orders changed since (``DailyRevenue`` notes
+when each day changed). The report itself is assembled from its shard
+snapshots and delivered once per distinct result. Configured with
+``CRM_REPORT``.
+"""
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .filters import start_of_day
+from .models import Customer, DailyRevenue, Order, ReportSnapshot
+
+
+def get_config():
+    config = {
+        'PERIOD_DAYS': 7,
+        'SHARD_DAYS': 1,
+        'URL': 'https://example.com/api/crm-report',
+        # seconds to connect and to wait for the endpoint's answer
+        'TIMEOUT': 10,
+        'SENDER': 'crm.reports.post_report',
+        'LOG_FILE': '/tmp/crm_report_log.txt',
+    }
+    config.update(getattr(settings, 'CRM_REPORT', {}))
+    return config
+
+
+def report_period(start=None, end=None):
+    """``(start, end)`` dates of a report, ``end`` exclusive; by default
+    the ``PERIOD_DAYS`` days before today."""
+    if end is None:
+        end = timezone.localdate()
+    if start is None:
+        start = end - timedelta(days=get_config()['PERIOD_DAYS'])
+    return start, end
+
+
+def shards(start, end):
+    size = timedelta(days=get_config()['SHARD_DAYS'])
+    shard_start = start
+    while shard_start < end:
+        yield shard_start, min(shard_start + size, end)
+        shard_start += size
+
+
+def _is_stale(snapshot, start, end, changed):
+    if snapshot is None:
+        return True
+    # the shard's last day was not over yet when it was computed
+    if snapshot.computed_at < start_of_day(end):
+        return True
+    days = (start + timedelta(days=offset)
+            for offset in range((end - start).days))
+    return any(day in changed and changed[day] > snapshot.computed_at
+               for day in days)
+
+
+def stale_shards(start, end):
+    """The shards of ``start``..``end`` whose snapshot is missing or out
+    of date."""
+    snapshots = {
+        (snapshot.start, snapshot.end): snapshot
+        for snapshot in ReportSnapshot.objects.filter(
+            kind=ReportSnapshot.SHARD, start__gte=start, end__lte=end)
+    }
+    changed = dict(DailyRevenue.objects.filter(
+        day__gte=start, day__lt=end).values_list('day', 'updated_at'))
+    return [
+        (shard_start, shard_end)
+        for shard_start, shard_end in shards(start, end)
+        if _is_stale(snapshots.get((shard_start, shard_end)), shard_start,
+                     shard_end, changed)
+    ]
+
+
+def compute_shard(start, end):
+    # taken first, so changes made while the totals are read count as
+    # newer than the snapshot
+    computed_at = timezone.now()
+    lower, upper = start_of_day(start), start_of_day(end)
+    orders = Order.objects.filter(
+        order_date__gte=lower, order_date__lt=upper).aggregate(
+        count=Count('id'), revenue=Sum('total_amount'))
+    new_customers = Customer.objects.filter(
+        created_at__gte=lower, created_at__lt=upper).count()
+    snapshot, _ = ReportSnapshot.objects.update_or_create(
+        kind=ReportSnapshot.SHARD, start=start, end=end, defaults={
+            'order_count': orders['count'],
+            'revenue': orders['revenue'] or 0,
+            'new_customers': new_customers,
+            'computed_at': computed_at,
+        })
+    return snapshot
+
+
+def assemble_report(start, end):
+    """Sum the shard snapshots of ``start``..``end`` into the report's
+    snapshot. A report whose totals changed is due for delivery again."""
+    totals = ReportSnapshot.objects.filter(
+        kind=ReportSnapshot.SHARD, start__gte=start, end__lte=end).aggregate(
+        order_count=Sum('order_count'), revenue=Sum('revenue'),
+        new_customers=Sum('new_customers'))
+    totals = {name: value or 0 for name, value in totals.items()}
+    snapshot, created = ReportSnapshot.objects.get_or_create(
+        kind=ReportSnapshot.REPORT, start=start, end=end, defaults=totals)
+    if not created and any(getattr(snapshot, name) != value
+                           for name, value in totals.items()):
+        for name, value in totals.items():
+            setattr(snapshot, name, value)
+        snapshot.computed_at = timezone.now()
+        snapshot.delivered_at = None
+        snapshot.save()
+    return snapshot
+
+
+def report_payload(snapshot):
+    return {
+        'start': snapshot.start.isoformat(),
+        'end': snapshot.end.isoformat(),
+        'orders': snapshot.order_count,
+        'customers': snapshot.new_customers,
+        'revenue': str(snapshot.revenue),
+        'computed_at': snapshot.computed_at.isoformat(),
+    }
+
+
+def post_report(payload, url, timeout):
+    response = requests.post(url, json=payload, timeout=timeout)
+    response.raise_for_status()
+
+
+def deliver(snapshot):
+    """Send ``snapshot`` with the configured ``SENDER``; it raises a
+    ``requests.RequestException`` when the report should be retried."""
+    config = get_config()
+    sender = import_string(config['SENDER'])
+    sender(report_payload(snapshot), config['URL'], config['TIMEOUT'])
+    ReportSnapshot.objects.filter(pk=snapshot.pk).update(
+        delivered_at=timezone.now())
+
+
+def log_report(snapshot):
+    path = get_config()['LOG_FILE']
+    if not path:
+        return
+    with open(path, 'a') as f:
+        f.write(f"{timezone.now():%Y-%m-%d %H:%M:%S} - Report "
+                f"{snapshot.start} - {snapshot.end}: "
+                f"{snapshot.new_customers} customers, "
+                f"{snapshot.order_count} orders, "
+                f"{snapshot.revenue} revenue\n")
@@ -0,0 +1,199 @@
+"""Opt-in cache of read-only GraphQL results.
+
+Enabled by the ``CRM_RESPONSE_CACHE`` setting, e.g.::
+
+    CRM_RESPONSE_CACHE = {
+        'CACHE': 'default',            # Django cache alias
+        'HINTS': {'Query.allProducts': 600},
+    }
+
+A query is cached only if every root field it selects has a TTL hint; the
+entry lives for the smallest hint among the fields it selects. Entries are
+tagged with the models the query can read and a write to one of those
+models (see ``crm.signals`` and ``crm.bulk``) moves the tag to a new
+version, which makes every entry built on the old version unreachable.
+"""
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from graphql import (
+    OperationType, TypeInfo, TypeInfoVisitor, Visitor, get_named_type,
+    is_abstract_type, print_ast, visit,
+)
+
+from .persisted_queries import CacheMetrics, LRUCache
+
+# seconds each field may be served from the cache, by schema coordinate
+DEFAULT_HINTS = {
+    'Query.allProducts': 300,
+    'Query.product': 300,
+    'Query.allCustomers': 120,
+    'Query.customer': 120,
+    'Query.allOrders': 60,
+    'Query.order': 60,
+    'Query.allRevenue': 60,
+    'Query.revenueByDay': 60,
+    'Query.revenueByCustomer': 60,
+    'Query.topProducts': 60,
+    'Query.revenueByProduct': 60,
+}
+
+# tags of the rows a field reads when its type is not a model type
+FIELD_TAGS = {
+    'Query.allRevenue': {'order'},
+    'Query.topProducts': {'order'},
+    'Query.revenueByProduct': {'order'},
+}
+
+# the revenue summaries and order items change exactly when orders do
+MODEL_TAGS = {
+    'dailyrevenue': 'order',
+    'customerrevenue': 'order',
+    'orderitem': 'order',
+}
+
+TAG_PREFIX = 'graphql:tag:'
+KEY_PREFIX = 'graphql:result:'
+
+metrics = CacheMetrics()
+_policies = LRUCache(256)
+
+
+class CachePolicy:
+    def __init__(self, ttl, tags):
+        self.ttl = ttl
+        self.tags = frozenset(tags)
+        self.document_key = None
+
+
+def get_config():
+    return getattr(settings, 'CRM_RESPONSE_CACHE', None)
+
+
+def get_cache():
+    return caches[get_config().get('CACHE', 'default')]
+
+
+def get_hints():
+    return {**DEFAULT_HINTS, **get_config().get('HINTS', {})}
+
+
+def model_tag(model):
+    name = model._meta.model_name
+    return MODEL_TAGS.get(name, name)
+
+
+def _type_tags(gql_type, schema):
+    types = (schema.get_possible_types(gql_type)
+             if is_abstract_type(gql_type) else [gql_type])
+    tags = set()
+    for possible in types:
+        meta = getattr(getattr(possible, 'graphene_type', None), '_meta', None)
+        model = getattr(meta, 'model', None)
+        if model is not None:
+            tags.add(model_tag(model))
+    return tags
+
+
+def analyze(schema, document, hints):
+    """Return the ``CachePolicy`` of a query document, or None when one of
+    its root fields has no TTL hint."""
+    type_info = TypeInfo(schema)
+    query_type = schema.query_type
+    state = {'ttl': None, 'tags': set(), 'cacheable': True}
+
+    class Collector(Visitor):
+        def enter_field(self, node, *args):
+            parent = type_info.get_parent_type()
+            field_type = type_info.get_type()
+            if parent is None or field_type is None:
+                return
+            coordinate = f'{parent.name}.{node.name.value}'
+            ttl = hints.get(coordinate)
+            if ttl is not None:
+                state['ttl'] = ttl if state['ttl'] is None else min(
+                    state['ttl'], ttl)
+            elif parent is query_type and not node.name.value.startswith('__'):
+                state['cacheable'] = False
+            state['tags'] |= FIELD_TAGS.get(coordinate, set())
+            state['tags'] |= _type_tags(get_named_type(field_type), schema)
+
+    visit(document, TypeInfoVisitor(type_info, Collector()))
+    if not state['cacheable'] or not state['ttl']:
+        return None
+    policy = CachePolicy(state['ttl'], state['tags'])
+    policy.document_key = hashlib.sha256(
+        print_ast(document).encode('utf-8')).hexdigest()
+    return policy
+
+
+def get_policy(schema, document, operation_ast, query_digest):
+    """The cache policy for one request, or None if it must not be cached."""
+    if get_config() is None or operation_ast is None:
+        return None
+    if operation_ast.operation != OperationType.QUERY:
+        return None
+    cached = _policies.get(query_digest)
+    if cached is None:
+        # False marks documents already found uncacheable
+        cached = analyze(schema, document, get_hints()) or False
+        _policies.set(query_digest, cached)
+    return cached or None
+
+
+def _tag_versions(cache, tags):
+    keys = [TAG_PREFIX + tag for tag in sorted(tags)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # a fresh version, so entries from before an eviction of the
+            # tag key can never match again
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def cache_key(policy, variables, operation_name, request):
+    user = getattr(request, 'user', None)
+    user_key = user.pk if getattr(user, 'is_authenticated', False) else None
+    versions = _tag_versions(get_cache(), policy.tags)
+    raw = json.dumps(
+        [policy.document_key, operation_name, variables, user_key, versions],
+        sort_keys=True, default=str)
+    return KEY_PREFIX + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get_result(key):
+    data = get_cache().get(key)
+    if data is None:
+        metrics.miss()
+    else:
+        metrics.hit()
+    return data
+
+
+def set_result(key, policy, data):
+    get_cache().set(key, data, policy.ttl)
+
+
+def invalidate(*tags):
+    if get_config() is None:
+        return
+    get_cache().set_many(
+        {TAG_PREFIX + tag: uuid.uuid4().hex for tag in tags}, None)
+
+
+def invalidate_on_commit(*tags):
+    """Invalidate ``tags`` once the current transaction commits, so readers
+    cannot cache rows that are still about to change."""
+    if get_config() is not None:
+        transaction.on_commit(lambda: invalidate(*tags))
+
+
+def reset():
+    _policies.clear()
+    metrics.reset()
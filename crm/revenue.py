@@ -0,0 +1,121 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .filters import start_of_day
+from .models import CustomerRevenue, DailyRevenue, Order, OrderItem
+from .response_cache import invalidate_on_commit
+
+TRACKED_FIELDS = ('customer_id', 'order_date', 'total_amount')
+
+CENT = Decimal('0.01')
+
+
+def revenue_row(order):
+    """The ``(customer_id, day, total)`` an order contributes, or None when
+    one of the tracked fields was not loaded."""
+    values = order.__dict__
+    if any(name not in values for name in TRACKED_FIELDS):
+        return None
+    order_date = values['order_date']
+    if timezone.is_aware(order_date):
+        order_date = timezone.localtime(order_date)
+    return (values['customer_id'], order_date.date(),
+            Decimal(str(values['total_amount'])))
+
+
+def _bump(model, lookup, count, amount):
+    # update() skips field defaults, so the change time is set here
+    changes = {'order_count': F('order_count') + count,
+               'revenue': F('revenue') + amount,
+               'updated_at': timezone.now()}
+    updated = model.objects.filter(**lookup).update(**changes)
+    if updated or count < 0:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(order_count=count, revenue=amount, **lookup)
+    except IntegrityError:
+        # created concurrently; add to that row instead
+        model.objects.filter(**lookup).update(**changes)
+
+
+def apply_rows(added=(), removed=()):
+    """Fold the contribution of added and removed orders into the
+    summaries with one UPDATE per affected day and customer."""
+    days = defaultdict(lambda: [0, Decimal(0)])
+    customers = defaultdict(lambda: [0, Decimal(0)])
+    for sign, rows in ((1, added), (-1, removed)):
+        for customer_id, day, total in rows:
+            for bucket, key in ((days, day), (customers, customer_id)):
+                bucket[key][0] += sign
+                bucket[key][1] += sign * total
+
+    with transaction.atomic():
+        for day, (count, amount) in days.items():
+            if count or amount:
+                _bump(DailyRevenue, {'day': day}, count, amount)
+        for customer_id, (count, amount) in customers.items():
+            if count or amount:
+                _bump(CustomerRevenue, {'customer_id': customer_id},
+                      count, amount)
+
+
+def record_orders(orders):
+    """Account for orders written without save(), e.g. by bulk_create."""
+    apply_rows(added=[revenue_row(order) for order in orders])
+
+
+def total_revenue():
+    return DailyRevenue.objects.aggregate(total=Sum('revenue'))['total']
+
+
+def product_sales(order_by, first=10, start=None, end=None):
+    """The ``first`` products by ``order_by`` (``'quantity'`` or
+    ``'revenue'``) with their units sold, revenue and orders, grouped in
+    the database from the captured ``OrderItem`` prices. ``start`` and
+    ``end`` (inclusive days) narrow it to the orders placed in between.
+    Revenue is rounded to the cent: SQLite sums decimals as floats."""
+    items = OrderItem.objects.all()
+    if start:
+        items = items.filter(order__order_date__gte=start_of_day(start))
+    if end:
+        items = items.filter(
+            order__order_date__lt=start_of_day(end + timedelta(days=1)))
+    rows = list(
+        items.values('product_id')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('line_total'),
+                  order_count=Count('id'))
+        .order_by(f'-{order_by}', 'product_id')[:first]
+    )
+    for row in rows:
+        row['revenue'] = row['revenue'].quantize(CENT)
+    return rows
+
+
+def rebuild_summaries():
+    """Recompute both summary tables from the orders table."""
+    with transaction.atomic():
+        DailyRevenue.objects.all().delete()
+        CustomerRevenue.objects.all().delete()
+        DailyRevenue.objects.bulk_create(
+            DailyRevenue(day=row['day'], order_count=row['count'],
+                         revenue=row['revenue'])
+            for row in Order.objects.annotate(day=TruncDate('order_date'))
+            .values('day')
+            .annotate(count=Count('id'), revenue=Sum('total_amount'))
+            .order_by()
+        )
+        CustomerRevenue.objects.bulk_create(
+            CustomerRevenue(customer_id=row['customer_id'],
+                            order_count=row['count'], revenue=row['revenue'])
+            for row in Order.objects.values('customer_id')
+            .annotate(count=Count('id'), revenue=Sum('total_amount'))
+            .order_by()
+        )
+        invalidate_on_commit('order')
@@ -1,13 +1,59 @@
+from decimal import Decimal
+
 import graphene
-import re
 from .models import Customer, Order
 from graphene_django.types import DjangoObjectType
 from django.db import transaction
 from django.utils import timezone
+from graphql import GraphQLError
+from graphql_relay import from_global_id
 from .filters import CustomerFilter, ProductFilter, OrderFilter
-from graphene_django.filter import DjangoFilterConnectionField
-from crm.models import Product
-from django.db.models import Sum
+from crm.models import BulkJob, CustomerRevenue, DailyRevenue, Product
+from .bulk import (LOW_STOCK_THRESHOLD, PHONE_RE, RESTOCK_INCREMENT,
+                   bulk_create_customers, bulk_create_orders, line_items,
+                   mark_reminded, parse_product_ids, restock_low_stock,
+                   save_line_items)
+from .fields import BatchedConnectionField
+from .loaders import get_loaders
+from .optimizer import is_prefetched, optimize_queryset
+from .pagination import CountableConnection
+from .pubsub import (ORDER_CREATED, PRODUCT_STOCK_CHANGED, get_pubsub,
+                     orders_created, stock_changed)
+from .revenue import product_sales, total_revenue
+from .tasks import start_bulk_job
+
+
+class OrderRelationsMixin:
+    """Resolves an order's customer and products through the per-request
+    loaders, so lists and pages of orders fetch them in one query each."""
+
+    # queue the customer and product set of every order in the page so
+    # the first edge resolved fetches them all in one query each; rows the
+    # optimizer already joined or prefetched are primed instead
+    @classmethod
+    def prime_loaders(cls, info, orders):
+        loaders = get_loaders(info)
+        for order in orders:
+            if Order.customer.is_cached(order):
+                loaders.customer.prime(order.customer_id, order.customer)
+            if is_prefetched(order, 'products'):
+                loaders.order_products.prime(
+                    order.pk, list(order.products.all()))
+        # a pruned customer_id means the customer was not selected
+        loaders.customer.want(
+            order.customer_id for order in orders
+            if 'customer_id' not in order.get_deferred_fields())
+        loaders.order_products.want(order.pk for order in orders)
+
+    def resolve_customer(self, info):
+        if Order.customer.is_cached(self):
+            return self.customer
+        return get_loaders(info).customer.load(self.customer_id)
+
+    def resolve_products(self, info):
+        if is_prefetched(self, 'products'):
+            return list(self.products.all())
+        return get_loaders(info).order_products.load(self.pk)
 
 
 # create GraphQl types for Mutation
@@ -23,10 +69,11 @@ class ProductType(DjangoObjectType):
         fields = ['id', 'name', 'price', 'stock']
 
 
-class OrderType(DjangoObjectType):
+class OrderType(OrderRelationsMixin, DjangoObjectType):
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'order_date', 'total_amount']
+        fields = ['id', 'customer', 'order_date', 'total_amount',
+                  'reminded_at']
 
     # To ensure nested objects (e.g. orders with customer
     # and product details) are supported:
@@ -34,29 +81,82 @@ class OrderType(DjangoObjectType):
     products = graphene.List(lambda: ProductType)
 
 
+class DailyRevenueType(DjangoObjectType):
+    class Meta:
+        model = DailyRevenue
+        fields = ['day', 'order_count', 'revenue']
+
+
+class CustomerRevenueType(DjangoObjectType):
+    class Meta:
+        model = CustomerRevenue
+        fields = ['customer', 'order_count', 'revenue']
+
+    customer = graphene.Field(lambda: CustomerType)
+
+
+class ProductSalesType(graphene.ObjectType):
+    product = graphene.Field(ProductType)
+    quantity = graphene.Int()
+    revenue = graphene.Decimal()
+    order_count = graphene.Int()
+
+
+def resolve_product_sales(order_by, first, start, end):
+    rows = product_sales(order_by, first, start, end)
+    products = Product.objects.in_bulk(row['product_id'] for row in rows)
+    for row in rows:
+        row['product'] = products.get(row['product_id'])
+    return rows
+
+
+class BulkJobType(DjangoObjectType):
+    class Meta:
+        model = BulkJob
+        fields = ['id', 'kind', 'status', 'total', 'processed', 'created',
+                  'failed', 'errors', 'error', 'created_at', 'started_at',
+                  'finished_at']
+
+    errors = graphene.List(graphene.String)
+    progress = graphene.Float()
+
+    def resolve_progress(self, info):
+        return self.processed / self.total if self.total else 1.0
+
+
 # Define Relay-Compatible Types for filters
 class CustomerNode(DjangoObjectType):
     class Meta:
         model = Customer
         interfaces = (graphene.relay.Node,)
         filterset_class = CustomerFilter
+        connection_class = CountableConnection
         fields = '__all__'
 
+    orders = BatchedConnectionField(lambda: OrderNode)
+
 
 class ProductNode(DjangoObjectType):
     class Meta:
         model = Product
         interfaces = (graphene.relay.Node,)
         filterset_class = ProductFilter
+        connection_class = CountableConnection
         fields = '__all__'
 
+    order_set = BatchedConnectionField(lambda: OrderNode)
+
 
-class OrderNode(DjangoObjectType):
+class OrderNode(OrderRelationsMixin, DjangoObjectType):
     class Meta:
         model = Order
         interfaces = (graphene.relay.Node,)
         filterset_class = OrderFilter
-        fields = ['id', 'customer', 'order_date', 'total_amount']
+        connection_class = CountableConnection
+        fields = ['id', 'customer', 'order_date', 'total_amount',
+                  'reminded_at']
+
+    products = graphene.List(lambda: ProductNode)
 
 
 # Creating Mutation
@@ -74,7 +174,7 @@ class CreateCustomer(graphene.Mutation):
         if Customer.objects.filter(email=email).exists():
             return CreateCustomer(
                 success=False, message="Email already exists.")
-        if phone and not re.match(r'^(\+\d{10,15}|\d{3}-\d{3}-\d{4}|\d{10,15})$', phone):
+        if phone and not PHONE_RE.match(phone):
             return CreateCustomer(
                 success=False, message='Invalid phone format.')
         customer = Customer(name=name, email=email, phone=phone)
@@ -86,36 +186,19 @@ class CreateCustomer(graphene.Mutation):
 class BulkCreateCustomers(graphene.Mutation):
     class Arguments:
         customers = graphene.List(graphene.JSONString, required=True)
+        batch_size = graphene.Int()
+        background = graphene.Boolean()
     created_customers = graphene.List(CustomerType)
     errors = graphene.List(graphene.String)
-
-    def mutate(self, info, customers):
-        # make a list for Created customers and Errors made
-        created = []
-        errors = []
-
-        with transaction.atomic():
-            for idx, data in enumerate(customers):
-
-                try:
-                    name = data.get('name')
-                    email = data.get('email')
-                    phone = data.get('phone')
-
-                    if not name or not email:
-                        return ValueError('Missing required fields.')
-
-                    if phone and not re.match(r'^(\+\d{10,15}|\d{3}-\d{3}-\d{4}|\d{10,15})$', phone):
-                        return ValueError('invalid phone format')
-
-                    if Customer.objects.filter(email=email).exists():
-                        return ValueError('Email already exist')
-
-                    customer = Customer(name=name, email=email, phone=phone)
-                    customer.save()
-                    created.append(customer)
-                except Exception as e:
-                    errors.append(f'Record {idx+1} : {str(e)}')
+    job = graphene.Field(BulkJobType)
+
+    def mutate(self, info, customers, batch_size=None, background=False):
+        if background:
+            # imported by a Celery task; poll job(id) for the result
+            return BulkCreateCustomers(
+                job=start_bulk_job('customers', customers, batch_size))
+        # bad records are collected in errors; the rest are still created
+        created, errors = bulk_create_customers(customers, batch_size)
         return BulkCreateCustomers(created_customers=created, errors=errors)
 
 
@@ -129,7 +212,7 @@ class CreateProduct(graphene.Mutation):
     message = graphene.String()
     product = graphene.Field(ProductType)
 
-    def mutate(self, info, name, price, stock):
+    def mutate(self, info, name, price, stock=0):
         if price < 0:
             return CreateProduct(success=False,
                                  message='Price must be positive')
@@ -138,6 +221,7 @@ class CreateProduct(graphene.Mutation):
                                  message='Stock must be positive')
         product = Product(name=name, price=price, stock=stock)
         product.save()
+        stock_changed([product], {})
         return CreateProduct(product=product, success=True,
                              message='Product succesfully Created')
 
@@ -152,7 +236,7 @@ class CreateOrder(graphene.Mutation):
     success = graphene.Boolean()
     message = graphene.String()
 
-    def mutate(self, info, customer_id, product_ids, order_date):
+    def mutate(self, info, customer_id, product_ids, order_date=None):
         try:
             customer = Customer.objects.get(id=customer_id)
         except Customer.DoesNotExist:
@@ -162,44 +246,106 @@ class CreateOrder(graphene.Mutation):
             return CreateOrder(
                 success=False, message='one product must be selected')
 
-        products = Product.objects.filter(id__in=product_ids)
-        if products.count() != len(product_ids):
+        # a product listed n times is ordered n times
+        try:
+            quantities = parse_product_ids(product_ids)
+            prices = dict(Product.objects.filter(
+                id__in=quantities).values_list('id', 'price'))
+            valid = len(prices) == len(quantities)
+        except ValueError:
+            valid = False
+        if not valid:
             return CreateOrder(
                 success=False, message='One or more product IDs are invalid.')
-        total_price = sum(p.price for p in products)
+        items = line_items(quantities, prices)
         order = Order(customer=customer,
                       order_date=order_date or timezone.now(),
-                      total_amount=total_price)
-        order.save()
-        order.products.set(products)
+                      total_amount=sum(item.line_total for item in items))
+        with transaction.atomic():
+            order.save()
+            save_line_items([order], [items])
+        orders_created([order])
         return CreateOrder(order=order, success=True,
                            message='Order created successfully.')
 
 
+class OrderInput(graphene.InputObjectType):
+    customer_id = graphene.ID(required=True)
+    product_ids = graphene.List(graphene.ID, required=True)
+    order_date = graphene.DateTime()
+
+
+class BulkCreateOrders(graphene.Mutation):
+    class Arguments:
+        orders = graphene.List(OrderInput, required=True)
+        background = graphene.Boolean()
+
+    orders = graphene.List(OrderType)
+    errors = graphene.List(graphene.String)
+    job = graphene.Field(BulkJobType)
+
+    def mutate(self, info, orders, background=False):
+        if background:
+            records = [{
+                'customer_id': order.customer_id,
+                'product_ids': order.product_ids,
+                'order_date': (order.order_date
+                               and order.order_date.isoformat()),
+            } for order in orders]
+            return BulkCreateOrders(job=start_bulk_job('orders', records))
+        # customers and products for the whole batch are fetched once and
+        # everything is written in a single transaction
+        created, errors = bulk_create_orders(orders)
+        OrderType.prime_loaders(info, created)
+        return BulkCreateOrders(orders=created, errors=errors)
+
+
 class UpdateLowStockProducts(graphene.Mutation):
     class Arguments:
-        pass
+        threshold = graphene.Int()
+        increment = graphene.Int()
 
-    updatedproduct = graphene.List(ProductType)
+    updated_products = graphene.List(ProductType)
     success = graphene.Boolean()
     message = graphene.String()
 
-    def mutate(self):
-        low_stock_product = Product.objects.filter(stock__lt=10)
-        updated = []
-        for product in low_stock_product:
-            product += 10
-            product.save()
-            updated.append(product)
-            if updated:
-                msg = f'{len(updated)} Products has been restocked'
-            else:
-                msg = 'No Product needed Restocking.'
+    def mutate(self, info, threshold=LOW_STOCK_THRESHOLD,
+               increment=RESTOCK_INCREMENT):
+        if increment <= 0:
             return UpdateLowStockProducts(
-                success=True,
-                message=msg,
-                updatedproduct=updated
-            )
+                success=False, message='Increment must be positive')
+        updated = restock_low_stock(threshold, increment)
+        if updated:
+            msg = f'{len(updated)} Products has been restocked'
+        else:
+            msg = 'No Product needed Restocking.'
+        return UpdateLowStockProducts(
+            success=True,
+            message=msg,
+            updated_products=updated
+        )
+
+
+class MarkOrdersReminded(graphene.Mutation):
+    """Record that the given orders (``OrderNode`` ids) were reminded.
+    Orders reminded before are left alone, so retries are harmless."""
+
+    class Arguments:
+        order_ids = graphene.List(graphene.ID, required=True)
+
+    marked = graphene.Int()
+
+    def mutate(self, info, order_ids):
+        pks = []
+        for order_id in order_ids:
+            try:
+                type_name, pk = from_global_id(order_id)
+                if type_name != OrderNode._meta.name:
+                    raise ValueError(type_name)
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                raise GraphQLError(f'Invalid order id: {order_id}')
+        return MarkOrdersReminded(marked=mark_reminded(pks))
 
 
 # creating Mutation feild
@@ -208,51 +354,119 @@ class Mutation(graphene.ObjectType):
     bulk_create_customers = BulkCreateCustomers.Field()
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
+    mark_orders_reminded = MarkOrdersReminded.Field()
 
 
 # creating Query feilds
 class Query(graphene.ObjectType):
-    # Relay-compatible query fields with filters and sorting
-    all_customers = DjangoFilterConnectionField(
-        CustomerNode,
-        order_by=graphene.List(of_type=graphene.String)  # e.g., ["name", "-email"]
-    )
-    all_products = DjangoFilterConnectionField(
-        ProductNode,
-        order_by=graphene.List(of_type=graphene.String)  # e.g., ["price", "-stock"]
-    )
-    all_orders = DjangoFilterConnectionField(
-        OrderNode,
-        order_by=graphene.List(of_type=graphene.String)  # e.g., ["order_date", "-total_amount"]
-    )
+    # Relay-compatible query fields with filters and sorting,
+    # e.g. orderBy: "-orderDate,totalAmount"
+    all_customers = BatchedConnectionField(CustomerNode)
+    all_products = BatchedConnectionField(ProductNode)
+    all_orders = BatchedConnectionField(OrderNode)
     all_revenue = graphene.Float()
+    revenue_by_day = graphene.List(
+        DailyRevenueType, start=graphene.Date(), end=graphene.Date())
+    revenue_by_customer = graphene.List(
+        CustomerRevenueType, first=graphene.Int())
+    # aggregated over the order items, with the prices paid
+    top_products = graphene.List(
+        ProductSalesType, first=graphene.Int(), start=graphene.Date(),
+        end=graphene.Date())
+    revenue_by_product = graphene.List(
+        ProductSalesType, first=graphene.Int(), start=graphene.Date(),
+        end=graphene.Date())
 
     # Single object lookups
     customer = graphene.relay.Node.Field(CustomerNode)
     product = graphene.relay.Node.Field(ProductNode)
     order = graphene.relay.Node.Field(OrderNode)
+    job = graphene.Field(BulkJobType, id=graphene.UUID(required=True))
 
-    # Resolvers with sorting logic
-    def resolve_all_customers(root, info, order_by=None, **kwargs):
-        qs = Customer.objects.all()
-        if order_by:
-            qs = qs.order_by(*order_by)
-        return qs
+    # Sorting is applied by the filtersets' order_by filter
+    def resolve_all_customers(root, info, **kwargs):
+        return optimize_queryset(Customer.objects.all(), info)
 
-    def resolve_all_products(root, info, order_by=None, **kwargs):
-        qs = Product.objects.all()
-        if order_by:
-            fields = order_by.split(",")
-            qs = qs.order_by(*fields)
-        return qs
+    def resolve_all_products(root, info, **kwargs):
+        return optimize_queryset(Product.objects.all(), info)
 
-    def resolve_all_orders(root, info, order_by=None, **kwargs):
-        qs = Order.objects.all()
-        if order_by:
-            qs = qs.order_by(*order_by)
-        return qs
+    def resolve_all_orders(root, info, **kwargs):
+        return optimize_queryset(Order.objects.all(), info)
+
+    def resolve_job(root, info, id):
+        return BulkJob.objects.filter(pk=id).first()
 
+    # Revenue is read from the summaries kept up to date by crm.signals
     def resolve_all_revenue(root, info, **kwargs):
-        qs = float(Order.objects.aggregate(total=Sum("total_amount"))["total"] or 0.0)
+        return float(total_revenue() or 0.0)
+
+    def resolve_revenue_by_day(root, info, start=None, end=None):
+        qs = DailyRevenue.objects.order_by('day')
+        if start:
+            qs = qs.filter(day__gte=start)
+        if end:
+            qs = qs.filter(day__lte=end)
         return qs
+
+    def resolve_revenue_by_customer(root, info, first=None):
+        qs = CustomerRevenue.objects.select_related('customer').order_by(
+            '-revenue', 'customer_id')
+        if first is not None:
+            qs = qs[:first]
+        return qs
+
+    def resolve_top_products(root, info, first=10, start=None, end=None):
+        return resolve_product_sales('quantity', first, start, end)
+
+    def resolve_revenue_by_product(root, info, first=10, start=None,
+                                   end=None):
+        return resolve_product_sales('revenue', first, start, end)
+
+
+# Subscriptions, served over WebSockets by crm.websocket. Filters are
+# applied to the published events before anything is read from the
+# database; matching events are resolved like any other object.
+class Subscription(graphene.ObjectType):
+    order_created = graphene.Field(
+        OrderType, customer_id=graphene.ID(), min_total=graphene.Decimal())
+    product_stock_changed = graphene.Field(
+        ProductType, product_ids=graphene.List(graphene.ID))
+    low_stock_alert = graphene.Field(ProductType, threshold=graphene.Int())
+
+    async def subscribe_order_created(root, info, customer_id=None,
+                                      min_total=None):
+        async for event in get_pubsub().subscribe(ORDER_CREATED):
+            if customer_id and str(event['customer_id']) != customer_id:
+                continue
+            if (min_total is not None and
+                    Decimal(event['total_amount']) < min_total):
+                continue
+            yield event
+
+    async def subscribe_product_stock_changed(root, info, product_ids=None):
+        wanted = set(product_ids or ())
+        async for event in get_pubsub().subscribe(PRODUCT_STOCK_CHANGED):
+            if not wanted or str(event['id']) in wanted:
+                yield event
+
+    # only when the stock falls below the threshold, not on every change
+    # while it stays there
+    async def subscribe_low_stock_alert(root, info,
+                                        threshold=LOW_STOCK_THRESHOLD):
+        async for event in get_pubsub().subscribe(PRODUCT_STOCK_CHANGED):
+            previous = event['previous_stock']
+            if event['stock'] < threshold and (
+                    previous is None or previous >= threshold):
+                yield event
+
+    # the root of each event's execution is the published event
+    def resolve_order_created(event, info, **kwargs):
+        return Order.objects.filter(pk=event['id']).first()
+
+    def resolve_product_stock_changed(event, info, **kwargs):
+        return Product.objects.filter(pk=event['id']).first()
+
+    def resolve_low_stock_alert(event, info, **kwargs):
+        return Product.objects.filter(pk=event['id']).first()
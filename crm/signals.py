@@ -0,0 +1,80 @@
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+
+from .models import Customer, Order, Product
+from .response_cache import invalidate_on_commit, model_tag
+from .revenue import TRACKED_FIELDS, apply_rows, revenue_row
+
+
+def stored_revenue_row(instance):
+    """What the stored order contributes to the revenue summaries; fills
+    in the tracked fields ``instance`` was loaded without."""
+    stored = Order.objects.filter(pk=instance.pk).values(*TRACKED_FIELDS)
+    for values in stored:
+        for name, value in values.items():
+            instance.__dict__.setdefault(name, value)
+        return revenue_row(Order(**values))
+    return None
+
+
+def tracks_revenue(update_fields):
+    if update_fields is None:
+        return True
+    return not {'customer', *TRACKED_FIELDS}.isdisjoint(update_fields)
+
+
+# The stored contribution of an order is read when it is saved, not when it
+# is loaded, so reads pay nothing for the summaries; a saved instance keeps
+# its new row and is not read again on its next save.
+@receiver(pre_save, sender=Order)
+def load_revenue_row(sender, instance, update_fields=None, **kwargs):
+    if (instance._state.adding or '_revenue_row' in instance.__dict__
+            or not tracks_revenue(update_fields)):
+        return
+    instance._revenue_row = stored_revenue_row(instance)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, update_fields=None, **kwargs):
+    if not (created or tracks_revenue(update_fields)):
+        return
+    old = None if created else instance.__dict__.get('_revenue_row')
+    new = revenue_row(instance)
+    if old != new:
+        apply_rows(added=[new], removed=[old] if old else [])
+    instance._revenue_row = new
+
+
+@receiver(pre_delete, sender=Order)
+def load_deleted_revenue_row(sender, instance, **kwargs):
+    if ('_revenue_row' not in instance.__dict__
+            and revenue_row(instance) is None):
+        # loaded with deferred fields
+        instance._revenue_row = stored_revenue_row(instance)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    row = instance.__dict__.get('_revenue_row') or revenue_row(instance)
+    if row:
+        apply_rows(removed=[row])
+
+
+# Cached GraphQL responses that read a model are dropped when it changes.
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+def invalidate_cached_responses(sender, **kwargs):
+    invalidate_on_commit(model_tag(sender))
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        # the link is visible from both sides
+        invalidate_on_commit(model_tag(Order), model_tag(Product))
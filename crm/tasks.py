@@ -1,44 +1,69 @@
-from celery import shared_task
-from datetime import datetime
-from graphene_django.settings import graphene_settings
-from graphql import graphql_sync
+from celery import chord, shared_task
+from django.db import transaction
+from django.utils.dateparse import parse_date
 import requests
 
+from . import jobs, reports
+from .models import ReportSnapshot
 
+
+# Dates travel as ISO strings, the tasks' arguments are JSON.
 @shared_task
-def generate_crm_report():
-    schema = graphene_settings.SCHEMA
-
-    query = '''
-    query {
-        allCustomers
-        allOrders
-        allRevenue
-    }
-    '''
-
-    result = graphql_sync(schema, query)
-    data = result.data
-
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_line = f"{timestamp} - Report: {data['allCustomers']} customers, {data['allOrders']} orders, {data['allRevenue']} revenue\n"
-
-    # ✅ Log to local file
-    with open('/tmp/crm_report_log.txt', 'a') as f:
-        f.write(log_line)
-
-    # ✅ Send report to remote endpoint
-    payload = {
-        "timestamp": timestamp,
-        "customers": data['allCustomers'],
-        "orders": data['allOrders'],
-        "revenue": data['allRevenue']
-    }
-
-    try:
-        response = requests.post("https://example.com/api/crm-report", json=payload)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        # Optional: log the error locally
-        with open('/tmp/crm_report_log.txt', 'a') as f:
-            f.write(f"{timestamp} - Failed to send report: {e}\n")
+def generate_crm_report(start=None, end=None):
+    """Recompute the out-of-date shards of the report period in parallel,
+    then assemble (and deliver) the report from the shard snapshots."""
+    start, end = reports.report_period(start and parse_date(start),
+                                       end and parse_date(end))
+    assemble = assemble_crm_report.si(start.isoformat(), end.isoformat())
+    stale = reports.stale_shards(start, end)
+    if not stale:
+        return assemble.delay().id
+    return chord(
+        compute_report_shard.si(shard_start.isoformat(),
+                                shard_end.isoformat())
+        for shard_start, shard_end in stale
+    )(assemble).id
+
+
+# Shards and reports are recomputed from scratch, so a task lost with its
+# worker is safely run again: they are only acknowledged once done.
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def compute_report_shard(start, end):
+    return reports.compute_shard(parse_date(start), parse_date(end)).pk
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def assemble_crm_report(start, end):
+    snapshot = reports.assemble_report(parse_date(start), parse_date(end))
+    if snapshot.delivered_at is None:
+        reports.log_report(snapshot)
+        deliver_crm_report.delay(snapshot.pk)
+    return snapshot.pk
+
+
+# the endpoint is retried with exponential backoff (1s, 2s, 4s, ... up to
+# ten minutes); each attempt is bounded by CRM_REPORT['TIMEOUT']
+@shared_task(autoretry_for=(requests.RequestException,), retry_backoff=True,
+             retry_backoff_max=600, max_retries=5, acks_late=True,
+             ignore_result=True)
+def deliver_crm_report(snapshot_id):
+    snapshot = ReportSnapshot.objects.filter(pk=snapshot_id).first()
+    if snapshot is None or snapshot.delivered_at is not None:
+        return False
+    reports.deliver(snapshot)
+    return True
+
+
+# routed to the bulk queue; progress commits with every chunk, so a job
+# lost with its worker resumes where it stopped
+@shared_task(acks_late=True, reject_on_worker_lost=True, ignore_result=True)
+def bulk_import_job(job_id, batch_size=None):
+    jobs.run_job(job_id, batch_size)
+
+
+def start_bulk_job(kind, records, batch_size=None):
+    """Store ``records`` as a job, enqueued once the job is committed."""
+    job = jobs.create_job(kind, records)
+    transaction.on_commit(
+        lambda: bulk_import_job.delay(str(job.pk), batch_size))
+    return job
@@ -1,3 +1,1623 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from celery import current_app as current_celery_app
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
+from graphql import parse
+from graphql_relay import to_global_id
+
+from graphql_crm import seed_db
+from graphql_crm.schema import schema
+from . import (health, jobs, persisted_queries, pubsub, response_cache,
+               tracing)
+from .benchmark import run_suite
+from .celery import app as celery_app
+from .filters import start_of_day
+from .tasks import bulk_import_job, generate_crm_report
+from .websocket import graphql_ws_application
+from .workers import run_benchmark as run_celery_benchmark, worker_argv
+from .models import (BulkJob, Customer, CustomerRevenue, DailyRevenue,
+                     Order, OrderItem, Product, ReportSnapshot)
+
+
+ORDERS_QUERY = '''
+query ($first: Int) {
+  allOrders(first: $first) {
+    edges {
+      node {
+        id
+        totalAmount
+        customer { email }
+        products { name price }
+      }
+    }
+  }
+}
+'''
+
+
+def add_items(order, products):
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=product, unit_price=product.price,
+                  line_total=product.price)
+        for product in products)
+
+
+def create_orders(count):
+    products = [Product.objects.create(name=f'Product {i}', price=10, stock=5)
+                for i in range(3)]
+    for i in range(count):
+        customer = Customer.objects.create(
+            name=f'Customer {i}', email=f'customer{i}@example.com')
+        order = Order.objects.create(customer=customer, total_amount=20)
+        add_items(order, products[:2])
+
+
+class OrderBatchingTests(TestCase):
+    def run_orders_query(self, first):
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(ORDERS_QUERY, variables={'first': first},
+                                    context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        return result.data['allOrders']['edges'], len(ctx.captured_queries)
+
+    def test_query_count_is_constant_regardless_of_page_size(self):
+        create_orders(20)
+        small_edges, small_queries = self.run_orders_query(2)
+        large_edges, large_queries = self.run_orders_query(20)
+
+        self.assertEqual(len(small_edges), 2)
+        self.assertEqual(len(large_edges), 20)
+        self.assertEqual(small_queries, large_queries)
+        # count + page joined to customers + prefetched order products
+        self.assertEqual(large_queries, 3)
+
+    def test_nested_relations_are_resolved(self):
+        create_orders(1)
+        edges, _ = self.run_orders_query(10)
+        node = edges[0]['node']
+        self.assertEqual(node['customer']['email'], 'customer0@example.com')
+        self.assertEqual([p['name'] for p in node['products']],
+                         ['Product 0', 'Product 1'])
+
+
+class QueryOptimizerTests(TestCase):
+    def execute(self, query, variables=None):
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(query, variables=variables,
+                                    context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        return result.data, [q['sql'] for q in ctx.captured_queries]
+
+    def test_only_selected_columns_are_loaded(self):
+        create_orders(2)
+        data, queries = self.execute(
+            '{ allCustomers { edges { node { id name } } } }')
+        self.assertEqual(len(data['allCustomers']['edges']), 2)
+        page_sql = queries[-1]
+        self.assertIn('"name"', page_sql)
+        self.assertNotIn('"phone"', page_sql)
+        self.assertNotIn('"email"', page_sql)
+
+    def test_nested_connections_are_prefetched_and_filtered(self):
+        create_orders(5)
+        Order.objects.filter(customer__name='Customer 0').update(
+            total_amount=100)
+        data, queries = self.execute('''
+            {
+              allCustomers {
+                edges {
+                  node {
+                    name
+                    orders(totalAmountGte: 50) {
+                      edges { node { totalAmount customer { name } } }
+                    }
+                  }
+                }
+              }
+            }
+        ''')
+        # count + page + one prefetch for every customer's orders
+        self.assertEqual(len(queries), 3)
+        orders = {edge['node']['name']: edge['node']['orders']['edges']
+                  for edge in data['allCustomers']['edges']}
+        self.assertEqual(len(orders['Customer 0']), 1)
+        self.assertEqual(orders['Customer 1'], [])
+
+
+class KeysetPaginationTests(TestCase):
+    QUERY = '''
+    query ($after: String) {
+      allOrders(keyset: true, first: 3, after: $after,
+                orderBy: "-totalAmount", totalAmountGte: 1) {
+        pageInfo { hasNextPage endCursor }
+        edges { node { id totalAmount } }
+      }
+    }
+    '''
+
+    def test_pages_follow_ordering_and_filters_without_counting(self):
+        create_orders(10)
+        for i, order in enumerate(Order.objects.order_by('pk')):
+            order.total_amount = i % 4
+            order.save()
+        expected = list(Order.objects.filter(total_amount__gte=1)
+                        .order_by('-total_amount', 'pk')
+                        .values_list('total_amount', flat=True))
+
+        seen, after = [], None
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                result = schema.execute(self.QUERY, variables={'after': after},
+                                        context_value=SimpleNamespace())
+            self.assertIsNone(result.errors)
+            self.assertEqual(len(ctx.captured_queries), 1)
+            self.assertNotIn('COUNT', ctx.captured_queries[0]['sql'])
+            page = result.data['allOrders']
+            seen.extend(edge['node']['totalAmount'] for edge in page['edges'])
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+
+        self.assertEqual(seen, [f'{amount:.2f}' for amount in expected])
+
+    def test_total_count_is_opt_in(self):
+        create_orders(4)
+        result = schema.execute(
+            '{ allOrders(keyset: true, first: 1) { totalCount } }',
+            context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['allOrders']['totalCount'], 4)
+
+
+class BulkCreateCustomersTests(TestCase):
+    MUTATION = '''
+    mutation ($customers: [JSONString]!, $batchSize: Int) {
+      bulkCreateCustomers(customers: $customers, batchSize: $batchSize) {
+        createdCustomers { email }
+        errors
+      }
+    }
+    '''
+
+    def test_bad_records_are_reported_without_stopping_the_batch(self):
+        Customer.objects.create(name='Existing', email='taken@example.com')
+        records = [
+            {'name': 'Ann', 'email': 'ann@example.com', 'phone': '+1234567890'},
+            {'name': 'Bad', 'email': 'bad@example.com', 'phone': 'nope'},
+            {'name': 'Dup', 'email': 'taken@example.com'},
+            {'email': 'noname@example.com'},
+            {'name': 'Ann again', 'email': 'ann@example.com'},
+            {'name': 'x' * 31, 'email': 'long@example.com'},
+            {'name': 'Eve', 'email': 'not-an-email'},
+            {'name': 'Ben', 'email': 'ben@example.com'},
+        ]
+        result = schema.execute(self.MUTATION, variables={
+            'customers': [json.dumps(record) for record in records],
+            'batchSize': 2,
+        })
+        self.assertIsNone(result.errors)
+        data = result.data['bulkCreateCustomers']
+        self.assertEqual([c['email'] for c in data['createdCustomers']],
+                         ['ann@example.com', 'ben@example.com'])
+        self.assertEqual([error.split(' :')[0] for error in data['errors']],
+                         ['Record 2', 'Record 3', 'Record 4', 'Record 5',
+                          'Record 6', 'Record 7'])
+        self.assertIn('name: Ensure this value has at most 30 characters',
+                      data['errors'][4])
+        self.assertIn('email: Enter a valid email address.',
+                      data['errors'][5])
+        self.assertEqual(Customer.objects.count(), 3)
+
+    def test_duplicate_check_is_one_query_per_chunk(self):
+        records = [json.dumps({'name': f'C{i}', 'email': f'c{i}@example.com'})
+                   for i in range(50)]
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(self.MUTATION, variables={
+                'customers': records, 'batchSize': 25})
+        self.assertIsNone(result.errors)
+        self.assertEqual(Customer.objects.count(), 50)
+        selects = [q for q in ctx.captured_queries
+                   if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 2)
+
+
+class StreamingImportTests(TestCase):
+    def test_csv_orders_are_imported_in_chunks(self):
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        laptop = Product.objects.create(name='Laptop', price=999, stock=1)
+        mouse = Product.objects.create(name='Mouse', price=50, stock=1)
+        body = '\n'.join([
+            'customer_id,product_ids,order_date',
+            f'{customer.pk},{laptop.pk};{mouse.pk},2025-01-02T10:00:00Z',
+            f'{customer.pk},{mouse.pk},',
+            f'999,{mouse.pk},',
+            f'{customer.pk},12345,',
+        ])
+        response = self.client.post('/import/orders?batch_size=2', body,
+                                    content_type='text/csv')
+        report = response.json()
+
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(report['failed'], 2)
+        self.assertEqual(report['chunks'], 2)
+        first = Order.objects.get(order_date__year=2025)
+        self.assertEqual(first.total_amount, 1049)
+        self.assertEqual(set(first.products.all()), {laptop, mouse})
+
+    def test_ndjson_products_report_bad_lines(self):
+        body = '\n'.join([
+            json.dumps({'name': 'Pen', 'price': '1.50', 'stock': 3}),
+            'not json',
+            json.dumps({'name': 'Free', 'price': -1}),
+            json.dumps({'name': 'Nan', 'price': 'NaN'}),
+            json.dumps({'name': 'Inf', 'price': 'Infinity'}),
+            json.dumps({'name': 'Huge', 'price': '1e30'}),
+            json.dumps({'name': 'x' * 51, 'price': 1}),
+            json.dumps({'name': 'Ink', 'price': 2}),
+        ])
+        response = self.client.post('/import/products', body,
+                                    content_type='application/x-ndjson')
+        report = response.json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(report['errors'][:5], [
+            'Record 2 : Invalid record.',
+            'Record 3 : Price must be positive',
+            'Record 4 : Invalid price or stock.',
+            'Record 5 : Invalid price or stock.',
+            'Record 6 : price: Ensure that there are no more than 20 digits '
+            'in total.',
+        ])
+        self.assertIn('name: Ensure this value has at most 50 characters',
+                      report['errors'][5])
+        self.assertEqual(sorted(Product.objects.values_list('name',
+                                                            flat=True)),
+                         ['Ink', 'Pen'])
+
+
+    def test_ndjson_orders_report_bad_dates(self):
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        pen = Product.objects.create(name='Pen', price=2, stock=1)
+        body = '\n'.join(
+            json.dumps({'customer_id': customer.pk, 'product_ids': [pen.pk],
+                        'order_date': order_date})
+            for order_date in (12345, '2025-13-40T00:00:00', ['2025'],
+                               '2025-01-02T10:00:00'))
+        report = self.client.post('/import/orders', body,
+                                  content_type='application/x-ndjson').json()
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(report['errors'], [
+            f'Record {n} : Invalid order_date.' for n in (1, 2, 3)])
+
+    @override_settings(CRM_BULK_MAX_BATCH_SIZE=2)
+    def test_batch_size_is_bounded(self):
+        body = '\n'.join(json.dumps({'name': f'P{i}', 'price': 1})
+                         for i in range(5))
+        for batch_size in ('0', '-1'):
+            response = self.client.post(
+                f'/import/products?batch_size={batch_size}', body,
+                content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.exists())
+
+        response = self.client.post('/import/products?batch_size=1000',
+                                    body, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['chunks'], 3)
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.ann = Customer.objects.create(name='Ann', email='ann@example.com')
+        bob = Customer.objects.create(name='Bob', email='bob@example.com')
+        pen = Product.objects.create(name='Pen', price=5, stock=3)
+        ink = Product.objects.create(name='Ink', price=20, stock=50)
+        for customer, total, products in [(self.ann, 25, [pen, ink]),
+                                          (bob, 5, [pen]),
+                                          (self.ann, 100, [ink])]:
+            order = Order.objects.create(customer=customer,
+                                         total_amount=total)
+            add_items(order, products)
+        self.pen, self.ink = pen, ink
+
+    @override_settings(CRM_EXPORT_CHUNK_SIZE=1)
+    def test_orders_stream_as_gzipped_csv_with_one_prefetch_per_chunk(self):
+        # one cursor over the orders joined to customers, then the
+        # products of each chunk
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                '/export/orders?format=csv&customer_name=ann')
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('orders.csv.gz', response['Content-Disposition'])
+        rows = list(csv.DictReader(
+            gzip.decompress(body).decode('utf-8').splitlines()))
+        self.assertEqual([row['total_amount'] for row in rows],
+                         ['25.00', '100.00'])
+        self.assertEqual(rows[0]['product_ids'],
+                         f'{self.pen.pk}|{self.ink.pk}')
+        self.assertEqual(rows[0]['customer_email'], 'ann@example.com')
+
+    def test_products_ndjson_uses_the_graphql_filters(self):
+        response = self.client.get(
+            '/export/products?gzip=0&low_stock=true&order_by=-price')
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows, [
+            {'id': self.pen.pk, 'name': 'Pen', 'price': '5.00', 'stock': 3}])
+
+        response = self.client.get('/export/orders?total_amount_gte=lots')
+        self.assertEqual(response.status_code, 400)
+
+    def test_orders_matching_several_products_are_exported_once(self):
+        # "n" matches both the Pen and the Ink of the first order
+        response = self.client.get(
+            '/export/orders?gzip=0&product_name=n&order_by=total_amount')
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['total_amount'] for row in rows],
+                         ['5.00', '25.00', '100.00'])
+
+        result = schema.execute(
+            '{ allOrders(productName: "n") {'
+            ' totalCount edges { node { id } } } }',
+            context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['allOrders']['totalCount'], 3)
+        self.assertEqual(len(result.data['allOrders']['edges']), 3)
+
+    def test_export_command_writes_a_gzip_file(self):
+        path = os.path.join(self.enterClassContext(
+            tempfile.TemporaryDirectory()), 'customers.ndjson.gz')
+        call_command('export_crm', 'customers', path, '--filter', 'name=bo',
+                     stderr=StringIO())
+        with gzip.open(path, 'rt') as export:
+            rows = [json.loads(line) for line in export]
+        self.assertEqual([row['email'] for row in rows], ['bob@example.com'])
+
+
+class BulkCreateOrdersTests(TestCase):
+    MUTATION = '''
+    mutation ($orders: [OrderInput]!) {
+      bulkCreateOrders(orders: $orders) {
+        orders { totalAmount customer { email } products { name } }
+        errors
+      }
+    }
+    '''
+
+    def test_orders_are_created_with_batched_queries(self):
+        ann = Customer.objects.create(name='Ann', email='ann@example.com')
+        ben = Customer.objects.create(name='Ben', email='ben@example.com')
+        pen = Product.objects.create(name='Pen', price=2, stock=5)
+        ink = Product.objects.create(name='Ink', price=3, stock=5)
+        orders = [
+            {'customerId': ann.pk, 'productIds': [pen.pk, ink.pk]},
+            {'customerId': ben.pk, 'productIds': [ink.pk],
+             'orderDate': '2025-03-01T12:00:00+00:00'},
+            {'customerId': 999, 'productIds': [pen.pk]},
+            {'customerId': ann.pk, 'productIds': []},
+        ] + [{'customerId': ben.pk, 'productIds': [pen.pk]}] * 20
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(self.MUTATION, variables={'orders': orders},
+                                    context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        data = result.data['bulkCreateOrders']
+        self.assertEqual(data['errors'], [
+            'Record 3 : invalid customer_id',
+            'Record 4 : one product must be selected',
+        ])
+        self.assertEqual(len(data['orders']), 22)
+        self.assertEqual(data['orders'][0]['totalAmount'], '5.00')
+        self.assertEqual([p['name'] for p in data['orders'][0]['products']],
+                         ['Pen', 'Ink'])
+        self.assertEqual(Order.objects.filter(order_date__year=2025).count(), 1)
+        # customers + products + orders + links, then one query each for
+        # the selected customers and products; revenue summary upkeep is
+        # per day and customer, not per order
+        order_queries = [
+            q for q in ctx.captured_queries
+            if 'revenue"' not in q['sql']
+            and not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(order_queries), 6)
+
+
+class OrderItemTests(TestCase):
+    CREATE_ORDER = '''
+    mutation ($customerId: ID!, $productIds: [ID]!) {
+      createOrder(customerId: $customerId, productIds: $productIds) {
+        success
+        message
+        order { totalAmount }
+      }
+    }
+    '''
+    SALES = '''
+    query ($start: Date) {
+      topProducts(first: 2, start: $start) {
+        product { name } quantity revenue orderCount
+      }
+      revenueByProduct(start: $start) { product { name } revenue }
+    }
+    '''
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Ann',
+                                                email='ann@example.com')
+        self.pen = Product.objects.create(name='Pen', price=3, stock=100)
+        self.ink = Product.objects.create(name='Ink', price=10, stock=100)
+        self.cap = Product.objects.create(name='Cap', price=1, stock=100)
+
+    def create_order(self, *products):
+        result = schema.execute(self.CREATE_ORDER, variables={
+            'customerId': self.customer.pk,
+            'productIds': [product.pk for product in products],
+        })
+        self.assertIsNone(result.errors)
+        return result.data['createOrder']
+
+    def test_repeated_products_are_quantities_at_the_captured_price(self):
+        data = self.create_order(self.ink, self.pen, self.ink)
+        self.assertEqual(data['order']['totalAmount'], '23.00')
+        Product.objects.filter(pk=self.ink.pk).update(price=99)
+        items = {item.product_id: item
+                 for item in OrderItem.objects.select_related('order')}
+        self.assertEqual((items[self.ink.pk].quantity,
+                          items[self.ink.pk].line_total), (2, 20))
+        self.assertEqual(sum(item.line_total for item in items.values()),
+                         items[self.ink.pk].order.total_amount)
+
+        data = self.create_order(self.pen, Product(pk=999))
+        self.assertEqual(data['message'],
+                         'One or more product IDs are invalid.')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_sales_are_aggregated_by_product(self):
+        self.create_order(self.ink, self.pen, self.ink)
+        self.create_order(*[self.pen] * 5, self.cap)
+        old = Order.objects.create(
+            customer=self.customer, total_amount=10,
+            order_date=django_timezone.now() - timedelta(days=30))
+        add_items(old, [self.ink])
+
+        with self.assertNumQueries(4):
+            data = schema.execute(self.SALES, variables={
+                'start': (django_timezone.localdate()
+                          - timedelta(days=7)).isoformat()}).data
+        self.assertEqual(
+            [(row['product']['name'], row['quantity'], row['revenue'],
+              row['orderCount'])
+             for row in data['topProducts']],
+            [('Pen', 6, '18.00', 2), ('Ink', 2, '20.00', 1)])
+        self.assertEqual(
+            [(row['product']['name'], row['revenue'])
+             for row in data['revenueByProduct']],
+            [('Ink', '20.00'), ('Pen', '18.00'), ('Cap', '1.00')])
+
+        data = schema.execute(self.SALES).data
+        self.assertEqual(data['revenueByProduct'][0]['revenue'], '30.00')
+
+    def test_backfilled_line_totals_add_up_to_the_order_total(self):
+        split_total = importlib.import_module(
+            'crm.migrations.0009_order_item').split_total
+        self.assertEqual(split_total('100.01', ['3.33', '10.00', '0']),
+                         [Decimal('24.98'), Decimal('75.03'), Decimal('0')])
+        self.assertEqual(split_total('7', ['1']), [Decimal('7')])
+        self.assertEqual(split_total('5', ['0', '0']),
+                         [Decimal('2.50'), Decimal('2.50')])
+
+    def test_revenue_is_exact_to_the_cent(self):
+        # SQLite sums these as floats
+        prices = ['255.38', '255.38', '255.39']
+        for price in prices:
+            order = Order.objects.create(customer=self.customer,
+                                         total_amount=price)
+            OrderItem.objects.create(order=order, product=self.pen,
+                                     unit_price=price, line_total=price)
+
+        data = schema.execute(self.SALES).data
+        self.assertEqual(data['topProducts'][0]['revenue'], '766.15')
+        self.assertEqual(data['revenueByProduct'][0]['revenue'], '766.15')
+
+
+class BulkJobTests(TestCase):
+    CUSTOMERS = '''
+    mutation ($customers: [JSONString]!, $batchSize: Int) {
+      bulkCreateCustomers(customers: $customers, batchSize: $batchSize,
+                          background: true) {
+        createdCustomers { email }
+        job { id status total }
+      }
+    }
+    '''
+    ORDERS = '''
+    mutation ($orders: [OrderInput]!) {
+      bulkCreateOrders(orders: $orders, background: true) {
+        job { id }
+      }
+    }
+    '''
+    JOB = '''
+    query ($id: UUID!) {
+      job(id: $id) {
+        kind status total processed created failed errors progress
+      }
+    }
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.celery_always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+
+    @classmethod
+    def tearDownClass(cls):
+        celery_app.conf.task_always_eager = cls.celery_always_eager
+        super().tearDownClass()
+
+    def execute(self, document, variables):
+        # the task is enqueued once the job is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            result = schema.execute(document, variables=variables,
+                                    context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def test_customers_are_imported_in_the_background(self):
+        records = [
+            {'name': 'Ann', 'email': 'ann@example.com'},
+            {'name': 'Bad', 'email': 'bad@example.com', 'phone': 'nope'},
+            {'name': 'Ben', 'email': 'ben@example.com'},
+        ]
+        data = self.execute(self.CUSTOMERS, {
+            'customers': [json.dumps(record) for record in records],
+            'batchSize': 2,
+        })['bulkCreateCustomers']
+        self.assertIsNone(data['createdCustomers'])
+        self.assertEqual(data['job']['status'], 'PENDING')
+        self.assertEqual(data['job']['total'], 3)
+
+        job = self.execute(self.JOB, {'id': data['job']['id']})['job']
+        self.assertEqual(job, {
+            'kind': 'customers', 'status': 'SUCCEEDED', 'total': 3,
+            'processed': 3, 'created': 2, 'failed': 1,
+            'errors': ['Record 2 : invalid phone format'], 'progress': 1.0,
+        })
+        self.assertEqual(Customer.objects.count(), 2)
+        self.assertIsNone(BulkJob.objects.get().records)
+
+    def test_orders_are_imported_in_the_background(self):
+        customer = Customer.objects.create(name='Ann',
+                                           email='ann@example.com')
+        product = Product.objects.create(name='Pen', price=5, stock=1)
+        data = self.execute(self.ORDERS, {'orders': [
+            {'customerId': customer.pk, 'productIds': [product.pk]},
+            {'customerId': 999, 'productIds': [product.pk]},
+        ]})['bulkCreateOrders']
+        job = self.execute(self.JOB, {'id': data['job']['id']})['job']
+        self.assertEqual((job['created'], job['errors']),
+                         (1, ['Record 2 : invalid customer_id']))
+        self.assertEqual(Order.objects.get().total_amount, 5)
+
+    def test_a_redelivered_job_resumes_after_the_last_chunk(self):
+        job = BulkJob.objects.create(
+            kind='customers', status=BulkJob.RUNNING, total=3, processed=1,
+            created=1, records=[{'name': f'C{i}', 'email': f'c{i}@x.com'}
+                                for i in range(3)])
+        bulk_import_job.delay(str(job.pk), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.created),
+                         (BulkJob.SUCCEEDED, 3, 3))
+        self.assertEqual(
+            sorted(Customer.objects.values_list('email', flat=True)),
+            ['c1@x.com', 'c2@x.com'])
+
+    def test_a_job_is_imported_by_one_run_at_a_time(self):
+        job = jobs.create_job('customers', [
+            {'name': f'C{i}', 'email': f'c{i}@x.com'} for i in range(3)])
+        first = jobs.claim_job(job.pk)
+        # a copy of the task delivered while the first run is alive
+        bulk_import_job.delay(str(job.pk), 1)
+        self.assertFalse(Customer.objects.exists())
+
+        # the first run stalls past its lease and is taken over
+        BulkJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=django_timezone.now() - timedelta(hours=1))
+        second = jobs.claim_job(job.pk)
+        self.assertIsNotNone(second)
+        self.assertFalse(jobs.import_records(job.pk, first, 1))
+        self.assertTrue(jobs.import_records(job.pk, second, 1))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.created),
+                         (BulkJob.SUCCEEDED, 3, 3))
+        self.assertEqual(Customer.objects.count(), 3)
+        self.assertIsNone(jobs.claim_job(job.pk))
+
+    def test_unknown_jobs_are_null(self):
+        data = self.execute(self.JOB, {'id': str(uuid.uuid4())})
+        self.assertIsNone(data['job'])
+
+
+class UpdateLowStockProductsTests(TestCase):
+    MUTATION = '''
+    mutation ($threshold: Int, $increment: Int) {
+      updateLowStockProducts(threshold: $threshold, increment: $increment) {
+        success
+        message
+        updatedProducts { name stock }
+      }
+    }
+    '''
+
+    def test_restocks_every_low_stock_product_in_one_update(self):
+        for name, stock in [('A', 0), ('B', 4), ('C', 5), ('D', 30)]:
+            Product.objects.create(name=name, price=1, stock=stock)
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(self.MUTATION, variables={
+                'threshold': 5, 'increment': 20})
+        self.assertIsNone(result.errors)
+        data = result.data['updateLowStockProducts']
+        self.assertEqual(data['updatedProducts'], [
+            {'name': 'A', 'stock': 20}, {'name': 'B', 'stock': 24}])
+        self.assertEqual(data['message'], '2 Products has been restocked')
+        self.assertEqual(
+            dict(Product.objects.values_list('name', 'stock')),
+            {'A': 20, 'B': 24, 'C': 5, 'D': 30})
+        updates = [q for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+
+    def test_only_the_products_read_are_restocked(self):
+        Product.objects.create(name='A', price=1, stock=0)
+        late = Product.objects.create(name='B', price=1, stock=30)
+        sold = []
+
+        def sell_out_before_restock(execute, sql, params, many, context):
+            if sql.startswith('UPDATE') and not sold:
+                # B runs low between the read and the restock
+                sold.append(sql)
+                Product.objects.filter(pk=late.pk).update(stock=1)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(sell_out_before_restock):
+            data = schema.execute(self.MUTATION, variables={
+                'threshold': 5, 'increment': 20}).data
+        self.assertEqual(data['updateLowStockProducts']['updatedProducts'],
+                         [{'name': 'A', 'stock': 20}])
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')),
+                         {'A': 20, 'B': 1})
+
+
+class RevenueSummaryTests(TestCase):
+    QUERY = '''
+    {
+      allRevenue
+      revenueByDay { day orderCount revenue }
+      revenueByCustomer { customer { email } orderCount revenue }
+    }
+    '''
+
+    def test_summaries_follow_order_changes(self):
+        ann = Customer.objects.create(name='Ann', email='ann@example.com')
+        ben = Customer.objects.create(name='Ben', email='ben@example.com')
+        day = datetime(2025, 5, 1, 12, tzinfo=timezone.utc)
+        first = Order.objects.create(customer=ann, order_date=day,
+                                     total_amount=10)
+        Order.objects.create(customer=ann, order_date=day, total_amount=5)
+        second = Order.objects.create(
+            customer=ben, order_date=day + timedelta(days=1), total_amount=7)
+
+        first.total_amount = 20
+        first.save()
+        reloaded = Order.objects.only('total_amount').get(pk=second.pk)
+        reloaded.customer = ann
+        reloaded.save()
+        Order.objects.filter(total_amount=5).delete()
+
+        result = schema.execute(self.QUERY)
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['allRevenue'], 27.0)
+        self.assertEqual(result.data['revenueByDay'], [
+            {'day': '2025-05-01', 'orderCount': 1, 'revenue': '20.00'},
+            {'day': '2025-05-02', 'orderCount': 1, 'revenue': '7.00'},
+        ])
+        self.assertEqual(result.data['revenueByCustomer'], [
+            {'customer': {'email': 'ann@example.com'}, 'orderCount': 2,
+             'revenue': '27.00'},
+            {'customer': {'email': 'ben@example.com'}, 'orderCount': 0,
+             'revenue': '0.00'},
+        ])
+
+    def test_reads_do_no_revenue_bookkeeping(self):
+        create_orders(3)
+        orders = list(Order.objects.all())
+        self.assertFalse(any('_revenue_row' in order.__dict__
+                             for order in orders))
+
+        order = orders[0]
+        order.reminded_at = django_timezone.now()
+        with CaptureQueriesContext(connection) as ctx:
+            order.save(update_fields=['reminded_at'])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        order.total_amount = 50
+        order.save()
+        self.assertEqual(CustomerRevenue.objects.get(
+            customer_id=order.customer_id).revenue, 50)
+
+    def test_rebuild_matches_incremental_summaries(self):
+        create_orders(3)
+        before = list(DailyRevenue.objects.values_list(
+            'day', 'order_count', 'revenue'))
+        DailyRevenue.objects.all().delete()
+        call_command('rebuild_revenue_summary', stdout=StringIO())
+        self.assertEqual(list(DailyRevenue.objects.values_list(
+            'day', 'order_count', 'revenue')), before)
+        self.assertEqual(CustomerRevenue.objects.count(), 3)
+
+
+class OrderDateFilterTests(TestCase):
+    def test_date_bounds_include_the_whole_day(self):
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        for hour in (0, 23):
+            Order.objects.create(
+                customer=customer, total_amount=1,
+                order_date=datetime(2025, 6, 1, hour, tzinfo=timezone.utc))
+        Order.objects.create(
+            customer=customer, total_amount=1,
+            order_date=datetime(2025, 6, 2, 0, tzinfo=timezone.utc))
+
+        result = schema.execute('''{
+          allOrders(orderDateGte: "2025-06-01", orderDateLte: "2025-06-01") {
+            edges { node { id } }
+          }
+        }''', context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data['allOrders']['edges']), 2)
+
+
+class ExplainFiltersTests(TransactionTestCase):
+    def indexes(self, table):
+        with connection.cursor() as cursor:
+            return {name for name, info in connection.introspection
+                    .get_constraints(cursor, table).items() if info['index']}
+
+    def test_compare_only_drops_the_filter_indexes_for_a_while(self):
+        create_orders(2)
+        before = self.indexes('crm_order')
+        out = StringIO()
+        call_command('explain_filters', compare=True, repeat=1, stdout=out)
+
+        self.assertIn('== before indexes ==', out.getvalue())
+        self.assertIn('== with indexes ==', out.getvalue())
+        self.assertEqual(self.indexes('crm_order'), before)
+        self.assertIn('crm_order_date_idx', before)
+        # the later migrations are still applied and their data kept
+        self.assertEqual(Order.objects.filter(reminded_at=None).count(), 2)
+        self.assertEqual(OrderItem.objects.count(), 4)
+
+
+delivered_reports = []
+
+
+def stub_report_sender(payload, url, timeout):
+    """Stands in for the report endpoint; fails while told to."""
+    if stub_report_sender.failures:
+        stub_report_sender.failures -= 1
+        raise requests.ConnectionError('endpoint unavailable')
+    delivered_reports.append(payload)
+
+
+@override_settings(CRM_REPORT={
+    'SENDER': 'crm.tests.stub_report_sender', 'LOG_FILE': None})
+class ReportPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # retries of eager tasks only run if their errors do not propagate
+        cls.celery_always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+
+    @classmethod
+    def tearDownClass(cls):
+        celery_app.conf.task_always_eager = cls.celery_always_eager
+        super().tearDownClass()
+
+    def setUp(self):
+        delivered_reports.clear()
+        stub_report_sender.failures = 0
+        self.customer = Customer.objects.create(name='Ann',
+                                                email='ann@example.com')
+        self.today = django_timezone.localdate()
+
+    def order_on(self, days_ago, total):
+        return Order.objects.create(
+            customer=self.customer, total_amount=total,
+            order_date=start_of_day(self.today - timedelta(days=days_ago))
+            + timedelta(hours=12))
+
+    def computed_shards(self):
+        return dict(ReportSnapshot.objects.filter(
+            kind=ReportSnapshot.SHARD).values_list('start', 'computed_at'))
+
+    def test_only_changed_shards_are_recomputed(self):
+        self.order_on(2, 10)
+        self.order_on(5, 30)
+        generate_crm_report.delay()
+
+        report = ReportSnapshot.objects.get(kind=ReportSnapshot.REPORT)
+        self.assertEqual((report.order_count, report.revenue), (2, 40))
+        self.assertEqual(len(self.computed_shards()), 7)
+        self.assertEqual(delivered_reports, [{
+            'start': str(self.today - timedelta(days=7)),
+            'end': str(self.today), 'orders': 2, 'customers': 0,
+            'revenue': '40.00',
+            'computed_at': report.computed_at.isoformat()}])
+
+        before = self.computed_shards()
+        generate_crm_report.delay()
+        self.assertEqual(self.computed_shards(), before)
+        self.assertEqual(len(delivered_reports), 1)
+
+        self.order_on(5, 5)
+        generate_crm_report.delay()
+        after = self.computed_shards()
+        changed = self.today - timedelta(days=5)
+        self.assertEqual([day for day in after if after[day] != before[day]],
+                         [changed])
+        self.assertEqual(delivered_reports[-1]['revenue'], '45.00')
+
+    def test_delivery_is_retried(self):
+        stub_report_sender.failures = 2
+        generate_crm_report.delay()
+        self.assertEqual(len(delivered_reports), 1)
+        self.assertIsNotNone(ReportSnapshot.objects.get(
+            kind=ReportSnapshot.REPORT).delivered_at)
+
+
+def load_reminder_script():
+    path = os.path.join(os.path.dirname(__file__), 'cron_jobs',
+                        'send_order_reminders.py')
+    spec = importlib.util.spec_from_file_location('send_order_reminders',
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.PAGE_SIZE = 2
+    module.RATE = 10000
+    module.RETRY_DELAY = 0
+    return module
+
+
+class OrderRemindersTests(TestCase):
+    def setUp(self):
+        self.script = load_reminder_script()
+        now = django_timezone.now()
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        self.recent = [Order.objects.create(customer=customer,
+                                            order_date=now - timedelta(days=1))
+                       for _ in range(5)]
+        Order.objects.create(customer=customer,
+                             order_date=now - timedelta(days=30))
+        Order.objects.create(customer=customer, order_date=now,
+                             reminded_at=now)
+        self.from_date = (now - timedelta(days=7)).date().isoformat()
+        self.failures = 0
+        self.calls = []
+
+    async def execute(self, query, variables):
+        self.calls.append(query)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('connection reset')
+        result = await sync_to_async(schema.execute)(
+            query, variables=variables, context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        return result.data
+
+    async def remind(self):
+        log = StringIO()
+        stats = await self.script.remind(self.execute, self.from_date, log)
+        return stats, log.getvalue().splitlines()
+
+    async def test_pages_are_reminded_once_and_marked(self):
+        self.failures = 1
+        stats, lines = await self.remind()
+        self.assertEqual((stats['reminded'], stats['failed']), (5, 0))
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(all('ann@example.com' in line for line in lines))
+        # three pages, one retried fetch and three marks
+        self.assertEqual(self.calls.count(self.script.ORDERS_QUERY), 4)
+        self.assertEqual(self.calls.count(self.script.MARK_REMINDED), 3)
+        pending = await Order.objects.filter(
+            pk__in=[order.pk for order in self.recent],
+            reminded_at__isnull=True).acount()
+        self.assertEqual(pending, 0)
+
+        stats, lines = await self.remind()
+        self.assertEqual((stats['reminded'], lines), (0, []))
+
+    async def test_a_failing_page_is_left_for_the_next_run(self):
+        self.script.MAX_ATTEMPTS = 1
+        original = self.script.send_reminder
+        calls = 0
+
+        async def flaky_send(order):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise ConnectionError('smtp down')
+            return await original(order)
+
+        self.script.send_reminder = flaky_send
+        stats, lines = await self.remind()
+        self.assertEqual((stats['reminded'], stats['failed']), (3, 2))
+        stats, lines = await self.remind()
+        self.assertEqual((stats['reminded'], len(lines)), (2, 2))
+
+    def test_mark_reminded_rejects_foreign_ids(self):
+        result = schema.execute(
+            self.script.MARK_REMINDED, context_value=SimpleNamespace(),
+            variables={'ids': [to_global_id('CustomerNode', 1)]})
+        self.assertIn('Invalid order id', result.errors[0].message)
+
+
+def stub_broker_down(config):
+    raise ConnectionRefusedError('broker down')
+
+
+@override_settings(CRM_HEALTH={'CHECKS': {
+    'graphql': 'crm.health.check_graphql',
+    'database': 'crm.health.check_database',
+    'broker': 'crm.tests.stub_broker_down',
+}})
+class HealthCheckTests(TestCase):
+    def setUp(self):
+        health.reset()
+
+    def test_healthz_runs_the_probe_in_process(self):
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['status'], 'ok')
+        self.assertEqual(list(payload['checks']), ['graphql'])
+        latency = payload['latency']['graphql']
+        self.assertEqual(latency['count'], 3)
+        self.assertEqual(latency['buckets']['+Inf'], 3)
+        self.assertEqual(health.probe_document.cache_info().currsize, 1)
+
+    def test_readyz_fails_when_a_dependency_is_down(self):
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        checks = response.json()['checks']
+        self.assertTrue(checks['graphql']['ok'])
+        self.assertTrue(checks['database']['ok'])
+        self.assertEqual(checks['broker'],
+                         {'ok': False, 'error': 'broker down',
+                          'latency_ms': checks['broker']['latency_ms']})
+
+    def test_slow_checks_time_out(self):
+        started = time.perf_counter()
+        with self.assertRaisesMessage(TimeoutError, 'no answer within 0.05s'):
+            health._with_timeout(lambda: time.sleep(0.5), 0.05)
+        self.assertLess(time.perf_counter() - started, 0.4)
+
+    def test_invalid_probe_fails_the_graphql_check(self):
+        with self.settings(CRM_HEALTH={'PROBE': '{ nope }'}):
+            payload = health.run_checks(health.LIVENESS)
+        self.assertEqual(payload['status'], 'fail')
+        self.assertIn('invalid health probe',
+                      payload['checks']['graphql']['error'])
+
+
+class CeleryWorkerProfileTests(TestCase):
+    def test_tasks_are_routed_to_their_workload_queue(self):
+        router = celery_app.amqp.router
+        for task, queue in [('crm.tasks.compute_report_shard', 'reports'),
+                            ('crm.tasks.deliver_crm_report', 'notifications'),
+                            ('crm.tasks.unrouted', 'default')]:
+            self.assertEqual(router.route({}, task)['queue'].name, queue)
+        self.assertTrue(celery_app.tasks['crm.tasks.compute_report_shard']
+                        .acks_late)
+
+    def test_worker_argv_applies_the_profile(self):
+        argv = worker_argv('notifications')
+        self.assertIn('--queues=notifications', argv)
+        self.assertIn('--pool=threads', argv)
+        self.assertIn('--prefetch-multiplier=4', argv)
+
+    def test_benchmark_measures_each_profile(self):
+        results = run_celery_benchmark(
+            20, profiles=['reports', 'notifications'], workload='default',
+            log=lambda line: None)
+        self.assertEqual(set(results), {'reports', 'notifications'})
+        for stats in results.values():
+            self.assertEqual(stats['tasks'], 20)
+            self.assertGreater(stats['throughput'], 0)
+        # the benchmark's workers leave the CRM app the current one
+        self.assertIs(current_celery_app._get_current_object(), celery_app)
+
+
+class SeedDataTests(TestCase):
+    END = datetime(2025, 6, 4, tzinfo=timezone.utc)  # a Wednesday
+
+    def seed(self, seed=0):
+        seed_db.run(customers=50, products=40, orders=1500, seed=seed,
+                    days=28, end=self.END, log=lambda line: None)
+        return (
+            list(Customer.objects.order_by('pk').values_list(
+                'name', 'email', 'phone', 'created_at')),
+            list(Product.objects.order_by('pk').values_list(
+                'name', 'price', 'stock')),
+            list(Order.objects.order_by('pk').values_list(
+                'customer_id', 'order_date', 'total_amount')),
+            list(OrderItem.objects.order_by('pk').values_list(
+                'order_id', 'product_id', 'line_total')),
+        )
+
+    def test_same_seed_gives_the_same_rows(self):
+        first = self.seed()
+        self.assertEqual(self.seed(), first)
+        self.assertNotEqual(self.seed(seed=1), first)
+
+    def test_products_are_skewed_and_weekends_are_busier(self):
+        self.seed()
+        sold = sorted(OrderItem.objects.values('product_id')
+                      .annotate(n=Count('id')).values_list('n', flat=True),
+                      reverse=True)
+        self.assertGreater(sold[0], 5 * sold[len(sold) // 2])
+
+        # without sale days, Saturdays and Sundays weigh 1.4, whatever
+        # weekday the range starts on
+        start = self.END - timedelta(days=14)
+        weights = seed_db.day_cum_weights(random.Random(0), start, 14,
+                                          burst_rate=0)
+        daily = [b - a for a, b in zip([0] + weights, weights)]
+        self.assertEqual(
+            [day for day, weight in enumerate(daily) if weight > 1],
+            [day for day in range(14)
+             if (start + timedelta(days=day)).weekday() in (5, 6)])
+
+
+class BenchmarkTests(TestCase):
+    def test_suite_runs_every_operation_over_both_transports(self):
+        create_orders(3)
+        results = run_suite(3, log=lambda line: None, only=[
+            'allOrders page 20', 'filtered allCustomers', 'allRevenue',
+            'createOrder'])
+        self.assertEqual(len(results), 4)
+        for transports in results.values():
+            self.assertEqual(set(transports), {'in-process', 'http'})
+        stats = results['allOrders page 20']['http']
+        self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        self.assertEqual(stats['queries'], 3)
+
+
+class PersistedQueryTests(TestCase):
+    QUERY = '{ allRevenue }'
+
+    def setUp(self):
+        persisted_queries.reset()
+
+    def post(self, body):
+        return self.client.post('/graphql', body,
+                                content_type='application/json').json()
+
+    def apq(self, digest):
+        return {'persistedQuery': {'version': 1, 'sha256Hash': digest}}
+
+    def test_hash_only_request_is_answered_once_registered(self):
+        digest = persisted_queries.query_hash(self.QUERY)
+        missing = self.post({'extensions': self.apq(digest)})
+        self.assertEqual(missing['errors'][0]['message'],
+                         'PersistedQueryNotFound')
+
+        self.post({'query': self.QUERY, 'extensions': self.apq(digest)})
+        response = self.post({'extensions': self.apq(digest)})
+        self.assertEqual(response['data'], {'allRevenue': 0.0})
+        self.assertEqual(persisted_queries.stats()['persisted_queries'],
+                         {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_hash_must_match_query(self):
+        response = self.post({'query': self.QUERY,
+                              'extensions': self.apq('0' * 64)})
+        self.assertEqual(response['errors'][0]['extensions']['code'],
+                         'PERSISTED_QUERY_HASH_MISMATCH')
+
+    def test_repeated_queries_skip_parsing(self):
+        for _ in range(3):
+            self.post({'query': self.QUERY})
+        self.post({'query': '{ allRevenue(bad: 1) }'})
+        self.assertEqual(persisted_queries.stats()['documents'],
+                         {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+
+
+@override_settings(CRM_RESPONSE_CACHE={'CACHE': 'default'})
+class ResponseCacheTests(TestCase):
+    PRODUCTS = '{ allProducts { edges { node { name stock } } } }'
+
+    def setUp(self):
+        response_cache.reset()
+        cache.clear()
+        self.product = Product.objects.create(name='Lamp', price=5, stock=3)
+
+    def post(self, query):
+        return self.client.post('/graphql', {'query': query},
+                                content_type='application/json').json()
+
+    def test_repeated_query_is_served_from_the_cache(self):
+        first = self.post(self.PRODUCTS)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post(self.PRODUCTS), first)
+        self.assertEqual(response_cache.metrics.snapshot()['hits'], 1)
+
+    def test_writes_invalidate_dependent_queries(self):
+        self.post(self.PRODUCTS)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.stock = 30
+            self.product.save()
+        node = self.post(self.PRODUCTS)['data']['allProducts']['edges'][0]
+        self.assertEqual(node['node']['stock'], 30)
+
+    def test_order_product_links_invalidate_products(self):
+        query = '{ allProducts { edges { node { orderSet { totalCount } } } } }'
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        order = Order.objects.create(customer=customer, total_amount=5)
+        self.post(query)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.add(self.product, through_defaults={
+                'unit_price': 5, 'line_total': 5})
+        edge = self.post(query)['data']['allProducts']['edges'][0]
+        self.assertEqual(edge['node']['orderSet']['totalCount'], 1)
+
+    def test_mutations_and_unhinted_fields_are_not_cached(self):
+        policy = response_cache.analyze(
+            schema.graphql_schema, parse('{ allRevenue }'), {})
+        self.assertIsNone(policy)
+        policy = response_cache.analyze(
+            schema.graphql_schema,
+            parse('{ allOrders { edges { node { customer { name } } } } }'),
+            response_cache.DEFAULT_HINTS)
+        self.assertEqual(policy.ttl, 60)
+        self.assertEqual(policy.tags, {'order', 'customer'})
+
+
+@override_settings(CRM_QUERY_LIMITS={'MAX_DEPTH': 8, 'MAX_COST': 1000})
+class QueryCostTests(TestCase):
+    def post(self, query, variables=None):
+        return self.client.post(
+            '/graphql', {'query': query, 'variables': variables},
+            content_type='application/json')
+
+    def test_cost_multiplies_through_nested_pages(self):
+        response = self.post('''
+          query ($first: Int) {
+            allCustomers(first: $first) {
+              edges { node { orders(first: 5) { edges { node {
+                customer { name }
+              } } } } }
+            }
+          }''', {'first': 10})
+        self.assertEqual(response.status_code, 200)
+        cost = response.json()['extensions']['cost']
+        self.assertEqual(cost['requestedQueryCost'], 1 + 10 * (1 + 5 * 1))
+        self.assertEqual(cost['depth'], 8)
+
+    def test_limits_reject_the_operation_before_execution(self):
+        nested = '''{
+          allCustomers(first: 50) { edges { node {
+            orders(first: 50) { edges { node { products { name } } } }
+          } } }
+        }'''
+        deep = nested.replace('products { name }',
+                              'customer { orders { totalCount } }')
+        for query, code in [
+                ('{ allCustomers(first: 1000) { totalCount } }',
+                 'PAGE_SIZE_EXCEEDED'),
+                (nested, 'QUERY_TOO_COMPLEX'),
+                (deep, 'QUERY_TOO_DEEP')]:
+            with self.assertNumQueries(0):
+                response = self.post(query)
+            self.assertEqual(response.status_code, 400)
+            codes = [error['extensions']['code']
+                     for error in response.json()['errors']]
+            self.assertIn(code, codes)
+
+
+@override_settings(CRM_TRACING={'ENABLED': True, 'EXTENSIONS': True})
+class TracingTests(TestCase):
+    def setUp(self):
+        tracing.registry.reset()
+
+    def test_sql_is_charged_to_the_resolving_field(self):
+        create_orders(3)
+        response = self.client.post('/graphql', {'query': ORDERS_QUERY},
+                                    content_type='application/json').json()
+        trace = response['extensions']['tracing']
+        self.assertEqual(trace['sql']['count'], 3)
+        self.assertEqual(trace['fields']['Query.allOrders']['sql_count'], 3)
+        self.assertEqual(trace['fields']['OrderNode.customer']['calls'], 3)
+        self.assertEqual(trace['n_plus_one'], [])
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('crm_graphql_requests_total 1', metrics)
+        self.assertIn(
+            'crm_graphql_sql_queries_total{field="Query.allOrders"} 3',
+            metrics)
+
+    def test_repeated_sql_templates_are_reported(self):
+        customers = [Customer.objects.create(name=f'C{i}',
+                                             email=f'c{i}@example.com')
+                     for i in range(6)]
+        trace = tracing.Trace(tracing.get_config())
+        with trace.capture():
+            trace.enter('OrderNode.customer')
+            for customer in customers:
+                Customer.objects.get(pk=customer.pk)
+            trace.leave('OrderNode.customer', 'allOrders', 0.0)
+        [problem] = trace.n_plus_one()
+        self.assertEqual(problem['count'], 6)
+        self.assertEqual(problem['fields'], ['OrderNode.customer'])
+
+    @override_settings(CRM_TRACING={})
+    def test_off_by_default_outside_debug(self):
+        config = tracing.get_config()
+        self.assertFalse(config['ENABLED'] or config['LOG'])
+        response = self.client.post('/graphql', {'query': ORDERS_QUERY},
+                                    content_type='application/json').json()
+        self.assertNotIn('tracing', response['extensions'])
+        self.assertIn('crm_graphql_requests_total 0',
+                      self.client.get('/metrics').content.decode())
+
+    @override_settings(CRM_TRACING={'ENABLED': True, 'SAMPLE_RATE': 0})
+    def test_unsampled_requests_are_not_traced(self):
+        self.client.post('/graphql', {'query': ORDERS_QUERY},
+                         content_type='application/json')
+        self.assertIn('crm_graphql_requests_total 0',
+                      self.client.get('/metrics').content.decode())
+
+
+# pool threads use their own connections, so the rows must be committed
+class BatchedRequestTests(TestCase):
+    def post(self, operations, path='/graphql'):
+        return self.client.post(path, operations,
+                                content_type='application/json')
+
+    def test_operations_share_the_request_loaders(self):
+        customer = Customer.objects.create(name='Ann',
+                                           email='ann@example.com')
+        orders = [Order.objects.create(customer=customer, total_amount=10)
+                  for _ in range(2)]
+        query = '{ order(id: "%s") { totalAmount customer { email } } }'
+        with self.assertNumQueries(3):
+            # the second order's customer comes from the loader
+            response = self.post([
+                {'query': query % to_global_id('OrderNode', order.pk),
+                 'id': str(order.pk)}
+                for order in orders])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([result['id'] for result in results],
+                         [str(order.pk) for order in orders])
+        self.assertEqual(
+            [result['data']['order']['customer'] for result in results],
+            [{'email': 'ann@example.com'}] * 2)
+
+    def test_a_mutation_is_seen_by_later_operations(self):
+        query = {'query': '{ allCustomers { totalCount } }'}
+        response = self.post([query, {'query': '''mutation {
+          createCustomer(name: "Ann", email: "ann@example.com",
+                         phone: "+2348012345678") {
+            customer { email }
+          }
+        }'''}, query])
+        counts = [result['data'] for result in response.json()]
+        self.assertEqual(counts[0]['allCustomers']['totalCount'], 0)
+        self.assertEqual(counts[2]['allCustomers']['totalCount'], 1)
+
+    @override_settings(CRM_QUERY_LIMITS={'MAX_BATCH_SIZE': 2,
+                                         'MAX_BATCH_COST': 30})
+    def test_batch_size_and_cost_are_capped(self):
+        query = {'query': '''{ allProducts(first: 20) { edges { node {
+          orderSet(first: 1) { totalCount }
+        } } } }'''}
+        response = self.post([query] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most 2', response.json()['errors'][0]['message'])
+
+        response = self.post([query] * 2)
+        first, second = response.json()
+        self.assertEqual(first['data']['allProducts']['edges'], [])
+        self.assertEqual(first['extensions']['cost']['requestedQueryCost'],
+                         21)
+        self.assertEqual(second['errors'][0]['extensions']['code'],
+                         'BATCH_TOO_COMPLEX')
+        self.assertNotIn('data', second)
+
+
+def on_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class LoopCheckingStore(persisted_queries.InProcessStore):
+    """Remembers whether it was called on an event loop."""
+    calls = []
+
+    def get(self, digest):
+        self.calls.append(on_event_loop())
+        return super().get(digest)
+
+    def set(self, digest, query):
+        self.calls.append(on_event_loop())
+        super().set(digest, query)
+
+
+class AsyncGraphQLViewTests(TransactionTestCase):
+    async def post(self, query):
+        return await self.async_client.post(
+            '/graphql/async', {'query': query},
+            content_type='application/json')
+
+    @override_settings(
+        CRM_PERSISTED_QUERIES={'BACKEND': 'crm.tests.LoopCheckingStore'},
+        CRM_RESPONSE_CACHE={'HINTS': {'Query.allRevenue': 60}})
+    async def test_caches_are_not_called_on_the_event_loop(self):
+        persisted_queries.reset()
+        response_cache.reset()
+        self.addCleanup(persisted_queries.reset)
+        self.addCleanup(response_cache.reset)
+        LoopCheckingStore.calls = []
+        cache_calls = []
+        real_cache = response_cache.get_cache
+
+        def checking_cache():
+            cache_calls.append(on_event_loop())
+            return real_cache()
+
+        query = '{ allRevenue }'
+        extensions = {'persistedQuery': {
+            'version': 1, 'sha256Hash': persisted_queries.query_hash(query)}}
+        with mock.patch.object(response_cache, 'get_cache', checking_cache):
+            for _ in range(2):
+                response = await self.async_client.post(
+                    '/graphql/async',
+                    {'query': query, 'extensions': extensions},
+                    content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+        self.assertTrue(LoopCheckingStore.calls and cache_calls)
+        self.assertFalse(any(LoopCheckingStore.calls + cache_calls))
+
+    async def test_root_fields_match_the_sync_view(self):
+        await sync_to_async(create_orders)(3)
+        query = '{ allRevenue ' + ORDERS_QUERY.split('{', 1)[1].replace(
+            '($first: Int)', '').replace('(first: $first)', '')
+        response = await self.post(query)
+        self.assertEqual(response.status_code, 200)
+        sync_response = await sync_to_async(self.client.post)(
+            '/graphql', {'query': query}, content_type='application/json')
+        self.assertEqual(response.json()['data'],
+                         sync_response.json()['data'])
+        self.assertEqual(len(response.json()['data']['allOrders']['edges']),
+                         3)
+
+    async def test_mutations_and_errors(self):
+        response = await self.post('''mutation {
+          createCustomer(name: "Ann", email: "ann@example.com",
+                         phone: "+2348012345678") {
+            customer { email }
+          }
+        }''')
+        self.assertEqual(
+            response.json()['data']['createCustomer']['customer']['email'],
+            'ann@example.com')
+        response = await self.post('{ allRevenue allNothing }')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_batches_run_queries_concurrently_around_mutations(self):
+        query = {'query': '{ allCustomers { totalCount } }'}
+        mutation = {'query': '''mutation {
+          createCustomer(name: "Ann", email: "ann@example.com",
+                         phone: "+2348012345678") {
+            customer { email }
+          }
+        }'''}
+        response = await self.async_client.post(
+            '/graphql/async', [query, query, mutation, query],
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        counts = [result['data'].get('allCustomers', {}).get('totalCount')
+                  for result in response.json()]
+        self.assertEqual(counts, [0, 0, None, 1])
+
+
+class FakeSocket:
+    """Drives the WebSocket application through ASGI messages."""
+
+    subscribers = 0
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': '/graphql',
+                 'subprotocols': ['graphql-transport-ws']}
+        self.task = asyncio.ensure_future(graphql_ws_application(schema)(
+            scope, self.incoming.get, self.outgoing.put))
+
+    async def send(self, message):
+        await self.incoming.put({'type': 'websocket.receive',
+                                 'text': json.dumps(message)})
+
+    async def receive(self):
+        message = await asyncio.wait_for(self.outgoing.get(), 5)
+        if message['type'] == 'websocket.send':
+            return json.loads(message['text'])
+        return message
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        self.accepted = await self.receive()
+        await self.send({'type': 'connection_init'})
+        return await self.receive()
+
+    async def subscribe(self, id, query, channel, variables=None):
+        await self.send({'type': 'subscribe', 'id': id, 'payload': {
+            'query': query, 'variables': variables}})
+        # wait for the subscriber to reach the pub/sub backend
+        backend = pubsub.get_pubsub()
+        while len(backend._subscribers[channel]) <= self.subscribers:
+            await asyncio.sleep(0.01)
+        self.subscribers += 1
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+class BrokenPubSub:
+    def publish(self, channel, message):
+        raise ConnectionError('pub/sub backend unavailable')
+
+
+class SubscriptionTests(TransactionTestCase):
+    def setUp(self):
+        pubsub.reset()
+        self.addCleanup(pubsub.reset)
+
+    async def execute(self, query, variables=None):
+        response = await sync_to_async(self.client.post)(
+            '/graphql', {'query': query, 'variables': variables},
+            content_type='application/json')
+        return response.json()['data']
+
+    async def test_order_created_is_filtered_by_customer(self):
+        customers = await sync_to_async(lambda: [
+            Customer.objects.create(name=name, email=f'{name}@example.com')
+            for name in ('ann', 'bob')])()
+        product = await Product.objects.acreate(name='Pen', price=5, stock=3)
+        socket = FakeSocket()
+        self.assertEqual(await socket.connect(), {'type': 'connection_ack'})
+        self.assertEqual(socket.accepted['subprotocol'],
+                         'graphql-transport-ws')
+        await socket.subscribe('1', '''subscription ($customer: ID) {
+          orderCreated(customerId: $customer) {
+            totalAmount customer { email } products { name }
+          }
+        }''', pubsub.ORDER_CREATED, {'customer': customers[1].pk})
+
+        for customer in customers:
+            await self.execute(
+                'mutation ($customer: ID!, $products: [ID]!) {'
+                ' createOrder(customerId: $customer, productIds: $products)'
+                ' { success } }',
+                {'customer': customer.pk, 'products': [product.pk]})
+
+        message = await socket.receive()
+        self.assertEqual(message, {'id': '1', 'type': 'next', 'payload': {
+            'data': {'orderCreated': {
+                'totalAmount': '5.00', 'customer': {'email': 'bob@example.com'},
+                'products': [{'name': 'Pen'}]}}}})
+        await socket.send({'type': 'complete', 'id': '1'})
+        await socket.send({'type': 'ping'})
+        self.assertEqual(await socket.receive(), {'type': 'pong'})
+        await socket.disconnect()
+        self.assertFalse(
+            pubsub.get_pubsub()._subscribers[pubsub.ORDER_CREATED])
+
+    async def test_low_stock_alert_only_when_stock_drops_below(self):
+        socket = FakeSocket()
+        await socket.connect()
+        await socket.subscribe('low', '''subscription {
+          lowStockAlert(threshold: 5) { name stock }
+        }''', pubsub.PRODUCT_STOCK_CHANGED)
+        await socket.subscribe('all', '''subscription {
+          productStockChanged { name }
+        }''', pubsub.PRODUCT_STOCK_CHANGED)
+
+        for name, stock in [('Plenty', 50), ('Scarce', 2)]:
+            await self.execute(
+                'mutation ($name: String!, $stock: Int) {'
+                ' createProduct(name: $name, price: 1, stock: $stock)'
+                ' { success } }', {'name': name, 'stock': stock})
+        messages = [await socket.receive() for _ in range(3)]
+        self.assertCountEqual(
+            [(message['id'], message['payload']['data'])
+             for message in messages], [
+                ('all', {'productStockChanged': {'name': 'Plenty'}}),
+                ('all', {'productStockChanged': {'name': 'Scarce'}}),
+                ('low', {'lowStockAlert': {'name': 'Scarce', 'stock': 2}}),
+            ])
+        await socket.disconnect()
+
+    @override_settings(CRM_PUBSUB={'BACKEND': 'crm.tests.BrokenPubSub'})
+    def test_a_failing_backend_does_not_fail_committed_writes(self):
+        customer = Customer.objects.create(name='Ann',
+                                           email='ann@example.com')
+        product = Product.objects.create(name='Pen', price=5, stock=3)
+        with self.assertLogs('crm.pubsub', 'ERROR'):
+            response = self.client.post('/graphql', {
+                'query': 'mutation ($customer: ID!, $products: [ID]!) {'
+                         ' createOrder(customerId: $customer,'
+                         ' productIds: $products) { success } }',
+                'variables': {'customer': customer.pk,
+                              'products': [product.pk]},
+            }, content_type='application/json').json()
+        self.assertNotIn('errors', response)
+        self.assertTrue(response['data']['createOrder']['success'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    async def test_protocol_errors(self):
+        socket = FakeSocket()
+        await socket.incoming.put({'type': 'websocket.connect'})
+        await socket.receive()
+        await socket.send({'type': 'subscribe', 'id': '1',
+                           'payload': {'query': '{ allRevenue }'}})
+        self.assertEqual((await socket.receive())['code'], 4401)
+
+        socket = FakeSocket()
+        await socket.connect()
+        await socket.send({'type': 'subscribe', 'id': '1',
+                           'payload': {'query': '{ allRevenue }'}})
+        self.assertEqual([await socket.receive() for _ in range(2)], [
+            {'id': '1', 'type': 'next',
+             'payload': {'data': {'allRevenue': 0.0}}},
+            {'id': '1', 'type': 'complete'},
+        ])
+        await socket.send({'type': 'subscribe', 'id': '2', 'payload': {
+            'query': 'subscription { orderCreated { nope } }'}})
+        message = await socket.receive()
+        self.assertEqual((message['id'], message['type']), ('2', 'error'))
+        await socket.disconnect()
+
+        response = await sync_to_async(self.client.post)(
+            '/graphql', {'query': 'subscription { orderCreated { id } }'},
+            content_type='application/json')
+        self.assertIn('WebSockets', response.json()['errors'][0]['message'])
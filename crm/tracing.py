@@ -0,0 +1,299 @@
+"""Per-request resolver and SQL tracing for the GraphQL endpoint.
+
+``TracingMiddleware`` times every resolver and a ``connection``
+execute wrapper charges each SQL query to the resolver that ran it. At the
+end of a request the trace is folded into process-wide counters (served in
+Prometheus text format by ``crm.views.metrics_view``), logged to the
+``crm.tracing`` logger and, when ``DEBUG`` is on, returned in the
+response's ``extensions``. Tracing and its log lines cost a lock and a
+timer per resolver, so they are only on by default when ``DEBUG`` is; in
+production they are opted into with ``CRM_TRACING``, optionally for a
+``SAMPLE_RATE`` fraction of the requests.
+"""
+import heapq
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+from . import persisted_queries, response_cache
+
+logger = logging.getLogger(__name__)
+
+# "IN (%s, %s, %s)" and "IN (%s)" are the same query template
+IN_LIST_RE = re.compile(r'\((?:%s, )*%s\)')
+
+UNATTRIBUTED = '(request)'
+
+
+def get_config():
+    config = {
+        'ENABLED': settings.DEBUG,
+        # fraction of the requests traced when enabled
+        'SAMPLE_RATE': 1.0,
+        'EXTENSIONS': settings.DEBUG,
+        'LOG': settings.DEBUG,
+        'N_PLUS_ONE_THRESHOLD': 5,
+        'SLOWEST': 10,
+    }
+    config.update(getattr(settings, 'CRM_TRACING', {}))
+    return config
+
+
+def _format_path(path):
+    if isinstance(path, str):
+        return path
+    return '.'.join(map(str, path.as_list()))
+
+
+def sql_template(sql):
+    return IN_LIST_RE.sub('(...)', sql)
+
+
+class FieldStats:
+    __slots__ = ('calls', 'seconds', 'queries', 'sql_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+class Trace:
+    def __init__(self, config):
+        self.config = config
+        self.started = time.perf_counter()
+        self.duration = None
+        self.fields = defaultdict(FieldStats)
+        self.slowest = []
+        self.templates = Counter()
+        self.template_fields = defaultdict(set)
+        self.queries = 0
+        self.sql_seconds = 0.0
+        # the async view runs root fields of one request in several threads
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        # coordinates of the resolvers currently running in this thread
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def enter(self, coordinate):
+        self._stack.append(coordinate)
+
+    def leave(self, coordinate, path, seconds):
+        self._stack.pop()
+        # paths are only formatted for the slowest entries, in as_dict()
+        entry = (seconds, id(path), path, coordinate)
+        with self._lock:
+            stats = self.fields[coordinate]
+            stats.calls += 1
+            stats.seconds += seconds
+            if len(self.slowest) < self.config['SLOWEST']:
+                heapq.heappush(self.slowest, entry)
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - started
+            stack = self._stack
+            coordinate = stack[-1] if stack else UNATTRIBUTED
+            template = sql_template(sql)
+            with self._lock:
+                stats = self.fields[coordinate]
+                stats.queries += 1
+                stats.sql_seconds += seconds
+                self.queries += 1
+                self.sql_seconds += seconds
+                self.templates[template] += 1
+                self.template_fields[template].add(coordinate)
+
+    @contextmanager
+    def record_sql(self):
+        """Charge the queries of this thread's connection to the trace."""
+        with connection.execute_wrapper(self.execute_wrapper):
+            yield
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+
+    @contextmanager
+    def capture(self):
+        with self.record_sql():
+            yield
+        self.stop()
+
+    def n_plus_one(self):
+        threshold = self.config['N_PLUS_ONE_THRESHOLD']
+        return [
+            {'sql': template, 'count': count,
+             'fields': sorted(self.template_fields[template])}
+            for template, count in self.templates.most_common()
+            if count > threshold
+        ]
+
+    def as_dict(self):
+        return {
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            'sql': {'count': self.queries,
+                    'duration_ms': round(self.sql_seconds * 1000, 3)},
+            'fields': {
+                coordinate: {
+                    'calls': stats.calls,
+                    'duration_ms': round(stats.seconds * 1000, 3),
+                    'sql_count': stats.queries,
+                    'sql_duration_ms': round(stats.sql_seconds * 1000, 3),
+                }
+                for coordinate, stats in sorted(self.fields.items())
+            },
+            'slowest': [
+                {'path': _format_path(path), 'field': coordinate,
+                 'duration_ms': round(seconds * 1000, 3)}
+                for seconds, _, path, coordinate in sorted(self.slowest,
+                                                           reverse=True)
+            ],
+            'n_plus_one': self.n_plus_one(),
+        }
+
+
+class TracingMiddleware:
+    """Graphene middleware timing each resolver of the request's trace."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def resolve(self, next, root, info, **args):
+        coordinate = f'{info.parent_type.name}.{info.field_name}'
+        self.trace.enter(coordinate)
+        started = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            self.trace.leave(coordinate, info.path,
+                             time.perf_counter() - started)
+
+
+class Registry:
+    """Process-wide totals of the finished traces."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.fields = defaultdict(FieldStats)
+        self.n_plus_one = Counter()
+
+    def record(self, trace):
+        with self._lock:
+            self.requests += 1
+            self.seconds += trace.duration or 0
+            for coordinate, stats in trace.fields.items():
+                total = self.fields[coordinate]
+                total.calls += stats.calls
+                total.seconds += stats.seconds
+                total.queries += stats.queries
+                total.sql_seconds += stats.sql_seconds
+            for problem in trace.n_plus_one():
+                for coordinate in problem['fields']:
+                    self.n_plus_one[coordinate] += 1
+
+    def render(self):
+        """The totals in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label = ','.join(f'{key}="{_escape(text)}"'
+                                 for key, text in labels.items())
+                lines.append(f'{name}{{{label}}} {value}' if label
+                             else f'{name} {value}')
+
+        with self._lock:
+            fields = sorted(self.fields.items())
+            metric('crm_graphql_requests_total', 'counter',
+                   'Traced GraphQL requests.', [({}, self.requests)])
+            metric('crm_graphql_request_seconds_total', 'counter',
+                   'Time spent executing traced requests.',
+                   [({}, self.seconds)])
+            metric('crm_graphql_resolver_calls_total', 'counter',
+                   'Resolver calls by field.',
+                   [({'field': name}, stats.calls) for name, stats in fields])
+            metric('crm_graphql_resolver_seconds_total', 'counter',
+                   'Time spent in resolvers by field.',
+                   [({'field': name}, stats.seconds)
+                    for name, stats in fields])
+            metric('crm_graphql_sql_queries_total', 'counter',
+                   'SQL queries by the field that ran them.',
+                   [({'field': name}, stats.queries)
+                    for name, stats in fields])
+            metric('crm_graphql_sql_seconds_total', 'counter',
+                   'SQL time by the field that ran it.',
+                   [({'field': name}, stats.sql_seconds)
+                    for name, stats in fields])
+            metric('crm_graphql_n_plus_one_total', 'counter',
+                   'Requests in which a field repeated one SQL template.',
+                   [({'field': name}, count)
+                    for name, count in sorted(self.n_plus_one.items())])
+
+        caches = {**persisted_queries.stats(),
+                  'responses': response_cache.metrics.snapshot()}
+        for kind in ('hits', 'misses'):
+            metric(f'crm_graphql_cache_{kind}_total', 'counter',
+                   f'GraphQL cache {kind}.',
+                   [({'cache': name}, counts[kind])
+                    for name, counts in sorted(caches.items())])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')
+
+
+registry = Registry()
+
+
+def start_trace(request):
+    """Begin tracing ``request``; None when tracing is disabled or the
+    request is not sampled."""
+    config = get_config()
+    if not config['ENABLED'] or random.random() >= config['SAMPLE_RATE']:
+        return None
+    trace = Trace(config)
+    request._crm_trace = trace
+    return trace
+
+
+def get_trace(request):
+    return getattr(request, '_crm_trace', None)
+
+
+def finish_trace(trace, result):
+    """Record ``trace`` and attach it to ``result`` if configured to."""
+    registry.record(trace)
+    summary = trace.as_dict()
+    if trace.config['LOG']:
+        level = logging.WARNING if summary['n_plus_one'] else logging.INFO
+        logger.log(level, json.dumps(summary))
+    if trace.config['EXTENSIONS']:
+        result.extensions = {**(result.extensions or {}), 'tracing': summary}
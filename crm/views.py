@@ -1,3 +1,547 @@
-from django.shortcuts import render
+import asyncio
+import json
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection, transaction
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import (
+    DocumentNode, ExecutionResult, FragmentDefinitionNode, GraphQLError,
+    OperationDefinitionNode, OperationType, SelectionSetNode, execute,
+    get_operation_ast, validate_schema,
+)
+from graphql.execution.collect_fields import collect_fields
+from graphql.execution.middleware import MiddlewareManager
+
+from . import health, response_cache, tracing
+from .bulk import IMPORTERS, import_records, iter_records
+from .cost import analyze_cost, get_limits
+from .export import EXPORTERS, ExportError, export_lines, gzip_chunks
+from .loaders import reset_loaders
+from .persisted_queries import (
+    PersistedQueryError, get_document, query_hash, resolve_persisted_query,
+    stats,
+)
+
+
+def request_format(request):
+    fmt = request.GET.get('format')
+    if fmt:
+        return fmt
+    if request.content_type == 'text/csv':
+        return 'csv'
+    return 'ndjson'
+
+
+# Streams an NDJSON or CSV body into the kind table, e.g.
+# curl -X POST --data-binary @orders.csv -H 'Content-Type: text/csv' \
+#     localhost:8000/import/orders
+@csrf_exempt
+@require_POST
+def import_view(request, kind):
+    if kind not in IMPORTERS:
+        return JsonResponse({'error': f'Unknown import kind: {kind}'},
+                            status=404)
+    fmt = request_format(request)
+    if fmt not in ('csv', 'ndjson'):
+        return JsonResponse({'error': f'Unsupported format: {fmt}'},
+                            status=400)
+    batch_size = request.GET.get('batch_size')
+    try:
+        batch_size = int(batch_size) if batch_size else None
+    except ValueError:
+        return JsonResponse({'error': 'batch_size must be an integer'},
+                            status=400)
+    # a chunk is never full below one row, so the whole body would be
+    # buffered; large sizes are capped by get_batch_size
+    if batch_size is not None and batch_size < 1:
+        return JsonResponse({'error': 'batch_size must be at least 1'},
+                            status=400)
+    # iterating the request reads the body line by line
+    report = import_records(kind, iter_records(request, fmt), batch_size)
+    return JsonResponse(report)
+
+
+# Streams the kind rows matching the filters of its GraphQL connection as
+# gzip-compressed NDJSON or CSV, e.g.
+# curl -o orders.csv.gz \
+#     'localhost:8000/export/orders?format=csv&order_date_gte=2025-01-01'
+# Send gzip=0 for an uncompressed body.
+@require_GET
+def export_view(request, kind):
+    if kind not in EXPORTERS:
+        return JsonResponse({'error': f'Unknown export kind: {kind}'},
+                            status=404)
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        return JsonResponse({'error': f'Unsupported format: {fmt}'},
+                            status=400)
+    filters = request.GET.copy()
+    for name in ('format', 'gzip'):
+        filters.pop(name, None)
+    try:
+        lines = export_lines(kind, fmt, filters)
+    except ExportError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f'{kind}.{fmt}'
+    if request.GET.get('gzip') == '0':
+        response = StreamingHttpResponse(
+            (line.encode('utf-8') for line in lines),
+            content_type=content_type)
+    else:
+        response = StreamingHttpResponse(gzip_chunks(lines),
+                                         content_type='application/gzip')
+        filename += '.gz'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def request_extensions(request, data):
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest(
+                'Extensions are invalid JSON.'))
+    return extensions if isinstance(extensions, dict) else None
+
+
+class Operation:
+    """A validated operation of one request, ready to execute."""
+
+    def __init__(self, schema, document, operation_ast, query, variables,
+                 operation_name, cost):
+        self.schema = schema
+        self.document = document
+        self.operation_ast = operation_ast
+        self.query = query
+        self.variables = variables
+        self.operation_name = operation_name
+        self.cost = cost
+        self.cache_policy = None
+        self.cache_key = None
+
+    @property
+    def is_mutation(self):
+        return (self.operation_ast is not None and
+                self.operation_ast.operation == OperationType.MUTATION)
+
+
+class CRMGraphQLView(GraphQLView):
+    """GraphQLView with persisted queries, a parsed-document cache, query
+    cost limits and the optional response cache.
+
+    Queries may be sent by sha256 hash alone (Automatic Persisted Queries)
+    and repeated query strings are executed from the cached, already
+    validated document instead of being parsed and validated again.
+    Operations over the ``crm.cost`` limits are rejected before execution
+    and the cost of the others is returned in ``extensions``, as is the
+    ``crm.tracing`` trace of the request in debug mode. With
+    ``CRM_RESPONSE_CACHE`` set, read-only queries are answered from
+    ``crm.response_cache`` until a write invalidates them.
+
+    A JSON list of operations is a batch, answered with a list of results.
+    Its operations run in order on one connection and share the request's
+    loaders; the batch's size and total cost are capped by
+    ``CRM_QUERY_LIMITS``.
+    """
+
+    # cost of the operations of this request's batch accepted so far
+    batch_cost = 0
+
+    def parse_body(self, request):
+        if self.get_content_type(request) == 'application/json':
+            self.batch = request.body.lstrip()[:1] == b'['
+        data = super().parse_body(request)
+        if self.batch:
+            limit = get_limits()['MAX_BATCH_SIZE']
+            if len(data) > limit:
+                raise HttpError(HttpResponseBadRequest(
+                    f'A batch may hold at most {limit} operations.'))
+        return data
+
+    def prepare_operation(self, request, data, query, variables,
+                          operation_name, show_graphiql=False):
+        """Everything before execution. Returns an ``Operation``, or the
+        ``ExecutionResult`` (or None, for GraphiQL) to respond with."""
+        try:
+            query = resolve_persisted_query(
+                query, request_extensions(request, data))
+        except PersistedQueryError as error:
+            return ExecutionResult(errors=[error])
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest(
+                'Must provide query string.'))
+
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        document, errors = get_document(
+            schema, query, self.validation_rules,
+            graphene_settings.MAX_VALIDATION_ERRORS)
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (request.method.lower() == 'get' and operation_ast is not None
+                and operation_ast.operation != OperationType.QUERY):
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ['POST'],
+                f'Can only perform a {operation_ast.operation.value} '
+                f'operation from a POST request.'))
+        if (operation_ast is not None
+                and operation_ast.operation == OperationType.SUBSCRIPTION):
+            return ExecutionResult(errors=[GraphQLError(
+                'Subscriptions are served over WebSockets, using the '
+                'graphql-transport-ws protocol.', operation_ast)])
+
+        cost = None
+        if operation_ast is not None:
+            cost = analyze_cost(schema, document, operation_ast, variables)
+            if cost.errors:
+                return ExecutionResult(
+                    errors=cost.errors, extensions={'cost': cost.as_dict()})
+            if self.batch:
+                limit = cost.limits['MAX_BATCH_COST']
+                if self.batch_cost + cost.cost > limit:
+                    return ExecutionResult(errors=[GraphQLError(
+                        f'The operations of this batch exceed its maximum '
+                        f'cost of {limit}.', operation_ast,
+                        extensions={'code': 'BATCH_TOO_COMPLEX'})],
+                        extensions={'cost': cost.as_dict()})
+                self.batch_cost += cost.cost
+        return Operation(schema, document, operation_ast, query, variables,
+                         operation_name, cost)
+
+    def cached_result(self, request, operation):
+        policy = response_cache.get_policy(
+            operation.schema, operation.document, operation.operation_ast,
+            query_hash(operation.query))
+        if policy is None:
+            return None
+        operation.cache_policy = policy
+        operation.cache_key = response_cache.cache_key(
+            policy, operation.variables, operation.operation_name, request)
+        data = response_cache.get_result(operation.cache_key)
+        return ExecutionResult(data=data) if data is not None else None
+
+    def finish_operation(self, operation, result):
+        if operation.cache_policy is not None and not result.errors:
+            response_cache.set_result(operation.cache_key,
+                                      operation.cache_policy, result.data)
+        if operation.cost is not None:
+            result.extensions = {**(result.extensions or {}),
+                                 'cost': operation.cost.as_dict()}
+        return result
+
+    def execute_graphql_request(self, request, data, query, variables,
+                                operation_name, show_graphiql=False):
+        operation = self.prepare_operation(
+            request, data, query, variables, operation_name, show_graphiql)
+        if not isinstance(operation, Operation):
+            return operation
+        result = self.cached_result(request, operation)
+        if result is not None:
+            return self.finish_operation(operation, result)
+
+        trace = tracing.start_trace(request)
+        if trace is None:
+            result = self.execute_operation(request, operation)
+        else:
+            with trace.capture():
+                result = self.execute_operation(request, operation,
+                                                trace=trace)
+            tracing.finish_trace(trace, result)
+        return self.finish_operation(operation, result)
+
+    def execute_operation(self, request, operation, document=None,
+                          context=None, trace=None):
+        if context is None:
+            context = self.get_context(request)
+        execute_options = {
+            'root_value': self.get_root_value(request),
+            'context_value': context,
+            'variable_values': operation.variables,
+            'operation_name': operation.operation_name,
+            'middleware': self.get_middleware(request, trace),
+        }
+        if self.execution_context_class:
+            execute_options['execution_context_class'] = (
+                self.execution_context_class)
+        schema = operation.schema
+        document = document or operation.document
+        try:
+            if operation.is_mutation and (
+                    graphene_settings.ATOMIC_MUTATIONS is True or
+                    connection.settings_dict.get('ATOMIC_MUTATIONS') is True):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+            return execute(schema, document, **execute_options)
+        except Exception as error:
+            return ExecutionResult(errors=[error])
+        finally:
+            if operation.is_mutation:
+                # later operations of the batch must not be served rows
+                # loaded before the mutation changed them
+                reset_loaders(context)
+
+    def get_middleware(self, request, trace=None):
+        middleware = self.middleware
+        if trace is None:
+            return middleware
+        if isinstance(middleware, MiddlewareManager):
+            middleware = middleware.middlewares
+        return [*(middleware or ()), tracing.TracingMiddleware(trace)]
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(
+            request, data)
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql)
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+        if execution_result and execution_result.errors:
+            set_rollback()
+        return self.encode_result(request, execution_result, id,
+                                  show_graphiql)
+
+    def encode_result(self, request, execution_result, id=None,
+                      show_graphiql=False):
+        # GraphQLView.get_response's encoding, plus the result's extensions
+        if not execution_result:
+            return None, 200
+        status_code = 200
+        response = {}
+        if execution_result.errors:
+            response['errors'] = [self.format_error(error)
+                                  for error in execution_result.errors]
+        if execution_result.errors and any(
+                not getattr(error, 'path', None)
+                for error in execution_result.errors):
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+        if execution_result.extensions:
+            response['extensions'] = execution_result.extensions
+        if self.batch:
+            response['id'] = id
+            response['status'] = status_code
+        return (self.json_encode(request, response, pretty=show_graphiql),
+                status_code)
+
+
+def split_root_fields(operation):
+    """One document per root response key of a query operation, so that
+    each can be executed independently."""
+    operation_ast = operation.operation_ast
+    fragments = [definition for definition in operation.document.definitions
+                 if isinstance(definition, FragmentDefinitionNode)]
+    root_fields = collect_fields(
+        operation.schema,
+        {fragment.name.value: fragment for fragment in fragments},
+        operation.variables or {}, operation.schema.query_type,
+        operation_ast.selection_set)
+    return [
+        DocumentNode(definitions=(OperationDefinitionNode(
+            operation=operation_ast.operation,
+            name=operation_ast.name,
+            variable_definitions=operation_ast.variable_definitions,
+            directives=operation_ast.directives,
+            selection_set=SelectionSetNode(selections=tuple(field_nodes)),
+        ), *fragments))
+        for field_nodes in root_fields.values()
+    ]
+
+
+def merge_results(results):
+    data = {}
+    errors = []
+    extensions = {}
+    for result in results:
+        if result.data is None:
+            data = None
+        elif data is not None:
+            data.update(result.data)
+        errors.extend(result.errors or ())
+        extensions.update(result.extensions or {})
+    return ExecutionResult(data=data, errors=errors or None,
+                           extensions=extensions or None)
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """``CRMGraphQLView`` for ASGI servers.
+
+    The view itself runs on the event loop and the ORM and cache work
+    (persisted queries, cached responses) in Django's thread pool, so a
+    request waiting on the database or a network cache holds no worker.
+    The root fields of a query are independent, so each one is executed
+    in its own thread (with its own database connection) and they resolve
+    concurrently; mutations keep their serial semantics in a single one.
+    The queries of a batch run concurrently too, still sharing the
+    request's loaders, while each mutation waits for the operations before
+    it and is waited for by those after it.
+    """
+
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ('get', 'post'):
+                raise HttpError(HttpResponseNotAllowed(
+                    ['GET', 'POST'],
+                    'GraphQL only supports GET and POST requests.'))
+            data = self.parse_body(request)
+            if self.graphiql and self.can_display_graphiql(request, data):
+                # a static page, no database access
+                return super().dispatch(request, *args, **kwargs)
+
+            if self.batch:
+                responses = await self.aget_batch_responses(request, data)
+                result = '[{}]'.format(
+                    ','.join(response[0] for response in responses))
+                status_code = max(
+                    (response[1] for response in responses), default=200)
+            else:
+                result, status_code = await self.aget_response(request, data)
+            return HttpResponse(status=status_code, content=result,
+                                content_type='application/json')
+        except HttpError as error:
+            response = error.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(
+                request, {'errors': [self.format_error(error)]})
+            return response
+
+    async def aget_response(self, request, data):
+        query, variables, operation_name, id = self.get_graphql_params(
+            request, data)
+        execution_result = await self.aexecute_graphql_request(
+            request, data, query, variables, operation_name)
+        return self.encode_result(request, execution_result, id)
+
+    async def aget_batch_responses(self, request, entries):
+        operations = []
+        for entry in entries:
+            query, variables, operation_name, id = self.get_graphql_params(
+                request, entry)
+            operations.append((id, await sync_to_async(
+                self.prepare_operation)(
+                    request, entry, query, variables, operation_name)))
+
+        results = []
+        queries = []
+        for _, operation in operations:
+            if isinstance(operation, Operation) and operation.is_mutation:
+                results += await asyncio.gather(*queries)
+                queries = []
+                results.append(await self.aexecute_operation(request,
+                                                             operation))
+            else:
+                queries.append(self.aexecute_operation(request, operation))
+        results += await asyncio.gather(*queries)
+        return [self.encode_result(request, result, id)
+                for (id, _), result in zip(operations, results)]
+
+    async def aexecute_graphql_request(self, request, data, query, variables,
+                                       operation_name):
+        # the persisted query store may be a network cache
+        operation = await sync_to_async(self.prepare_operation)(
+            request, data, query, variables, operation_name)
+        return await self.aexecute_operation(request, operation)
+
+    async def aexecute_operation(self, request, operation):
+        """Run a prepared operation; anything else from
+        ``prepare_operation`` is already the result."""
+        if not isinstance(operation, Operation):
+            return operation
+        result = await sync_to_async(self.cached_result)(request, operation)
+        if result is not None:
+            return await sync_to_async(self.finish_operation)(operation,
+                                                               result)
+
+        trace = tracing.start_trace(request)
+        operation_ast = operation.operation_ast
+        if (operation_ast is None or
+                operation_ast.operation != OperationType.QUERY):
+            result = await self.run_in_thread(
+                trace, self.execute_operation, request, operation, None,
+                None, trace)
+        else:
+            documents = split_root_fields(operation)
+            results = await asyncio.gather(*(
+                self.run_in_thread(
+                    trace, self.execute_operation, request, operation,
+                    document, None, trace)
+                for document in documents))
+            result = merge_results(results)
+        if trace is not None:
+            trace.stop()
+            tracing.finish_trace(trace, result)
+        return await sync_to_async(self.finish_operation)(operation, result)
+
+    @staticmethod
+    def run_in_thread(trace, func, *args):
+        def call():
+            try:
+                if trace is None:
+                    return func(*args)
+                with trace.record_sql():
+                    return func(*args)
+            finally:
+                # pool threads outlive the request; do not leak connections
+                close_old_connections()
+        return sync_to_async(call, thread_sensitive=False)()
+
+
+def metrics_view(request):
+    """GraphQL request, resolver, SQL and cache counters of this process
+    for a Prometheus scrape."""
+    return HttpResponse(tracing.registry.render(),
+                        content_type='text/plain; version=0.0.4')
+
+
+def graphql_cache_stats(request):
+    """Hit and miss counts of this process's GraphQL caches."""
+    return JsonResponse({**stats(),
+                         'responses': response_cache.metrics.snapshot()})
+
+
+def health_response(names):
+    payload = health.run_checks(names)
+    return JsonResponse(payload,
+                        status=200 if payload['status'] == 'ok' else 503)
+
+
+@never_cache
+@require_GET
+def healthz(request):
+    """Liveness: the process answers and can execute GraphQL."""
+    return health_response(health.LIVENESS)
+
+
+@never_cache
+@require_GET
+def readyz(request):
+    """Readiness: GraphQL, the database and the Celery broker answer."""
+    return health_response(health.READINESS)
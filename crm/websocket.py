@@ -0,0 +1,217 @@
+"""GraphQL over WebSockets for the ASGI application.
+
+Speaks the ``graphql-transport-ws`` protocol of the graphql-ws client:
+after ``connection_init``/``connection_ack`` the client sends ``subscribe``
+messages and the server answers each with ``next`` results until
+``complete``. Subscription events come from ``crm.pubsub``; every event is
+executed in Django's thread pool, so resolvers may use the ORM as usual.
+Queries and mutations sent over the socket get a single ``next``.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from graphene_django.settings import graphene_settings
+from graphql import (
+    ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast,
+)
+from graphql.execution import create_source_event_stream
+
+from .cost import analyze_cost
+from .persisted_queries import get_document
+
+PROTOCOL = 'graphql-transport-ws'
+
+# seconds a client may take to send connection_init
+CONNECTION_INIT_TIMEOUT = 10
+
+
+class SocketContext:
+    """``info.context`` of an operation run over a WebSocket."""
+
+    def __init__(self, scope, connection_params):
+        self.scope = scope
+        self.connection_params = connection_params
+        self.user = scope.get('user')
+
+
+def _run_sync(func, *args, **kwargs):
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+class GraphQLWebSocket:
+    def __init__(self, schema, scope, receive, send):
+        self.schema = schema
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.acknowledged = False
+        self.connection_params = None
+        self.operations = {}
+
+    async def send_json(self, message):
+        await self.send({'type': 'websocket.send',
+                         'text': json.dumps(message, cls=DjangoJSONEncoder)})
+
+    async def close(self, code, reason=''):
+        await self.send({'type': 'websocket.close', 'code': code,
+                         'reason': reason})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if PROTOCOL not in self.scope.get('subprotocols', []):
+            await self.send({'type': 'websocket.close', 'code': 4406})
+            return
+        await self.send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+
+        init_timeout = asyncio.get_running_loop().call_later(
+            CONNECTION_INIT_TIMEOUT, self._init_timed_out)
+        try:
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if not await self.handle(message.get('text') or
+                                         message.get('bytes')):
+                    break
+        finally:
+            init_timeout.cancel()
+            for task in self.operations.values():
+                task.cancel()
+
+    def _init_timed_out(self):
+        if not self.acknowledged:
+            asyncio.ensure_future(self.close(
+                4408, 'Connection initialisation timeout'))
+
+    async def handle(self, raw):
+        """Handle one client message; False once the socket was closed."""
+        try:
+            message = json.loads(raw)
+            kind = message['type']
+        except (TypeError, ValueError, KeyError):
+            await self.close(4400, 'Invalid message')
+            return False
+
+        if kind == 'connection_init':
+            if self.acknowledged:
+                await self.close(4429, 'Too many initialisation requests')
+                return False
+            self.acknowledged = True
+            self.connection_params = message.get('payload') or {}
+            await self.send_json({'type': 'connection_ack'})
+        elif kind == 'ping':
+            await self.send_json({'type': 'pong'})
+        elif kind == 'pong':
+            pass
+        elif kind == 'subscribe':
+            if not self.acknowledged:
+                await self.close(4401, 'Unauthorized')
+                return False
+            id = message.get('id')
+            if id in self.operations:
+                await self.close(4409, f'Subscriber for {id} already exists')
+                return False
+            self.operations[id] = asyncio.ensure_future(
+                self.run_operation(id, message.get('payload') or {}))
+        elif kind == 'complete':
+            task = self.operations.pop(message.get('id'), None)
+            if task:
+                task.cancel()
+        else:
+            await self.close(4400, f'Unknown message type {kind}')
+            return False
+        return True
+
+    async def run_operation(self, id, payload):
+        try:
+            await self._run_operation(id, payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            await self.send_json({'id': id, 'type': 'error',
+                                  'payload': [{'message': str(error)}]})
+        else:
+            if self.operations.pop(id, None) is not None:
+                await self.send_json({'id': id, 'type': 'complete'})
+            return
+        self.operations.pop(id, None)
+
+    async def _run_operation(self, id, payload):
+        schema = self.schema.graphql_schema
+        variables = payload.get('variables')
+        operation_name = payload.get('operationName')
+        document, errors = get_document(
+            schema, payload.get('query') or '', None,
+            graphene_settings.MAX_VALIDATION_ERRORS)
+        operation_ast = document and get_operation_ast(document,
+                                                       operation_name)
+        if not errors and operation_ast is None:
+            errors = [GraphQLError('Unknown operation.')]
+        if not errors:
+            errors = analyze_cost(schema, document, operation_ast,
+                                  variables).errors
+        if errors:
+            await self.send_json({'id': id, 'type': 'error', 'payload': [
+                error.formatted for error in errors]})
+            self.operations.pop(id, None)
+            return
+
+        options = {'variable_values': variables,
+                   'operation_name': operation_name}
+        if operation_ast.operation != OperationType.SUBSCRIPTION:
+            result = await _run_sync(
+                execute, schema, document,
+                context_value=SocketContext(self.scope,
+                                            self.connection_params),
+                **options)
+            await self.send_result(id, result)
+            return
+
+        stream = await create_source_event_stream(
+            schema, document,
+            context_value=SocketContext(self.scope, self.connection_params),
+            **options)
+        if isinstance(stream, ExecutionResult):
+            await self.send_json({'id': id, 'type': 'error', 'payload': [
+                error.formatted for error in stream.errors]})
+            self.operations.pop(id, None)
+            return
+        try:
+            async for event in stream:
+                # a fresh context per event, so loaders never serve rows
+                # cached by an earlier one
+                result = await _run_sync(
+                    execute, schema, document, root_value=event,
+                    context_value=SocketContext(self.scope,
+                                                self.connection_params),
+                    **options)
+                await self.send_result(id, result)
+        finally:
+            await stream.aclose()
+
+    async def send_result(self, id, result):
+        payload = {'data': result.data}
+        if result.errors:
+            payload['errors'] = [error.formatted for error in result.errors]
+        await self.send_json({'id': id, 'type': 'next', 'payload': payload})
+
+
+def graphql_ws_application(schema, path='/graphql'):
+    """An ASGI application serving ``schema`` on WebSockets at ``path``."""
+    async def application(scope, receive, send):
+        if scope['path'].rstrip('/') != path:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        await GraphQLWebSocket(schema, scope, receive, send).run()
+    return application
@@ -0,0 +1,169 @@
+"""Celery worker profiles for the CRM queues, and a local benchmark of
+their throughput.
+
+Each profile names the queues a worker consumes and its pool, concurrency
+and prefetch multiplier; ``manage.py celery_worker <profile>`` starts one.
+Long, CPU-bound report shards and imports run with a prefetch of one, so
+no task waits behind a slow one already reserved by a busy process; the
+short, I/O-bound notifications run on many threads with a deeper prefetch.
+Profiles are overridden or added with ``CRM_CELERY_WORKERS``.
+
+The benchmark pushes a burst of synthetic tasks through an in-memory
+broker to workers running in this process. Every execution slot of a
+profile is a solo worker with the profile's prefetch, which reserves and
+runs tasks like a slot of a prefork or thread pool does; task bodies sleep
+for their duration, so the numbers show queueing, not the speed of the
+pool.
+"""
+import contextlib
+import random
+import statistics
+import threading
+import time
+
+from celery import Celery, current_app
+from celery.contrib.testing.worker import start_worker
+from django.conf import settings
+
+from .celery import QUEUES
+
+WORKER_PROFILES = {
+    'default': {'queues': ['default'], 'pool': 'prefork',
+                'concurrency': 4, 'prefetch_multiplier': 4},
+    'reports': {'queues': ['reports'], 'pool': 'prefork',
+                'concurrency': 2, 'prefetch_multiplier': 1},
+    'notifications': {'queues': ['notifications'], 'pool': 'threads',
+                      'concurrency': 16, 'prefetch_multiplier': 4},
+    # imports hold a lot of memory; recycle the processes now and then
+    'bulk': {'queues': ['bulk'], 'pool': 'prefork', 'concurrency': 2,
+             'prefetch_multiplier': 1, 'max_tasks_per_child': 50},
+    # every queue in one worker, for development
+    'all': {'queues': list(QUEUES), 'pool': 'prefork', 'concurrency': 4,
+            'prefetch_multiplier': 1},
+}
+
+# task durations in milliseconds of the work each queue sees
+WORKLOADS = {
+    'default': lambda rng: rng.uniform(1, 10),
+    'reports': lambda rng: rng.uniform(20, 60),
+    'notifications': lambda rng: rng.uniform(2, 10),
+    # mostly small chunks, now and then a large file
+    'bulk': lambda rng: 200 if rng.random() < 0.1 else rng.uniform(5, 20),
+}
+
+
+def get_profiles():
+    return {**WORKER_PROFILES, **getattr(settings, 'CRM_CELERY_WORKERS', {})}
+
+
+def worker_argv(name, loglevel='info'):
+    """``celery worker`` arguments of the profile ``name``."""
+    profile = get_profiles()[name]
+    argv = [
+        'worker', f'--hostname={name}@%h', f'--loglevel={loglevel}',
+        f"--queues={','.join(profile['queues'])}",
+        f"--pool={profile['pool']}",
+        f"--concurrency={profile['concurrency']}",
+        f"--prefetch-multiplier={profile['prefetch_multiplier']}",
+    ]
+    if profile.get('max_tasks_per_child'):
+        argv.append(
+            f"--max-tasks-per-child={profile['max_tasks_per_child']}")
+    return argv
+
+
+class Run:
+    """Counts the finished tasks of one benchmark run."""
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.waits = []
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def finished(self, wait):
+        with self._lock:
+            self.waits.append(wait)
+            if len(self.waits) == self.tasks:
+                self.done.set()
+
+
+def benchmark_app():
+    app = Celery('crm-benchmark', broker='memory://localhost/',
+                 set_as_current=False)
+    app.conf.update(
+        task_ignore_result=True,
+        # the synthetic tasks are acked late, like the long CRM tasks
+        task_acks_late=True,
+        worker_hijack_root_logger=False,
+        broker_transport_options={'polling_interval': 0.001},
+    )
+    runs = {}
+
+    @app.task(name='crm.benchmark.work')
+    def work(run_id, ms, enqueued):
+        wait = time.perf_counter() - enqueued
+        time.sleep(ms / 1000)
+        runs[run_id].finished(wait)
+
+    return app, work, runs
+
+
+def measure(app, work, runs, profile, durations, timeout=60):
+    run_id = len(runs)
+    run = runs[run_id] = Run(len(durations))
+    slots = profile['concurrency']
+    queue = profile['queues'][0]
+    with contextlib.ExitStack() as stack:
+        for slot in range(slots):
+            stack.enter_context(start_worker(
+                app, pool='solo', concurrency=1, queues=[queue],
+                prefetch_multiplier=profile['prefetch_multiplier'],
+                perform_ping_check=False, loglevel='WARNING',
+                hostname=f'bench{run_id}-{slot}@localhost'))
+        started = time.perf_counter()
+        for ms in durations:
+            work.apply_async((run_id, ms, time.perf_counter()), queue=queue)
+        if not run.done.wait(timeout):
+            raise RuntimeError(f'{len(run.waits)} of {run.tasks} tasks '
+                               f'finished within {timeout}s')
+        seconds = time.perf_counter() - started
+    waits = sorted(wait * 1000 for wait in run.waits)
+    return {
+        'tasks': len(durations),
+        'seconds': seconds,
+        'throughput': len(durations) / seconds,
+        'p50_wait_ms': waits[len(waits) // 2],
+        'p95_wait_ms': waits[int(len(waits) * 0.95)],
+        'mean_task_ms': statistics.fmean(durations),
+    }
+
+
+def run_benchmark(tasks, profiles=None, workload=None, seed=0, log=print):
+    """Throughput of every profile over ``tasks`` synthetic tasks of its
+    first queue's workload, or of ``workload`` to compare the profiles on
+    the same work."""
+    available = get_profiles()
+    app, work, runs = benchmark_app()
+    # starting a worker makes its app the current one
+    previous = current_app._get_current_object()
+    results = {}
+    try:
+        for name in profiles or available:
+            profile = available[name]
+            kind = workload or profile['queues'][0]
+            rng = random.Random(seed)
+            durations = [WORKLOADS.get(kind, WORKLOADS['default'])(rng)
+                         for _ in range(tasks)]
+            stats = measure(app, work, runs, profile, durations)
+            results[name] = {'workload': kind, **stats}
+            log(f"{name} [{kind}]: {stats['throughput']:.0f} tasks/s, "
+                f"wait p50 {stats['p50_wait_ms']:.1f} ms, "
+                f"p95 {stats['p95_wait_ms']:.1f} ms "
+                f"({profile['concurrency']} x prefetch "
+                f"{profile['prefetch_multiplier']})")
+    finally:
+        previous.set_current()
+        previous.set_default()
+    return results
+
@@ -1,5 +1,6 @@
 import graphene
 from crm.schema import Query as CRMQuery, Mutation as CRMMutation
+from crm.schema import Subscription as CRMSubscription
 
 
 class Query(CRMQuery, graphene.ObjectType):
@@ -10,4 +11,9 @@ class Mutation(CRMMutation, graphene.ObjectType):
     pass
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(CRMSubscription, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation,
+                         subscription=Subscription)
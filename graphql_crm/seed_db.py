@@ -1,51 +1,194 @@
 # seed_db.py
+#
+# Deterministic synthetic CRM data at any scale, e.g.
+#   python manage.py seed_crm --customers 100000 --orders 2000000
+# or from a shell:
+#   from graphql_crm.seed_db import run; run(orders=50000)
+#
+# The same seed and end date always produce the same rows. Product
+# popularity and customer activity follow Zipf distributions, and order
+# dates are bursty (weekly seasonality, busy hours and random sale days).
 
-from crm.models import Customer, Product, Order
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
 from django.utils import timezone
 
+from crm.bulk import chunked
+from crm.models import (Customer, CustomerRevenue, DailyRevenue, Order,
+                        OrderItem, Product)
+from crm.response_cache import invalidate
+from crm.revenue import rebuild_summaries
+
+FIRST_NAMES = [
+    'Alice', 'Bob', 'Carol', 'David', 'Eve', 'Frank', 'Grace', 'Heidi',
+    'Ivan', 'Judy', 'Mallory', 'Niaj', 'Olivia', 'Peggy', 'Rupert', 'Sybil',
+    'Trent', 'Victor', 'Walter', 'Amara', 'Chidi', 'Femi', 'Ngozi', 'Tunde',
+    'Yusuf', 'Zainab', 'Kemi', 'Emeka', 'Ada', 'Bola',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Brown', 'Garcia', 'Miller', 'Davis', 'Okafor',
+    'Adeyemi', 'Balogun', 'Eze', 'Nwosu', 'Bello', 'Lopez', 'Wilson',
+    'Taylor', 'Moore', 'Martin', 'Lee', 'Walker', 'Hall',
+]
+PRODUCT_WORDS = [
+    'Laptop', 'Mouse', 'Keyboard', 'Monitor', 'Headset', 'Webcam', 'Cable',
+    'Charger', 'Speaker', 'Tablet', 'Phone', 'Router', 'Drive', 'Printer',
+    'Camera', 'Watch', 'Lamp', 'Desk', 'Chair', 'Bag',
+]
+PRODUCT_ADJECTIVES = [
+    'Pro', 'Mini', 'Ultra', 'Max', 'Lite', 'Plus', 'Air', 'Classic', 'Eco',
+    'Smart',
+]
+# relative order volume for each hour of the day (UTC)
+HOURLY_WEIGHTS = [
+    1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 8, 9, 10, 9, 8, 8, 9, 10, 12, 12, 10, 7,
+    4, 2,
+]
+
+
+def zipf_cum_weights(n, s):
+    """Cumulative Zipf(s) weights for ranks 1..n, for ``rng.choices``."""
+    return list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def day_cum_weights(rng, start, days, burst_rate=0.04):
+    # weekends are busier, and a few sale days get 5-20x the usual volume
+    weights = []
+    for day in range(days):
+        weekday = (start + timedelta(days=day)).weekday()
+        weight = 1.4 if weekday in (5, 6) else 1.0
+        if rng.random() < burst_rate:
+            weight *= rng.uniform(5, 20)
+        weights.append(weight)
+    return list(accumulate(weights))
+
+
+def make_phone(rng):
+    kind = rng.random()
+    if kind < 0.15:
+        return None
+    digits = ''.join(rng.choice('0123456789') for _ in range(10))
+    if kind < 0.6:
+        return f'+1{digits}'
+    if kind < 0.85:
+        return f'{digits[:3]}-{digits[3:6]}-{digits[6:]}'
+    return digits
+
+
+def reset_tables():
+    # flush instead of delete(): no per-row signals or cascades to collect
+    models = [OrderItem, Order, DailyRevenue, CustomerRevenue,
+              Customer, Product]
+    tables = [model._meta.db_table for model in models]
+    connection.ops.execute_sql_flush(connection.ops.sql_flush(
+        no_style(), tables, reset_sequences=True))
+
+
+def generate_customers(rng, count, start, end, batch_size):
+    span = int((end - start).total_seconds())
+    # keep emails unique when adding to existing data
+    offset = Customer.objects.count()
+    for chunk in chunked(range(offset, offset + count), batch_size):
+        customers = []
+        for i in chunk:
+            first = rng.choice(FIRST_NAMES)
+            last = rng.choice(LAST_NAMES)
+            customers.append(Customer(
+                name=f'{first} {last}',
+                email=f'{first}.{last}{i}@example.com'.lower(),
+                phone=make_phone(rng),
+                created_at=start + timedelta(seconds=rng.randrange(span)),
+            ))
+        Customer.objects.bulk_create(customers)
+
+
+def generate_products(rng, count, batch_size):
+    for chunk in chunked(range(count), batch_size):
+        Product.objects.bulk_create(
+            Product(
+                name=(f'{rng.choice(PRODUCT_ADJECTIVES)} '
+                      f'{rng.choice(PRODUCT_WORDS)} {i}'),
+                price=round(min(rng.lognormvariate(3.5, 1.0), 9999), 2),
+                # about a tenth of the catalogue is low on stock
+                stock=rng.randint(0, 9) if rng.random() < 0.1
+                else rng.randint(10, 500),
+            )
+            for i in chunk)
+
+
+def generate_orders(rng, count, start, days, batch_size, zipf_s, max_items):
+    customer_ids = list(Customer.objects.order_by('id')
+                        .values_list('id', flat=True))
+    products = list(Product.objects.order_by('id').values_list('id', 'price'))
+    # popularity ranks are shuffled so popular products are spread out
+    rng.shuffle(customer_ids)
+    rng.shuffle(products)
+    customer_weights = zipf_cum_weights(len(customer_ids), zipf_s * 0.7)
+    product_weights = zipf_cum_weights(len(products), zipf_s)
+    day_weights = day_cum_weights(rng, start, days)
+    hour_weights = list(accumulate(HOURLY_WEIGHTS))
+
+    for chunk in chunked(range(count), batch_size):
+        orders = []
+        items = []
+        for _ in chunk:
+            picked = set(rng.choices(
+                range(len(products)), cum_weights=product_weights,
+                k=min(int(rng.expovariate(0.8)) + 1, max_items)))
+            day = rng.choices(range(days), cum_weights=day_weights)[0]
+            hour = rng.choices(range(24), cum_weights=hour_weights)[0]
+            orders.append(Order(
+                customer_id=rng.choices(
+                    customer_ids, cum_weights=customer_weights)[0],
+                order_date=start + timedelta(
+                    days=day, hours=hour, seconds=rng.randrange(3600)),
+                total_amount=sum(products[i][1] for i in picked),
+            ))
+            items.append(sorted(products[i] for i in picked))
+        with transaction.atomic():
+            Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create([
+                OrderItem(order_id=order.pk, product_id=product_id,
+                          unit_price=price, line_total=price)
+                for order, order_items in zip(orders, items)
+                for product_id, price in order_items
+            ])
+
+
+def run(customers=3, products=2, orders=1, seed=0, days=365, end=None,
+        batch_size=5000, zipf_s=1.1, max_items=5, reset=True, log=print):
+    """Generate ``customers``, ``products`` and ``orders`` rows.
+
+    Orders fall within the ``days`` days before ``end`` (default: today,
+    UTC midnight). Rows are written with chunked ``bulk_create`` and the
+    revenue summaries are rebuilt once at the end.
+    """
+    if end is None:
+        end = timezone.now().replace(hour=0, minute=0, second=0,
+                                     microsecond=0)
+    elif not isinstance(end, datetime):
+        end = timezone.make_aware(datetime.combine(end, datetime.min.time()))
+    start = end - timedelta(days=days)
+    rng = random.Random(seed)
+    if orders and not (customers or (not reset and Customer.objects.exists())):
+        raise ValueError('Orders need at least one customer.')
+    if orders and not (products or (not reset and Product.objects.exists())):
+        raise ValueError('Orders need at least one product.')
 
-def run():
-
-    Customer.objects.all().delete()
-
-    # Create a single customer
-    alice = Customer.objects.create(
-        name="Alice",
-        email="alice@example.com",
-        phone="+1234567890"
-    )
-
-    # Bulk create customers
-    bob = Customer.objects.create(
-        name="Bob",
-        email="bob@example.com",
-        phone="123-456-7890"
-    )
-    carol = Customer.objects.create(
-        name="Carol",
-        email="carol@example.com"
-        # phone is optional
-    )
-
-    # Create products
-    laptop = Product.objects.create(
-        name="Laptop",
-        price=999.99,
-        stock=10
-    )
-    mouse = Product.objects.create(
-        name="Mouse",
-        price=49.99,
-        stock=50
-    )
-
-    # Create an order for Alice with Laptop and Mouse
-    order = Order.objects.create(
-        customer=alice,
-        order_date=timezone.now()
-    )
-    order.products.set([laptop, mouse])
-    order.total_amount = laptop.price + mouse.price
-    order.save()
-
-    print("✅ Database seeded successfully.")
+    if reset:
+        reset_tables()
+    started = time.monotonic()
+    generate_customers(rng, customers, start, end, batch_size)
+    log(f'{customers} customers in {time.monotonic() - started:.1f}s')
+    generate_products(rng, products, batch_size)
+    log(f'{products} products in {time.monotonic() - started:.1f}s')
+    generate_orders(rng, orders, start, days, batch_size, zipf_s, max_items)
+    log(f'{orders} orders in {time.monotonic() - started:.1f}s')
+    rebuild_summaries()
+    invalidate('customer', 'product', 'order')
+    log(f'✅ Database seeded successfully in {time.monotonic() - started:.1f}s.')